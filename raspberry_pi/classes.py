@@ -1,6 +1,16 @@
+import time
+import copy
+import heapq
+import itertools
+import asyncio
+import inspect
+import os
+import select
+import threading
 import numpy as np
 import modern_robotics as mr
-from typing import List
+from contextlib import contextmanager, nullcontext
+from typing import List, Callable, Tuple, Any
 
 class Link():
     def __init__(self, inertiaMat: np.ndarray, mass: float, prevLink: 'Link',
@@ -99,13 +109,257 @@ class Robot():
         TiEF = np.dot(mr.TransInv(links[-1].Tsi), TsbHome)
         self.TllList.append(TiEF)
         self.TsbHome: np.ndarray = self.TllList[-1]
-    
+        self.compiled: "CompiledRobot" = None
+        self.kinCache: "KinematicsCache" = None
+
     def __repr__(self):
         return f"Robot:(joints: {self.joints}\nscrewAxes: " +\
                f"{self.screwAxes}\nlimList: {self.limList}\nlinks: " +\
                f"{self.links}\n GiList: {self.GiList}\n TllList: " +\
                f"{self.TllList}\n TsbHome: {self.TsbHome}"
 
+    def Compile(self, recompile: bool=False) -> "CompiledRobot":
+        """Returns the configuration-independent quantities of the
+        robot, packed into contiguous arrays. The result is cached,
+        so it is only computed on the first call.
+        :param recompile: Rebuild the cached CompiledRobot, e.g. after
+                          changing joint parameters such as fricPar.
+        :return compiled: CompiledRobot instance of this robot.
+        """
+        if self.compiled is None or recompile:
+            self.compiled = CompiledRobot(self)
+            self.kinCache = None #Built on the old CompiledRobot
+        return self.compiled
+
+class CompiledRobot():
+    """Storage class with all quantities of a Robot that do not depend
+    on the joint configuration, precomputed once so that they do not
+    have to be rebuilt on every dynamics- or kinematics call.
+    NOTE: Obtain an instance through Robot.Compile(), which caches it.
+    """
+    def __init__(self, robot: Robot):
+        """Constructor for CompiledRobot class.
+        :param robot: A Robot object describing the robot mathematically.
+        """
+        n = len(robot.joints)
+        self.n: int = n
+        #6xn matrix with the space frame screw axes as its columns.
+        self.screwS: np.ndarray = np.ascontiguousarray(
+            np.array(robot.screwAxes, dtype=float).reshape(n, 6).T)
+        """Adjoint of T_(s,i) in the home configuration. Follows the
+        Pegasus arm specific mechanics of FeedForward: joint 1 and
+        joint n-1 use the link frame of the joint before them."""
+        self.AdHis: np.ndarray = np.zeros((n,6,6))
+        Tsi = np.eye(4)
+        for i in range(n):
+            if i != n-1 and i != 1:
+                Tsi = robot.links[i].Tsi
+            self.AdHis[i] = mr.Adjoint(mr.TransInv(Tsi))
+        #Screw axes in the link frames {i}, one row per joint.
+        self.screwA: np.ndarray = np.einsum('ijk,ki->ij', self.AdHis,
+                                            self.screwS)
+        #T_(i,i-1) in the home configuration, incl. the end-effector.
+        self.TllInv: np.ndarray = np.array([mr.TransInv(Tll) for Tll in
+                                            robot.TllList])
+        #Adjoint of T_(n,n+1), rigidly connected to the last link.
+        self.AdTEF: np.ndarray = mr.Adjoint(self.TllInv[n])
+        self.GiList: np.ndarray = np.array(robot.GiList, dtype=float)
+        self.TsbHome: np.ndarray = np.array(robot.TsbHome, dtype=float)
+        self.limList: np.ndarray = np.array(robot.limList, dtype=float)
+        self.gearRatio: np.ndarray = np.array([joint.gearRatio for joint in
+                                               robot.joints], dtype=float)
+        self.km: np.ndarray = np.array([joint.km for joint in
+                                        robot.joints], dtype=float)
+        self.tauStat: np.ndarray = np.array([joint.fricPar['stat'] for
+                                             joint in robot.joints],
+                                            dtype=float)
+        self.tauKin: np.ndarray = np.array([joint.fricPar['kin'] for
+                                            joint in robot.joints],
+                                           dtype=float)
+        self.bVisc: np.ndarray = np.array([joint.fricPar['visc'] for
+                                           joint in robot.joints],
+                                          dtype=float)
+        self.eff: np.ndarray = np.array([joint.fricPar['eff'] for joint in
+                                         robot.joints], dtype=float)
+
+    def __repr__(self):
+        return f"CompiledRobot(n: {self.n}\nscrewS: {self.screwS}\n" +\
+               f"screwA: {self.screwA}\nlimList: {self.limList}\n" +\
+               f"eff: {self.eff})"
+
+class RNEAWorkspace():
+    """Preallocated buffers for the Newton-Euler inverse dynamics
+    (dynamics_funcs.FeedForward), such that repeated calls for the
+    same robot do not allocate any new arrays.
+    NOTE: One workspace per control loop / thread; the buffers are
+    overwritten on every call.
+    """
+    def __init__(self, robot: Robot):
+        """Constructor for RNEAWorkspace class.
+        :param robot: A Robot object describing the robot mathematically.
+        """
+        model = robot.Compile()
+        n = model.n
+        self.n: int = n
+        #Exponentials of the screw axes & T_(i,i-1) given current config.
+        self.expT: np.ndarray = np.zeros((n,4,4))
+        self.Tii: np.ndarray = np.zeros((4,4))
+        #Adjoints of T_(i,i-1), the last one being constant.
+        self.AdTiiN: np.ndarray = np.zeros((n+1,6,6))
+        self.AdTiiN[n] = model.AdTEF
+        #Twists, accelerations & wrenches of each link, one per row.
+        self.V: np.ndarray = np.zeros((n+1,6))
+        self.dV: np.ndarray = np.zeros((n+1,6))
+        self.F: np.ndarray = np.zeros((n+1,6))
+        #Scratch 6-vectors for intermediate products.
+        self.Adtheta: np.ndarray = np.zeros(6)
+        self.tmp: np.ndarray = np.zeros(6)
+        self.tmp2: np.ndarray = np.zeros(6)
+        self.tau: np.ndarray = np.zeros(n)
+
+    def __repr__(self):
+        return f"RNEAWorkspace(n: {self.n})"
+
+class KinematicsCache():
+    """Storage class for the kinematics of one joint configuration: the
+    end-effector pose, the space & body Jacobian and the damped least-
+    squares pseudo-inverse of the space Jacobian. Filled by 
+    kinematic_funcs.Kinematics, which only recomputes them when the 
+    joint angles change, such that all consumers of a control tick 
+    (VelControl, ForceControl, ImpControl, ...) share one computation.
+    NOTE: Obtain the cache of a robot through Kinematics(robot, theta).
+    The arrays are overwritten on every update, copy them to keep them.
+    """
+    def __init__(self, robot: Robot, damping: float=0.01):
+        """Constructor for KinematicsCache class.
+        :param robot: A Robot object describing the robot mathematically.
+        :param damping: Damping factor of the least-squares pseudo-
+                        inverse, regularizing it near singularities.
+        """
+        model = robot.Compile()
+        n = model.n
+        self.n: int = n
+        self.damping: float = damping
+        #Joint angles of the cached quantities, None if nothing cached.
+        self.theta: np.ndarray = None
+        self.Tsb: np.ndarray = np.eye(4)
+        self.Js: np.ndarray = np.zeros((6,n))
+        self.Jb: np.ndarray = np.zeros((6,n))
+        self.JsPinv: np.ndarray = np.zeros((n,6))
+        #Scratch matrices for the product of exponentials.
+        self.expT: np.ndarray = np.zeros((4,4))
+        self.T: np.ndarray = np.eye(4)
+        self.AdT: np.ndarray = np.zeros((6,6))
+        #Number of updates & cache hits, for profiling.
+        self.nUpdates: int = 0
+        self.nHits: int = 0
+
+    def __repr__(self):
+        return f"KinematicsCache(n: {self.n}, theta: {self.theta}, " +\
+               f"updates: {self.nUpdates}, hits: {self.nHits})"
+
+class WorkspaceIndex():
+    """Voxel grid of the positions the end-effector can reach, each 
+    reachable voxel storing the joint angles of a sample inside it. 
+    Used to reject unreachable targets & to seed the inverse kinematics
+    in O(1). The grid is conservative: Voxels next to a sampled voxel 
+    count as reachable too, as sparse sampling misses some of them.
+    NOTE: Build it with kinematics/workspace.py, which also persists it.
+    Only positions are indexed, not orientations.
+    """
+    def __init__(self, origin: np.ndarray, voxelSize: float, 
+                 occupied: np.ndarray, seeds: np.ndarray, 
+                 key: np.ndarray=None):
+        """Constructor for WorkspaceIndex class.
+        :param origin: Position of the corner of voxel (0,0,0) in [m].
+        :param voxelSize: Edge length of each voxel in [m].
+        :param occupied: 3D boolean grid, True for sampled voxels.
+        :param seeds: Grid of joint angles, occupied.shape + (n,), of
+                      one sample per occupied voxel.
+        :param key: Optional array identifying the robot model it was 
+                    built for, see workspace.ModelKey.
+        """
+        self.origin: np.ndarray = np.asarray(origin, dtype=float)
+        self.voxelSize: float = float(voxelSize)
+        self.occupied: np.ndarray = np.asarray(occupied, dtype=bool)
+        self.seeds: np.ndarray = np.array(seeds)
+        self.key: np.ndarray = None if key is None else np.asarray(key)
+        #Dilate by one voxel, taking over the seeds of the neighbours.
+        self.reachable: np.ndarray = self.occupied.copy()
+        shape = np.array(self.occupied.shape)
+        for offset in np.ndindex(3,3,3):
+            shift = np.array(offset) - 1
+            if not np.any(shift):
+                continue
+            src = tuple(slice(max(0,-k), n - max(0,k)) for k, n in 
+                        zip(shift, shape))
+            dst = tuple(slice(max(0,k), n - max(0,-k)) for k, n in 
+                        zip(shift, shape))
+            new = self.occupied[src] & ~self.reachable[dst]
+            self.seeds[dst][new] = self.seeds[src][new]
+            self.reachable[dst] |= new
+
+    def __repr__(self):
+        return f"WorkspaceIndex(shape: {self.occupied.shape}, voxelSize:" +\
+               f" {self.voxelSize}, occupied: {np.count_nonzero(self.occupied)})"
+
+    def Index(self, pos: np.ndarray) -> Tuple[int]:
+        """Voxel containing a position, None if outside of the grid.
+        :param pos: Position of the end-effector in the space frame.
+        :return index: Tuple of the 3 voxel indices, or None.
+        """
+        index = np.floor((np.asarray(pos, dtype=float)[0:3] - self.origin)/
+                         self.voxelSize).astype(int)
+        if np.any(index < 0) or np.any(index >= self.occupied.shape):
+            return None
+        return tuple(index)
+
+    def Reachable(self, pos: np.ndarray) -> bool:
+        """Whether the end-effector can reach a position.
+        :param pos: Position, or an SE(3) matrix of which the position 
+                    is used.
+        :return reachable: False if the position is surely unreachable.
+        """
+        pos = np.asarray(pos, dtype=float)
+        index = self.Index(pos[0:3,3] if pos.ndim == 2 else pos)
+        return index is not None and bool(self.reachable[index])
+
+    def Seed(self, pos: np.ndarray) -> np.ndarray:
+        """Joint angles of a sample near a position, as initial guess 
+        for the inverse kinematics.
+        :param pos: Position, or an SE(3) matrix of which the position 
+                    is used.
+        :return theta: Joint angles, or None if unreachable.
+        """
+        pos = np.asarray(pos, dtype=float)
+        index = self.Index(pos[0:3,3] if pos.ndim == 2 else pos)
+        if index is None or not self.reachable[index]:
+            return None
+        return self.seeds[index].astype(float)
+
+    def Save(self, path: str):
+        """Stores the index in a compressed .npz file.
+        :param path: File path, missing directories are created.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(path, origin=self.origin, 
+                            voxelSize=self.voxelSize, 
+                            occupied=self.occupied, seeds=self.seeds, 
+                            key=np.array([]) if self.key is None else 
+                            self.key)
+
+    @staticmethod
+    def Load(path: str) -> "WorkspaceIndex":
+        """Loads an index stored with Save.
+        :param path: File path.
+        :return index: The WorkspaceIndex.
+        """
+        with np.load(path) as data:
+            #Dilation already applied to the stored seeds is harmless.
+            return WorkspaceIndex(data['origin'], float(data['voxelSize']),
+                                  data['occupied'], data['seeds'], 
+                                  data['key'] if data['key'].size else None)
+
 class SerialData():
     """Container class containing all relevant information and functions
     for parsing and acting on data received over serial communication."""
@@ -142,6 +396,12 @@ class SerialData():
         self.maxDeltaAngle = maxDeltaAngle #Depricated
         self.angleTol = angleTol #Depricated
         self.limBool = [False for i in range(lenData)]
+        #Serial protocol: 'text' (ASCII groups) or 'bin' (binary frames)
+        self.protocol = 'text'
+        self.seqOut = 0 #Sequence number of the next outgoing frame
+        self.seqIn = None #Sequence number of the last received frame
+        self.tIn = None #Arrival time of the last received frame
+        self.parser = None #FrameParser, created on first read
 
     def ExtractVars(self, dataPacket: List[str]):
         """Extracts & translates information in each datapacket.
@@ -152,17 +412,39 @@ class SerialData():
         Example input:
         dataPacket = '1234|0'
         """
+        totCount = [0 for i in range(self.lenData)]
+        rotDir = [0 for i in range(self.lenData)]
+        homing = [None for i in range(self.lenData)]
+        current = [None for i in range(self.lenData)]
         for i in range(self.lenData):
             args = dataPacket[i].split('|')
             if len(args) >= 3:
-                self.homing[i] = args[2]
-                self.homing[i] = int(self.homing[i])
+                homing[i] = int(args[2])
             if len(args) == 4:
-                self.current[i] = args[3]
-                self.current[i] = float(self.current[i])
-            self.totCount[i], self.rotDirCurr[i] = args[0:2]
-            self.totCount[i] = int(self.totCount[i])
-            self.rotDirCurr[i] = int(self.rotDirCurr[i])
+                current[i] = float(args[3])
+            totCount[i] = int(args[0])
+            rotDir[i] = int(args[1])
+        self.UpdateCounts(totCount, rotDir, homing, current)
+
+    def UpdateCounts(self, totCount: List[int], rotDir: List[int], 
+                     homing: List[int]=None, current: List[float]=None):
+        """Stores decoded encoder data and translates it into joint 
+        angles. Shared by the text (ExtractVars) and binary protocol.
+        :param totCount: Total encoder count of each motor.
+        :param rotDir: Current rotational direction of each motor.
+        :param homing: Optional homing sensor value of each motor.
+        :param current: Optional measured current of each motor.
+        """
+        for i in range(self.lenData):
+            if homing is not None and homing[i] is not None:
+                self.homing[i] = int(homing[i])
+            if current is not None and current[i] is not None:
+                self.current[i] = float(current[i])
+            self.totCount[i] = int(totCount[i])
+            self.rotDirCurr[i] = int(rotDir[i])
+        #All counts are stored first, as the diff drive angles combine
+        #the counts of two motors.
+        for i in range(self.lenData):
             self.prevAngle[i] = self.currAngle[i]
             if i == self.lenData-1:
                     #Gripper doesn't have an 'angle'
@@ -192,6 +474,25 @@ class SerialData():
                 self.currAngle[i] -= self.totCount[i-1]*\
                                      self.joints[i-1].enc2Theta
 
+    def Snapshot(self) -> "SerialData":
+        """Returns a copy of this object, of which the lists are not 
+        shared with the original."""
+        snapshot = copy.copy(self)
+        snapshot.parser = None
+        for key, value in vars(self).items():
+            if isinstance(value, list) and key != 'joints':
+                setattr(snapshot, key, list(value))
+        return snapshot
+
+    def CopyState(self, other: "SerialData"):
+        """Copies the received state (counts, angles, homing, current,
+        last frame) of another SerialData instance into this one."""
+        for key in ['totCount', 'rotDirCurr', 'current', 'homing', 
+                    'currAngle', 'prevAngle']:
+            getattr(self, key)[:] = getattr(other, key)
+        self.seqIn = other.seqIn
+        self.tIn = other.tIn
+
     def Dtheta2Mspeed(self, dtheta: "np.ndarray[float]", 
                       dthetaMax: List[float], PWMMin: int, PWMMax: int):
         #DEPRICATED!
@@ -300,29 +601,56 @@ class SerialData():
 
 class PID():
     """Data storage class for PID information & execution of PID loops.
+    Gains are either scalars, nxn matrices, or Kxnxn stacks of matrices
+    for K independent controllers (e.g. a gain sweep), which are then 
+    executed at once on Kxn signals. The state is updated in place.
     """
-    def __init__(self, kP: np.ndarray, kI: np.ndarray, kD: np.ndarray, ILim: np.ndarray):
+    def __init__(self, kP: np.ndarray, kI: np.ndarray, kD: np.ndarray, 
+                 ILim: np.ndarray, K: int=None, dMeas: bool=False, 
+                 tf: float=0):
         """Constructor for PID object.
         :param kP: Proportional gain term matrix.
         :param kI: Integral gain term matrix.
         :param kD: Differential gain term matrix.
         NOTE: To omit P-, I-, or D action, input kX = 0
-        :param ILim: Limit to integral gain for anti-integral windup.
+        :param ILim: Limit to integral gain for anti-integral windup,
+                     n-vector or Kxn.
+        :param K: Optional number of controllers executed in parallel,
+                  otherwise deduced from the shapes of the gains & ILim.
+        :param dMeas: Take the derivative of the measurement (feedback)
+                      instead of the error, such that steps in the 
+                      reference do not cause derivative kicks.
+        :param tf: Time constant of the first-order low-pass filter on
+                   the derivative in [s], 0 for no filtering.
         """
-        n = ILim.size
         self.kP = kP
         self.kI = kI
         self.kD = kD
-        self.termI = np.zeros(n)
-        self.ILim = ILim
-        self.errPrev = np.zeros(n)
+        self.ILim = np.asarray(ILim, dtype=float)
+        self.dMeas = dMeas
+        self.tf = tf
+        batch = np.broadcast_shapes(*[np.shape(k)[:-2] for k in 
+                                      (kP, kI, kD)], self.ILim.shape[:-1],
+                                    () if K is None else (K,))
+        self.shape: Tuple[int] = batch + self.ILim.shape[-1:]
+        self.Reset()
+
+    @staticmethod
+    def Gain(k: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """Applies a scalar, matrix, or stack of matrices to (a batch 
+        of) vectors x."""
+        if np.ndim(k) < 2:
+            return np.multiply(k, x)
+        return np.matmul(k, x[...,None])[...,0]
 
-    def Execute(self, ref: np.ndarray, Fb: np.ndarray, dt: float):
+    def Execute(self, ref: np.ndarray, Fb: np.ndarray, dt: float, 
+                out: np.ndarray=None) -> np.ndarray:
         """Computes discrete PID error control given a reference 
         signal, a feedback signal, and PID constants.
-        :param ref: Reference / Feed-forward signal.
-        :param Fdb: Feedback signal.
+        :param ref: Reference / Feed-forward signal, n-vector or Kxn.
+        :param Fdb: Feedback signal, n-vector or Kxn.
         :param dt: Time between each error calculation in seconds.
+        :param out: Optional array to write the output into.
         :return PID: PID output.
         
         Example input:
@@ -338,25 +666,992 @@ class PID():
         Output:
         [0.  0.7 2.3 1.5 4. ]
         """
-        err = ref - Fb
-        termP = np.dot(self.kP, err)
-        for i in range(err.size):
-            if abs(self.termI[i]) >= self.ILim[i]:
-                self.termI[i] = np.sign(self.termI[i])*\
-                                  self.ILim[i]
-            else: #Trapezoidal integration
-                trpz = dt*(self.errPrev[i] + err[i])/2
-                self.termI[i] += self.kI[i,i]*trpz
-        termD = np.dot(self.kD, (np.subtract(err, self.errPrev)/dt))
-        PID = np.add(np.add(termP, self.termI), termD)
-        self.errPrev = err
-        return PID
+        err = self.err
+        np.subtract(ref, Fb, out=err)
+        #Trapezoidal integration, frozen at the limit (anti-windup)
+        windup = np.abs(self.termI) >= self.ILim
+        termI = self.Gain(self.kI, dt*(self.errPrev + err)/2)
+        np.add(self.termI, termI, out=self.termI, where=~windup)
+        np.copyto(self.termI, np.sign(self.termI)*self.ILim, where=windup)
+        if self.dMeas:
+            if self.FbPrev is None: #No derivative on the first call
+                self.FbPrev = np.array(np.broadcast_to(Fb, self.shape), 
+                                       dtype=float)
+            derivative = (self.FbPrev - Fb)/dt
+            self.FbPrev[...] = Fb
+        else:
+            derivative = (err - self.errPrev)/dt
+        if self.tf > 0: #First-order low-pass filter
+            alpha = dt/(self.tf + dt)
+            self.dFilt += alpha*(derivative - self.dFilt)
+        else:
+            self.dFilt[...] = derivative
+        if out is None:
+            out = np.empty(self.shape)
+        np.add(self.Gain(self.kP, err), self.termI, out=out)
+        out += self.Gain(self.kD, self.dFilt)
+        self.errPrev[...] = err
+        return out
 
     def Reset(self):
-        """Reset previous error and integral term."""
-        n = self.ILim.size
-        self.errPrev = np.zeros(n)
-        self.termI = np.zeros(n)
+        """Reset previous error, integral term and derivative filter."""
+        self.err = np.zeros(self.shape)
+        self.errPrev = np.zeros(self.shape)
+        self.termI = np.zeros(self.shape)
+        self.dFilt = np.zeros(self.shape)
+        self.FbPrev = None
+
+class TimingLog():
+    """Low-overhead timing instrumentation of control loops. Every stage 
+    (e.g. 'FeedForward', 'SReadAndParse', or a Scheduler task) has a 
+    fixed-size ring buffer with its latest durations, from which the 
+    p50, p99 and maximum latency are computed, next to a count of 
+    missed deadlines.
+    """
+    def __init__(self, size: int=4096, 
+                 clock: Callable[[], float]=time.perf_counter):
+        """Constructor for TimingLog class.
+        :param size: Number of samples kept per stage, older samples 
+                     are overwritten.
+        :param clock: Function returning the current time in [s].
+        """
+        self.size = size
+        self.clock = clock
+        self.stages = dict()
+
+    def Record(self, stage: str, duration: float, missed: int=0):
+        """Stores one duration sample of a stage.
+        :param stage: Name of the stage.
+        :param duration: Measured duration in [s].
+        :param missed: Number of deadlines missed by this sample.
+        """
+        if stage not in self.stages:
+            self.stages[stage] = dict(buffer=np.zeros(self.size), count=0, 
+                                      missed=0, drained=0)
+        data = self.stages[stage]
+        data['buffer'][data['count'] % self.size] = duration
+        data['count'] += 1
+        data['missed'] += missed
+
+    @contextmanager
+    def Measure(self, stage: str):
+        """Context manager recording the duration of its body.
+
+        Example input:
+        with timing.Measure("FeedForward"):
+            tauFF = FeedForward(robot, theta, dtheta, ddtheta, g, FTip)
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.Record(stage, self.clock() - start)
+
+    def Summary(self) -> dict:
+        """Computes the latency statistics of each stage over the 
+        samples in its ring buffer.
+        :return summary: Per stage the total number of samples, the 
+                         p50, p99 & maximum duration in [s], and the 
+                         number of missed deadlines.
+
+        Example output:
+        {'PID': {'n': 1200, 'p50': 0.00011, 'p99': 0.00042, 
+                 'max': 0.0013, 'missed': 0}}
+        """
+        summary = dict()
+        for stage, data in self.stages.items():
+            samples = data['buffer'][:min(data['count'], self.size)]
+            p50, p99 = np.percentile(samples, [50, 99])
+            summary[stage] = dict(n=data['count'], p50=p50, p99=p99, 
+                                  max=samples.max(), missed=data['missed'])
+        return summary
+
+    def Dump(self, csvTitle: str=None) -> str:
+        """Prints the summary as a table in [ms], and optionally writes 
+        it to a CSV file.
+        :param csvTitle: Optional address of the CSV file.
+        :return table: The printed table.
+        """
+        lines = ["stage,n,p50 [ms],p99 [ms],max [ms],missed"]
+        for stage, stats in self.Summary().items():
+            lines.append(f"{stage},{stats['n']},{stats['p50']*1e3:.3f}," +
+                         f"{stats['p99']*1e3:.3f},{stats['max']*1e3:.3f}," +
+                         f"{stats['missed']}")
+        table = "\n".join(lines)
+        print(table)
+        if csvTitle:
+            with open(csvTitle, "w") as csvFile:
+                csvFile.write(table + "\n")
+        return table
+
+    def Drain(self) -> dict:
+        """Returns the samples recorded since the previous Drain, oldest
+        first. Samples already overwritten in the ring buffer are lost.
+        :return samples: Per stage an array of durations in [s].
+        """
+        samples = dict()
+        for stage, data in list(self.stages.items()):
+            count = data['count']
+            nNew = min(count - data['drained'], self.size)
+            if nNew > 0:
+                index = np.arange(count - nNew, count) % self.size
+                samples[stage] = data['buffer'][index]
+            data['drained'] = count
+        return samples
+
+    def Append(self, csvTitle: str) -> int:
+        """Appends the samples since the previous Drain to a CSV file, 
+        one 'stage,duration [ms]' row per sample, e.g. periodically
+        from a logging coroutine.
+        :param csvTitle: Address of the CSV file.
+        :return nSamples: Number of written samples.
+        """
+        samples = self.Drain()
+        newFile = not os.path.exists(csvTitle)
+        with open(csvTitle, "a") as csvFile:
+            if newFile:
+                csvFile.write("stage,duration [ms]\n")
+            for stage, durations in samples.items():
+                csvFile.writelines(f"{stage},{duration*1e3:.4f}\n" for 
+                                   duration in durations)
+        return sum(durations.size for durations in samples.values())
+
+    def __repr__(self):
+        return f"TimingLog(size: {self.size}, stages: {list(self.stages)})"
+
+class NullTimingLog(TimingLog):
+    """TimingLog recording nothing, for control loops without one: 
+    Measure & Record cost a method call, and nothing is allocated per
+    tick. Use the shared instance NULL_TIMING."""
+    def __init__(self):
+        super().__init__(size=0)
+
+    def Record(self, stage: str, duration: float, missed: int=0):
+        pass
+
+    def Measure(self, stage: str):
+        return nullcontext()
+
+NULL_TIMING = NullTimingLog()
+
+class Scheduler():
+    """Fixed-rate scheduler for periodic tasks (FF, PID, communication,
+    UI, ...). Sleeps until the next deadline instead of busy-waiting, 
+    executes all tasks that are due in the order they were added, and 
+    records overruns (deadlines missed by a full period or more).
+    """
+    def __init__(self, clock: Callable[[], float]=None, 
+                 sleep: Callable[[float], None]=None, 
+                 timing: TimingLog=None, 
+                 asyncSleep: Callable[[float], Any]=None):
+        """Constructor for Scheduler class.
+        :param clock: Function returning the current time in [s].
+        :param sleep: Function sleeping for the given time in [s].
+        :param timing: Optional TimingLog, in which the execution time 
+                       of each task is recorded as '<task>', and its
+                       lateness w.r.t. its deadline as '<task> late', 
+                       including the missed deadlines.
+        :param asyncSleep: Coroutine function sleeping for the given 
+                           time in [s], used by RunAsync().
+        NOTE: clock & sleep can be replaced, e.g. for simulated time 
+        (see SimClock). Without them, real time is used.
+        """
+        self.clock = time.perf_counter if clock is None else clock
+        self.sleep = time.sleep if sleep is None else sleep
+        self.asyncSleep = asyncio.sleep if asyncSleep is None else asyncSleep
+        self.timing = timing
+        self.tasks = []
+        self.running = False
+        self.startTime = None
+
+    def AddTask(self, name: str, period: float, callback: Callable[[], None],
+                phase: float=0):
+        """Registers a periodic task. Tasks that are due at the same 
+        time are executed in the order they are added.
+        :param name: Name of the task, used for the statistics.
+        :param period: Time between two executions in [s].
+        :param callback: Function without arguments executing the task.
+                         With RunAsync(), it may also be a coroutine 
+                         function.
+        :param phase: Delay of the first execution after the start of 
+                      Run() in [s].
+        """
+        if period <= 0:
+            raise ValueError("The period of a task should be positive.")
+        self.tasks.append(dict(name=name, period=period, callback=callback, 
+                               phase=phase, tick=0, deadline=None, runs=0, 
+                               overruns=0, maxLate=0.))
+
+    def Elapsed(self) -> float:
+        """Returns the time since the start of Run() in [s]."""
+        return self.clock() - self.startTime
+
+    def Stop(self):
+        """Stops Run() after the current tick, can be called by tasks."""
+        self.running = False
+
+    def Run(self, duration: float=None, until: Callable[[], bool]=None):
+        """Executes the registered tasks at their fixed rates until 
+        Stop() is called, duration has passed, or until() is True.
+        Deadlines are fixed multiples of the period after the start, so 
+        delays do not accumulate. If a task is late by one or more full
+        periods, the missed executions are skipped and counted as 
+        overruns.
+        :param duration: Optional maximum run time in [s].
+        :param until: Optional function, evaluated after every tick, 
+                      that stops the scheduler when it returns True.
+        """
+        self.Start()
+        while self.running:
+            due = self.DueTasks(duration)
+            if due is None:
+                break
+            for task, now in due:
+                start = self.ExecClock()
+                task['callback']()
+                self.Finish(task, now, start)
+            waitTime = self.WaitTime(duration, until)
+            if waitTime > 0:
+                self.sleep(waitTime)
+        self.running = False
+
+    async def RunAsync(self, duration: float=None, 
+                       until: Callable[[], bool]=None):
+        """Coroutine equivalent of Run(), such that the scheduler shares
+        an asyncio event loop with other coroutines (e.g. serial I/O). 
+        Other coroutines run while it sleeps until the next deadline.
+        Callbacks returning an awaitable are awaited.
+        :param duration: Optional maximum run time in [s].
+        :param until: Optional function, evaluated after every tick, 
+                      that stops the scheduler when it returns True.
+        """
+        self.Start()
+        while self.running:
+            due = self.DueTasks(duration)
+            if due is None:
+                break
+            for task, now in due:
+                start = self.ExecClock()
+                result = task['callback']()
+                if inspect.isawaitable(result):
+                    await result
+                self.Finish(task, now, start)
+            waitTime = self.WaitTime(duration, until)
+            await self.asyncSleep(max(waitTime, 0))
+        self.running = False
+
+    def Start(self):
+        """Sets the start time & the first deadline of each task."""
+        self.startTime = self.clock()
+        for task in self.tasks:
+            task['tick'] = 0
+            task['deadline'] = self.startTime + task['phase']
+        self.running = True
+
+    def DueTasks(self, duration: float=None) -> list:
+        """Returns (task, time) of each task that is due, None if the
+        duration has passed."""
+        now = self.clock()
+        if duration is not None and now - self.startTime >= duration:
+            return None
+        return [(task, now) for task in self.tasks if task['deadline'] <= now]
+
+    def ExecClock(self) -> float:
+        """Clock for execution times: That of the TimingLog, which stays
+        in real time when the scheduler runs in simulated time."""
+        return 0. if self.timing is None else self.timing.clock()
+
+    def Finish(self, task: dict, now: float, start: float):
+        """Records an execution of a task, which started at start while
+        due at now, and sets its next deadline."""
+        late = now - task['deadline']
+        missed = int(late // task['period'])
+        if self.timing is not None:
+            self.timing.Record(task['name'], self.ExecClock() - start)
+            self.timing.Record(task['name'] + " late", late, missed)
+        task['runs'] += 1
+        task['maxLate'] = max(task['maxLate'], late)
+        task['overruns'] += missed
+        task['tick'] += missed + 1
+        task['deadline'] = self.startTime + task['phase'] + \
+                           task['tick']*task['period']
+
+    def WaitTime(self, duration: float=None, 
+                 until: Callable[[], bool]=None) -> float:
+        """Returns the time until the next deadline in [s], and stops the
+        scheduler if until() is True."""
+        if until is not None and until():
+            self.running = False
+        if not self.running:
+            return 0
+        nextDeadline = min(task['deadline'] for task in self.tasks)
+        if duration is not None:
+            nextDeadline = min(nextDeadline, self.startTime + duration)
+        return nextDeadline - self.clock()
+
+    def Stats(self) -> dict:
+        """Returns per task the number of executions, the number of 
+        overruns, and the maximum lateness w.r.t. its deadline in [s].
+
+        Example output:
+        {'PID': {'runs': 200, 'overruns': 1, 'maxLate': 0.0531}}
+        """
+        return {task['name']: dict(runs=task['runs'], 
+                overruns=task['overruns'], maxLate=task['maxLate'])
+                for task in self.tasks}
+
+    def __repr__(self):
+        return f"Scheduler(tasks: {[task['name'] for task in self.tasks]})"
+
+class FrameParser():
+    """Incremental parser of a serial byte stream. Incoming bytes are 
+    kept in a persistent buffer, such that frames split over multiple 
+    reads are completed by the next read instead of being flushed. Every
+    complete frame is decoded, timestamped & stored until polled."""
+    def __init__(self, split: Callable[[bytearray], Tuple[List[bytes], int, int]],
+                 decode: Callable[[bytes], Tuple[int, Any]], 
+                 maxBuffer: int=4096, maxHistory: int=256, 
+                 clock: Callable[[], float]=time.perf_counter):
+        """Constructor for FrameParser class.
+        :param split: Function finding all complete frames in a buffer,
+                      returning the frames, the number of bytes consumed
+                      & the number of corrupt chunks skipped.
+        :param decode: Function decoding a frame into its sequence 
+                       number (None if the protocol has none) and 
+                       content. Raises InputError on a corrupt frame.
+        :param maxBuffer: Maximum number of buffered bytes without a 
+                          complete frame, older bytes are discarded.
+        :param maxHistory: Maximum number of unpolled frames, older 
+                           frames are discarded & counted as dropped.
+        :param clock: Function returning the current time in seconds.
+        """
+        self.split = split
+        self.decode = decode
+        self.maxBuffer = maxBuffer
+        self.maxHistory = maxHistory
+        self.clock = clock
+        self.buffer = bytearray()
+        self.history = []
+        self.latest = None
+        self.seq = None
+        self.nFrames = 0
+        self.nCorrupt = 0
+        self.nDropped = 0
+
+    def __repr__(self):
+        return f"FrameParser(frames={self.nFrames}, corrupt=" + \
+               f"{self.nCorrupt}, dropped={self.nDropped})"
+
+    def Feed(self, data: bytes, t: float=None) -> int:
+        """Adds received bytes and decodes all frames completed by them.
+        :param data: Bytes as read from the serial port.
+        :param t: Arrival time of the data, clock() by default.
+        :return nNew: Number of valid frames decoded.
+        """
+        t = self.clock() if t is None else t
+        self.buffer += data
+        frames, consumed, nCorrupt = self.split(self.buffer)
+        del self.buffer[:consumed]
+        self.nCorrupt += nCorrupt
+        if len(self.buffer) > self.maxBuffer:
+            del self.buffer[:len(self.buffer)-self.maxBuffer]
+            self.nCorrupt += 1
+        nNew = 0
+        for frame in frames:
+            try:
+                seq, content = self.decode(frame)
+            except InputError:
+                self.nCorrupt += 1
+                continue
+            if seq is not None and self.seq is not None:
+                #Gaps in the 16-bit sequence, repeated frames excluded
+                gap = (seq - self.seq - 1) & 0xFFFF
+                self.nDropped += gap if gap < 0x8000 else 0
+            self.seq = seq
+            self.latest = (t, content)
+            self.history.append(self.latest)
+            self.nFrames += 1
+            nNew += 1
+        if len(self.history) > self.maxHistory:
+            self.nDropped += len(self.history) - self.maxHistory
+            del self.history[:len(self.history)-self.maxHistory]
+        return nNew
+
+    def Latest(self) -> Tuple[float, Any]:
+        """Returns the most recent (time, content), None if no frame 
+        has been received yet."""
+        return self.latest
+
+    def Poll(self) -> List[Tuple[float, Any]]:
+        """Returns all (time, content) received since the last poll, 
+        oldest first."""
+        history, self.history = self.history, []
+        return history
+
+class SerialBuffers():
+    """State shared by the background serial handlers (SerialWorker, 
+    AsyncSerial): Received frames are decoded into a private SerialData
+    (back buffer), of which a copy is published after every read (front
+    buffer). The newest command is sent at a fixed rate. The control 
+    loop only exchanges in-memory state with the handler (Exchange), so
+    USB timing cannot stall it. Publishing swaps a single reference, so
+    no locks are needed."""
+    def __init__(self, SPData: "SerialData", localMu, 
+                 read: Callable[["SerialData", Any], bool],
+                 write: Callable[["SerialData", Any], None]):
+        """Constructor for SerialBuffers class.
+        :param SPData: SerialData instance only used by the handler.
+        :param localMu: serial.Serial() instance representing the serial
+                        communication with the local microcontroller.
+        :param read: Function parsing waiting data into SPData, e.g. 
+                     SReadAndParse.
+        :param write: Function sending SPData.mSpeed, e.g. SWriteCommand.
+        """
+        self.SPData = SPData
+        self.localMu = localMu
+        self.read = read
+        self.write = write
+        self.command = list(SPData.mSpeed)
+        self.snapshot = SPData.Snapshot()
+        self.nSnapshot = 0
+        self.nExchanged = 0
+        self.error = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}(running={self.IsRunning()}, " + \
+               f"snapshots={self.nSnapshot})"
+
+    def IsRunning(self) -> bool:
+        return False
+
+    def ReadTask(self):
+        """Parses waiting data & publishes a copy if anything changed."""
+        seqIn, tIn = self.SPData.seqIn, self.SPData.tIn
+        self.read(self.SPData, self.localMu)
+        if self.SPData.tIn != tIn or self.SPData.seqIn != seqIn:
+            self.snapshot = self.SPData.Snapshot()
+            self.nSnapshot += 1
+
+    def WriteTask(self):
+        """Sends the most recent command."""
+        self.SPData.mSpeed = list(self.command)
+        self.write(self.SPData, self.localMu)
+
+    def Latest(self) -> "SerialData":
+        """Returns the most recent published copy of the received data,
+        raises the error of the handler if it crashed."""
+        if self.error is not None:
+            raise self.error
+        return self.snapshot
+
+    def SetCommand(self, mSpeed: List[float]):
+        """Queues motor commands, sent at the next write."""
+        self.command = list(mSpeed)
+
+    def Exchange(self, SPData: "SerialData") -> bool:
+        """Copies the most recent received data into SPData, and queues
+        SPData.mSpeed as the next command. Replaces reading & writing
+        the serial port in the control loop.
+        :param SPData: SerialData instance of the control loop.
+        :return newData: True if data was received since the previous
+                         exchange.
+        """
+        nSnapshot = self.nSnapshot #Read before the snapshot itself
+        snapshot = self.Latest()
+        SPData.CopyState(snapshot)
+        self.SetCommand(SPData.mSpeed)
+        newData = nSnapshot != self.nExchanged
+        self.nExchanged = nSnapshot
+        return newData
+
+class SerialWorker(SerialBuffers):
+    """Background thread owning the serial port, see SerialBuffers."""
+    def __init__(self, SPData: "SerialData", localMu, 
+                 read: Callable[["SerialData", Any], bool],
+                 write: Callable[["SerialData", Any], None], 
+                 dtComm: float, dtRead: float=None, timing: TimingLog=None,
+                 clock: Callable[[], float]=time.perf_counter, 
+                 sleep: Callable[[float], None]=time.sleep):
+        """Constructor for SerialWorker class.
+        :param SPData: SerialData instance only used by the worker.
+        :param localMu: serial.Serial() instance representing the serial
+                        communication with the local microcontroller.
+        :param read: Function parsing waiting data into SPData, e.g. 
+                     SReadAndParse.
+        :param write: Function sending SPData.mSpeed, e.g. SWriteCommand.
+        :param dtComm: Time between two sent commands in [s].
+        :param dtRead: Time between two reads in [s], dtComm/10 by 
+                       default.
+        :param timing: Optional TimingLog, see Scheduler.
+        :param clock: Function returning the current time in [s].
+        :param sleep: Function sleeping for the given time in [s].
+        """
+        super().__init__(SPData, localMu, read, write)
+        self.stopEvent = threading.Event()
+        self.thread = None
+        self.scheduler = Scheduler(clock, sleep, timing)
+        dtRead = dtComm/10 if dtRead is None else dtRead
+        self.scheduler.AddTask("serial read", dtRead, self.ReadTask)
+        self.scheduler.AddTask("serial write", dtComm, self.WriteTask,
+                               phase=dtComm)
+
+    def Run(self):
+        """Executes the worker in the current thread until Stop()."""
+        try:
+            self.scheduler.Run(until=self.stopEvent.is_set)
+        except BaseException as e:
+            self.error = e
+
+    def Start(self) -> "SerialWorker":
+        """Starts the worker in a daemon thread."""
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self.Run, daemon=True, 
+                                       name="SerialWorker")
+        self.thread.start()
+        return self
+
+    def Stop(self, timeout: float=1):
+        """Stops the worker thread and waits for it to finish."""
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def IsRunning(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+class AsyncSerial(SerialBuffers):
+    """Coroutine counterpart of SerialWorker, sharing the asyncio event
+    loop of the control loop instead of running in a thread. Rx parses
+    received frames as soon as the port is readable (loop.add_reader on
+    its file descriptor), or polls every dtRead if the port has none 
+    (e.g. a TeensyEmulator) or the loop cannot wait on it (Windows). Tx
+    sends the newest command every dtComm. See SerialBuffers."""
+    def __init__(self, SPData: "SerialData", localMu, 
+                 read: Callable[["SerialData", Any], bool],
+                 write: Callable[["SerialData", Any], None], 
+                 dtComm: float, dtRead: float=None, timing: TimingLog=None,
+                 clock: Callable[[], float]=None, 
+                 asyncSleep: Callable[[float], Any]=None):
+        """Constructor for AsyncSerial class.
+        :param SPData: SerialData instance only used by the coroutines.
+        :param localMu: serial.Serial() instance representing the serial
+                        communication with the local microcontroller.
+        :param read: Function parsing waiting data into SPData, e.g. 
+                     SReadAndParse.
+        :param write: Function sending SPData.mSpeed, e.g. SWriteCommand.
+        :param dtComm: Time between two sent commands in [s].
+        :param dtRead: Time between two reads in [s] when polling, 
+                       dtComm/10 by default.
+        :param timing: Optional TimingLog, see Scheduler.
+        :param clock: Function returning the current time in [s], real
+                      time if None.
+        :param asyncSleep: Coroutine function sleeping for the given 
+                           time in [s], asyncio.sleep if None.
+        """
+        super().__init__(SPData, localMu, read, write)
+        self.timing = NULL_TIMING if timing is None else timing
+        self.tasks = []
+        dtRead = dtComm/10 if dtRead is None else dtRead
+        self.rxScheduler = Scheduler(clock, None, timing, asyncSleep)
+        self.rxScheduler.AddTask("serial read", dtRead, self.ReadTask)
+        self.txScheduler = Scheduler(clock, None, timing, asyncSleep)
+        self.txScheduler.AddTask("serial write", dtComm, self.WriteTask,
+                                 phase=dtComm)
+
+    def FileNo(self) -> int:
+        """Returns the file descriptor of the port, None if it has none."""
+        fileno = getattr(self.localMu, "fileno", None)
+        return None if fileno is None else fileno()
+
+    async def Rx(self):
+        """Coroutine receiving data until Stop()."""
+        fd = self.FileNo()
+        if fd is None:
+            await self.rxScheduler.RunAsync()
+            return
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        try:
+            loop.add_reader(fd, readable.set)
+        except NotImplementedError: #E.g. the ProactorEventLoop (Windows)
+            await self.rxScheduler.RunAsync()
+            return
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                with self.timing.Measure("serial read"):
+                    self.ReadTask()
+        finally:
+            loop.remove_reader(fd)
+
+    async def Tx(self):
+        """Coroutine sending the newest command every dtComm until 
+        Stop()."""
+        await self.txScheduler.RunAsync()
+
+    def Done(self, task: asyncio.Task):
+        """Keeps the error of a crashed coroutine, raised by Latest()."""
+        if not task.cancelled() and task.exception() is not None:
+            self.error = task.exception()
+
+    def Start(self, loop: asyncio.AbstractEventLoop=None) -> "AsyncSerial":
+        """Schedules Rx & Tx on the event loop, where they run whenever
+        the loop does (e.g. with the control loop in RunAsync()).
+        :param loop: Event loop, the current one if None.
+        """
+        loop = asyncio.get_event_loop() if loop is None else loop
+        self.tasks = [loop.create_task(self.Rx(), name="serial rx"),
+                      loop.create_task(self.Tx(), name="serial tx")]
+        for task in self.tasks:
+            task.add_done_callback(self.Done)
+        return self
+
+    def Stop(self):
+        """Cancels Rx & Tx. If their loop is not running, it is run until
+        they finished."""
+        for task in self.tasks:
+            task.cancel()
+        if self.tasks:
+            loop = self.tasks[0].get_loop()
+            if not loop.is_running() and not loop.is_closed():
+                loop.run_until_complete(asyncio.gather(*self.tasks, 
+                                                       return_exceptions=True))
+
+    def IsRunning(self) -> bool:
+        return any(not task.done() for task in self.tasks)
+
+class TeensyEmulator():
+    """Hardware-free stand-in for the Teensy running serial_comm_v5_curr.
+    Speaks the same ASCII protocol: Commands "['mSpeed|rotCCW', ...]\n"
+    are parsed as ParseCommand does, and every dtComm a frame
+    "[totCount|rotDir|homing|curr]...\r\n" is sent, with the homing 
+    value as a raw byte. Motor PWM is integrated into encoder counts by 
+    a plant model: By default motor speed proportional to PWM, for 
+    protocol tests & benchmarks. For the robot_init dynamics as plant,
+    see SimTeensy (simulation/sim.py). As on the Teensy, rotDir is the
+    direction of the last count change, 1 when counting down. Can be 
+    used directly as a serial.Serial() instance, or served over a 
+    pseudo-terminal (ServePty) for StartComms."""
+    def __init__(self, joints: List[Joint], dtComm: float=0.2, 
+                 dtStep: float=0.001, dthetaMax: List[float]=None, 
+                 plant: Callable[[np.ndarray, float], np.ndarray]=None, 
+                 countNoise: float=0, currNoise: float=0, 
+                 pCorrupt: float=0, seed: int=None, 
+                 clock: Callable[[], float]=time.perf_counter):
+        """Constructor for TeensyEmulator class.
+        :param joints: List of all Joint instances of the robot, one per
+                       motor except the gripper.
+        :param dtComm: Time between two sent frames in [s], as in the 
+                       Teensy code.
+        :param dtStep: Integration step of the plant in [s].
+        :param dthetaMax: Speed of each motor at a PWM of 255, in [rad/s]
+                          of the joint the encoder is scaled to. Used by
+                          the default plant, 1 rad/s by default.
+        :param plant: Optional function (PWM, dt) -> totCount, advancing
+                      a plant model by dt with signed PWM per motor and 
+                      returning the (float) encoder count of each motor.
+        :param countNoise: Standard deviation of the noise on the sent
+                           encoder counts.
+        :param currNoise: Standard deviation of the noise on the sent 
+                          currents in [A].
+        :param pCorrupt: Probability of a sent frame being corrupted by
+                         a flipped or dropped byte.
+        :param seed: Optional seed for the noise & corruption.
+        :param clock: Function returning the current time in [s].
+        """
+        self.lenData = len(joints) + 1 #+1 for gripper
+        self.joints = joints
+        self.dtComm = dtComm
+        self.dtStep = dtStep
+        if dthetaMax is None:
+            dthetaMax = [1 for i in range(len(joints))]
+        #Counts per second at a PWM of 255, gripper excluded.
+        self.countRate = np.array([dthetaMax[i]/joints[i].enc2Theta 
+                                   for i in range(len(joints))] + [0.])
+        self.plant = self.KinematicPlant if plant is None else plant
+        self.countNoise = countNoise
+        self.currNoise = currNoise
+        self.pCorrupt = pCorrupt
+        self.rng = np.random.default_rng(seed)
+        self.clock = clock
+        self.mSpeed = [0 for i in range(self.lenData)]
+        self.rotCCW = [0 for i in range(self.lenData)]
+        self.homing = [0 for i in range(self.lenData)]
+        self.count = np.zeros(self.lenData)
+        self.rotDir = [0 for i in range(self.lenData)]
+        self.command = ""
+        self.dataOut = bytearray()
+        self.nFrames = 0
+        self.nCommands = 0
+        self.tCommand = None #Arrival time of the last command
+        self.tPlant = self.clock()
+        self.tStart = self.tPlant
+        self.tFrame = self.tStart + dtComm
+        self.thread = None
+        self.stopEvent = threading.Event()
+
+    def __repr__(self):
+        return f"TeensyEmulator(frames={self.nFrames}, commands=" + \
+               f"{self.nCommands}, totCount={self.TotCount()})"
+
+    def PWM(self) -> np.ndarray:
+        """Returns the signed PWM of each motor (positive for CCW)."""
+        return np.array([self.mSpeed[i] if self.rotCCW[i] == 1 else 
+                         -self.mSpeed[i] for i in range(self.lenData)], 
+                        dtype=float)
+
+    def KinematicPlant(self, PWM: np.ndarray, dt: float) -> np.ndarray:
+        """Default plant: Motor speed proportional to PWM."""
+        self.count += np.clip(PWM, -255, 255)/255*self.countRate*dt
+        return self.count
+
+    def TotCount(self) -> List[int]:
+        return [int(round(count)) for count in self.count]
+
+    def Update(self, now: float=None):
+        """Advances the plant to now, sending all frames due until now.
+        :param now: Current time in [s], clock() by default.
+        """
+        now = self.clock() if now is None else now
+        while self.tFrame <= now:
+            self.Integrate(self.tFrame)
+            self.dataOut += self.Frame()
+            self.nFrames += 1
+            self.tFrame = self.tStart + (self.nFrames + 1)*self.dtComm
+        self.Integrate(now)
+
+    def Integrate(self, tEnd: float):
+        """Advances the plant to tEnd in steps of at most dtStep."""
+        PWM = self.PWM()
+        while self.tPlant < tEnd:
+            dt = min(self.dtStep, tEnd - self.tPlant)
+            countPrev = self.count.copy()
+            self.count[:] = self.plant(PWM, dt)
+            for i in np.flatnonzero(self.count != countPrev):
+                #As the encoder interrupts: totCount-1 if rotDir
+                self.rotDir[i] = 1 if self.count[i] < countPrev[i] else 0
+            self.tPlant += dt
+
+    def Frame(self) -> bytes:
+        """Returns the frame the Teensy would currently send, including
+        noise & corruption."""
+        frame = bytearray()
+        PWM = self.PWM()
+        for i in range(self.lenData):
+            count = self.count[i] + self.rng.normal(0, self.countNoise) \
+                    if self.countNoise else self.count[i]
+            curr = PWM[i]*2/255
+            if self.currNoise:
+                curr += self.rng.normal(0, self.currNoise)
+            frame += f"[{int(round(count))}|{self.rotDir[i]}|".encode() + bytes([self.homing[i]]) + \
+                     f"|{curr:4.2f}]".encode()
+        frame += b"\r\n"
+        if self.pCorrupt and self.rng.random() < self.pCorrupt:
+            idx = int(self.rng.integers(len(frame)))
+            if self.rng.random() < 0.5:
+                frame[idx] ^= 1 << int(self.rng.integers(8))
+            else:
+                del frame[idx]
+        return bytes(frame)
+
+    def ParseCommand(self, com: str):
+        """Parses a command as ParseCommand of the Teensy code does."""
+        parseIndex = 0
+        commandIt = 0
+        while parseIndex < len(com) and commandIt < self.lenData:
+            startIndex = com.find("'", parseIndex)
+            sepIndex = com.find("|", parseIndex)
+            endIndex = com.find("'", startIndex + 1)
+            if min(startIndex, sepIndex, endIndex) == -1:
+                break
+            try:
+                self.mSpeed[commandIt] = int(com[startIndex+1:sepIndex])
+                self.rotCCW[commandIt] = int(com[sepIndex+1:endIndex])
+            except ValueError: #toInt() returns 0 on invalid input
+                self.mSpeed[commandIt] = 0
+                self.rotCCW[commandIt] = 0
+            parseIndex = endIndex + 1
+            commandIt += 1
+
+    #serial.Serial() interface
+    def write(self, data: bytes) -> int:
+        self.Update()
+        for c in data.decode("utf-8", errors="replace"):
+            if c == "\n":
+                self.ParseCommand(self.command)
+                self.command = ""
+                self.nCommands += 1
+                self.tCommand = self.clock()
+            else:
+                self.command += c
+        return len(data)
+
+    def inWaiting(self) -> int:
+        self.Update()
+        return len(self.dataOut)
+
+    @property
+    def in_waiting(self) -> int:
+        return self.inWaiting()
+
+    def read(self, size: int=1) -> bytes:
+        self.Update()
+        data = bytes(self.dataOut[:size])
+        del self.dataOut[:size]
+        return data
+
+    def reset_input_buffer(self):
+        self.dataOut.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.Stop()
+
+    def ServePty(self, dtLoop: float=0.0005) -> str:
+        """Serves the emulator over a pseudo-terminal in a background 
+        thread, such that it can be opened like a real Teensy.
+        :param dtLoop: Polling interval of the serving thread in [s].
+        :return port: Device name to open, e.g. with StartComms(port).
+        """
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(slave) #No echo / line processing, like a USB port
+        port = os.ttyname(slave)
+        os.set_blocking(master, False) #Drop data if nobody reads
+        self.stopEvent.clear()
+        def Serve():
+            try:
+                while not self.stopEvent.is_set():
+                    if select.select([master], [], [], dtLoop)[0]:
+                        self.write(os.read(master, 4096))
+                    self.Update()
+                    if self.dataOut:
+                        try:
+                            os.write(master, self.read(len(self.dataOut)))
+                        except BlockingIOError:
+                            pass
+            finally:
+                os.close(master)
+                os.close(slave)
+        self.thread = threading.Thread(target=Serve, daemon=True, 
+                                       name="TeensyEmulator")
+        self.thread.start()
+        return port
+
+    def Stop(self, timeout: float=1):
+        """Stops serving the pseudo-terminal."""
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+class SimClock():
+    """Simulated time: Sleeping advances the time instantly, such that
+    loops run as fast as they are computed."""
+    def __init__(self, t0: float=0):
+        self.t = t0
+        #Wake-up times of the sleeping coroutines, see AsyncSleep.
+        self.sleepers = []
+        self.counter = itertools.count()
+
+    def __call__(self) -> float:
+        return self.t
+
+    def __repr__(self):
+        return f"SimClock(t={self.t})"
+
+    def Sleep(self, dt: float):
+        self.t += max(dt, 0)
+
+    async def AsyncSleep(self, dt: float):
+        """Sleeps in simulated time. With several coroutines sleeping
+        on the same event loop, the time jumps to the earliest wake-up 
+        time once the others had the chance to run, such that they wake 
+        in the order they would in real time."""
+        entry = (self.t + max(dt, 0), next(self.counter))
+        heapq.heappush(self.sleepers, entry)
+        try:
+            await asyncio.sleep(0) #Let other coroutines run
+            while self.sleepers[0] != entry:
+                await asyncio.sleep(0)
+            self.t = max(self.t, entry[0])
+        finally:
+            self.sleepers.remove(entry)
+            heapq.heapify(self.sleepers)
+
+class SimPlant():
+    """Plant model replacing the motors & encoders of the robot, for use
+    as the plant of a TeensyEmulator. Motor PWM is mapped to motor 
+    torques, un-mixed into joint torques (inverse of the differential 
+    drive mixing of the controllers), and the robot dynamics are 
+    integrated. The joint angles are returned as the encoder counts 
+    that SerialData.UpdateCounts translates back into these angles."""
+    def __init__(self, robot: Robot, step: Callable, theta0: List[float], 
+                 tauPerPWM: List[float], bVisc: List[float]=None, 
+                 g: np.ndarray=np.array([0,0,-9.81]), 
+                 FTip: np.ndarray=np.zeros(6)):
+        """Constructor for SimPlant class.
+        :param robot: A Robot object describing the robot mathematically.
+        :param step: Integration function with the signature of 
+                     SimulateStep (dynamics_funcs.py).
+        :param theta0: Initial joint angles in [rad].
+        :param tauPerPWM: Joint torque of each motor per unit of PWM in
+                          [Nm], e.g. from Curr2Tau(MSpeed2Curr(1), ...).
+        :param bVisc: Optional viscous damping of each joint in 
+                      [Nm/(rad/s)], for losses missing in the rigid-body
+                      model (back-EMF, gearbox).
+        :param g: 3-vector describing gravitational acceleration in the 
+                  space frame.
+        :param FTip: 6-vector of the wrench at the end-effector.
+        """
+        n = len(robot.joints)
+        self.robot = robot
+        self.step = step
+        self.theta = list(theta0)
+        self.dtheta = [0. for i in range(n)]
+        self.ddtheta = [0. for i in range(n)]
+        self.tauPerPWM = np.asarray(tauPerPWM, dtype=float)
+        self.bVisc = np.zeros(n) if bVisc is None else \
+                     np.asarray(bVisc, dtype=float)
+        self.g = g
+        self.FTip = FTip
+        self.enc2Theta = [joint.enc2Theta for joint in robot.joints]
+
+    def __repr__(self):
+        return f"SimPlant(theta={np.round(self.theta, 4)})"
+
+    def Torques(self, PWM: np.ndarray) -> np.ndarray:
+        """Maps the signed PWM of each motor to joint torques in [Nm]."""
+        n = len(self.robot.joints)
+        tauM = np.asarray(PWM[:n], dtype=float)*self.tauPerPWM
+        tau = tauM.copy()
+        #Motors: tauM[3] = -tauJ4 - tauJ5, tauM[4] = tauJ4 - tauJ5
+        tau[3] = (tauM[4] - tauM[3])/2
+        tau[4] = -(tauM[3] + tauM[4])/2
+        return tau
+
+    def Counts(self) -> np.ndarray:
+        """Returns the encoder counts (gripper included) corresponding
+        to the current joint angles, see SerialData.UpdateCounts."""
+        theta, e = self.theta, self.enc2Theta
+        angleRel = theta[3] + theta[2] + theta[1]
+        return np.array([theta[0]/e[0], theta[1]/e[1], 
+                         (theta[2] + theta[1])/e[2], 
+                         (theta[4] - angleRel)/e[3], 
+                         (theta[4] + angleRel)/e[4], 0.])
+
+    def __call__(self, PWM: np.ndarray, dt: float) -> np.ndarray:
+        """Advances the plant by dt with the given PWM, see 
+        TeensyEmulator."""
+        tau = self.Torques(PWM) - self.bVisc*np.asarray(self.dtheta)
+        self.theta, self.dtheta, self.ddtheta = self.step(self.robot, 
+            self.theta, self.dtheta, self.ddtheta, tau, self.g, self.FTip,
+            dt)
+        return self.Counts()
+
 ### ERROR CLASSES
 class IKAlgorithmError(BaseException):
     """Custom error class for when the inverse kinematics algorithm is 
@@ -7,21 +7,24 @@ current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
 
-from typing import Union, List, Tuple
+from typing import Union, List, Tuple, Callable, Any
 import modern_robotics as mr
 import numpy as np
-import time
 import serial
 import pygame
+import asyncio
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-from kinematics.kinematic_funcs import IKSpace, FKSpace
-from trajectory_generation.traj_gen import TrajGen, TrajDerivatives
-from dynamics.dynamics_funcs import FeedForward
-from serial_comm.serial_comm import SReadAndParse
-from classes import Robot, SerialData, PID, IKAlgorithmError, InputError
+from kinematics.kinematic_funcs import IKSpace, Kinematics
+from trajectory_generation.traj_gen import TrajGen, TrajDerivatives, \
+                                           JointTrajLims, TOPP, MotorTauLims
+from dynamics.dynamics_funcs import FeedForward, FeedForwardBatch
+from serial_comm.serial_comm import SExchange
+from classes import Robot, SerialData, PID, IKAlgorithmError, InputError, \
+                    Scheduler, TimingLog, WorkspaceIndex, RNEAWorkspace, \
+                    NULL_TIMING
 from util import Tau2Curr, Curr2MSpeed, RToEuler, LimDamping
 
-def PosControl(sConfig: Union[np.ndarray, List], eConfig: Union[np.ndarray, List], robot: Robot, serial: SerialData, dt: float, vMax: float, omgMax: float, PIDObj: PID, dtComm: float, dtPID: float, dtFrame: float, localMu: serial.Serial, screen: pygame.Surface, background: pygame.Surface): 
+def PosControl(sConfig: Union[np.ndarray, List], eConfig: Union[np.ndarray, List], robot: Robot, serial: SerialData, dt: float, vMax: float, omgMax: float, PIDObj: PID, dtComm: float, dtPID: float, dtFrame: float, localMu: serial.Serial, screen: pygame.Surface, background: pygame.Surface, timing: TimingLog=None, loop: asyncio.AbstractEventLoop=None, workspace: WorkspaceIndex=None, aMax: float=None, clock: Callable[[], float]=None, sleep: Callable[[float], None]=None, asyncSleep: Callable[[float], Any]=None): 
     """Position control by means of point-to-point trajectory 
     generation combined with feed-forward and PID torque control.
     :param sConfig: Start configuration, either in SE(3) or a list of 
@@ -39,9 +42,26 @@ def PosControl(sConfig: Union[np.ndarray, List], eConfig: Union[np.ndarray, List
     :param dtComm: Interval of sending & receiving data w.r.t the 
                    local microcontroller in [s].
     :param dtPID: Time between PID torque updates in [s].
-    :param localMu: Serial-object for local microcontroller comms.
-    :param screen: Pygame screen object.
+    :param localMu: Serial-object for local microcontroller comms, or
+                    a SerialWorker handling them in the background.
+    :param screen: Pygame screen object, None if the UI is refreshed
+                   by another coroutine on the loop.
     :param background: Pygame background image object.
+    :param timing: Optional TimingLog to record the latency of each 
+                   stage and task of the control loop in.
+    :param loop: Optional asyncio event loop to run the tasks on, see 
+                 Scheduler.RunAsync. Blocking Scheduler.Run otherwise.
+    :param workspace: Optional WorkspaceIndex, with which unreachable 
+                      SE(3) configurations are rejected before the IK.
+    :param aMax: Optional maximum acceleration of the joints in 
+                 [rad/s^2]. If given, the trajectory is time-optimal
+                 (see TOPP) within omgMax, aMax, and the torque range 
+                 of the PWM, instead of a quintic time scaling.
+    :param clock: Optional time source of the scheduler, e.g. a 
+                  SimClock. Real time if None.
+    :param sleep: Function sleeping in clock, e.g. SimClock.Sleep.
+    :param asyncSleep: Coroutine function sleeping in clock, e.g. 
+                       SimClock.AsyncSleep.
     
     Example input:
     Initialisation of Robot args is omitted for the sake of brevity.
@@ -70,9 +90,11 @@ def PosControl(sConfig: Union[np.ndarray, List], eConfig: Union[np.ndarray, List
         if isinstance(eConfig, np.ndarray) and sConfig.shape == eConfig.shape:
             if sConfig.shape == (4,4): #Translate both to joints space 
                 sConfig, successS = IKSpace(robot.TsbHome, sConfig,
-                                    robot.screwAxes, robot.limList)
+                                    robot.screwAxes, robot.limList, 
+                                    workspace=workspace)
                 eConfig, successE = IKSpace(robot.TsbHome, eConfig, 
-                                    robot.screwAxes, robot.limList)
+                                    robot.screwAxes, robot.limList, 
+                                    workspace=workspace)
                 if not successS or not successE:
                     raise IKAlgorithmError()
     elif isinstance(eConfig, np.ndarray):
@@ -84,82 +106,105 @@ def PosControl(sConfig: Union[np.ndarray, List], eConfig: Union[np.ndarray, List
     #Obtain trajectory in joint space, for safety
     method = "joint"
     print("Generating trajectory...")
-    traj = TrajGen(robot, sConfig, eConfig, vMax, omgMax, dt, method, 
-    timeScaling=5)
-    print(f"Total estimated time for trajectory: {round(dt*traj[:,0].size, 2)} s")
-    traj, velTraj, accTraj = TrajDerivatives(traj, method, robot, dt)
     g = np.array([0,0,-9.81])
+    if aMax is None:
+        traj = TrajGen(robot, sConfig, eConfig, vMax, omgMax, dt, method, 
+        timeScaling=5)
+        traj, velTraj, accTraj = TrajDerivatives(traj, method, robot, dt, 
+                                                 timeScaling=5)
+    else:
+        #Start & end, with the end on the side avoiding the joint limits
+        path = JointTrajLims(sConfig, eConfig, robot.limList, 1, 2, 3)
+        #Motor torques of the diff drive, as computed in PIDTask
+        tauMap = np.eye(path.shape[1])
+        tauMap[3:5,3:5] = [[-1.1, -1], [1, -1]]
+        #Part of the PWM range (PWM = tau*33.78) is left for the PID
+        tauLim = 0.8*MotorTauLims(robot, 2, [1/33.78]*path.shape[1])
+        traj, velTraj, accTraj = TOPP(robot, path, omgMax, aMax, tauLim, 
+                                      dt, g, tauMap)
+    print(f"Total estimated time for trajectory: {round(dt*traj[:,0].size, 2)} s")
     FTip = np.zeros(6) #Position control, --> assume no end-effector force.
     tauPID = np.zeros(traj[0,:].size)
-    n = -1 #iterator
-    PWM = [0 for i in range(5)]
-    startTime = time.perf_counter()
-    lastFrame = time.perf_counter()
-    lastWrite = time.perf_counter()
-    lastPID = time.perf_counter()
-    print("Starting trajectory...")
-    while time.perf_counter() - startTime < dt*traj[:,0].size: #Trajectory loop
-        nPrev = n
-        n = round((time.perf_counter()-startTime)/dt)
-        if n >= traj[:,0].size:
-            break
-        if n != nPrev:
-            tauFF = FeedForward(robot, traj[n], velTraj[n], accTraj[n], g, FTip)
-            #hacky fix, but works for now
-            tauFF[0] = [0 if velTraj[n,0] == 0 else tauFF[0]][0]
-        if time.perf_counter() - lastPID >= dtPID:
-            thetaCurr = np.array(serial.currAngle[:-1]) #Exclude gripper data
-            thetaPrev = np.array(serial.prevAngle[:-1])
-            dthetaCurr = (thetaCurr - thetaPrev)/dtPID
+    #Whole torque profile up front, the loop only has to index it.
+    if timing is None:
+        timing = NULL_TIMING
+    with timing.Measure("FeedForwardBatch"):
+        tauFFTraj = FeedForwardBatch(robot, traj, velTraj, accTraj, g, FTip)
+    #hacky fix, but works for now
+    tauFFTraj[velTraj[:,0] == 0, 0] = 0
+    tauFF = tauFFTraj[0]
+    nTraj = traj[:,0].size
+    PWM = np.zeros(5)
+    limList = robot.Compile().limList
+    state = dict(n=0, tauFF=tauFF)
+    scheduler = Scheduler(clock, sleep, timing, asyncSleep)
+
+    def FFTask():
+        """Select the feed-forward torques of the current sub-config."""
+        state['n'] = min(round(scheduler.Elapsed()/dt), nTraj-1)
+        state['tauFF'] = tauFFTraj[state['n']]
+
+    def PIDTask():
+        n = state['n']
+        thetaCurr = np.array(serial.currAngle[:-1]) #Exclude gripper data
+        thetaPrev = np.array(serial.prevAngle[:-1])
+        dthetaCurr = (thetaCurr - thetaPrev)/dtPID
+        with timing.Measure("PID.Execute"):
             tauPID = PIDObj.Execute(traj[n], thetaCurr, dtPID)
-            lastPID = time.perf_counter()
-            tau = tauFF + tauPID
-            tauFric = np.zeros(5)
-            for i in range(tau.size):
-                """Compute joint friction based on friction model of joint."""
-                if not np.isclose(tauPID[i], 0, atol=1e-05) and np.isclose(dthetaCurr[i], 0, atol=1e-01):
-                    tauStat = robot.joints[i].fricPar['stat']
-                    tauFric[i] = tauStat*np.sign(tau[i])
-                elif np.isclose(tauPID[i], 0, atol=1e-05) and not np.isclose(dthetaCurr[i],0,atol=1e-01):
-                    tauKin = robot.joints[i].fricPar['kin']
-                    tauFric[i] = tauKin*np.sign(tau[i]) 
-            tau += tauFric
-            #Diff-drive properties:
-            tauJ4 = tau[3]
-            tauJ5 = tau[4]
-            tau[3] = (-tauJ4*1.1 - tauJ5) #This motor struggle more than the other
-            tau[4] = tauJ4 - tauJ5
-            # I = [Tau2Curr(tau[i], robot.joints[i].gearRatio, robot.joints[i].km, 
-            #               currLim=2) for i in range(len(robot.joints))]
-            PWM = tau*33.78 #EXPERIMENTAL
-            PWM = np.round(LimDamping(thetaCurr, PWM, robot.limList, k=20))
-            #Take care of communication on an interval basis:
-        if (time.perf_counter() - lastWrite >= dtComm):
-            SReadAndParse(serial, localMu)
-            serial.mSpeed[:-1] = [abs(val) if abs(val) < 255 else 255 for val in PWM]
-            serial.rotDirDes = [np.sign(PWM[i]) if 
-                                np.sign(PWM[i]) == 1 else 0 for i in 
-                                range(serial.lenData-1)]
-            for i in range(serial.lenData-1): #TODO: Add Gripper function
-                serial.dataOut[i] = f"{abs(serial.mSpeed[i])}|"+\
-                                    f"{serial.rotDirDes[i]}"
-            #TODO: Replace last entry w/ gripper commands
-            serial.dataOut[-1] = f"{0|0}"
-            localMu.write(f"{serial.dataOut}\n".encode('utf-8')) 
-            lastWrite = time.perf_counter()
-        #Take care of PyGame screen on an interval basis:
-        now = time.perf_counter()
-        if now - lastFrame >= dtFrame:
-            events = pygame.event.get() #To interact with pygame, avoids freezing.
-            for event in events:
-                if event.type == pygame.QUIT:
-                    raise KeyboardInterrupt
-            screen.blit(background, (0,0))
-            pygame.display.update()
-            lastFrame = time.perf_counter()
+        tau = state['tauFF'] + tauPID
+        tauFric = np.zeros(5)
+        for i in range(tau.size):
+            """Compute joint friction based on friction model of joint."""
+            if not np.isclose(tauPID[i], 0, atol=1e-05) and np.isclose(dthetaCurr[i], 0, atol=1e-01):
+                tauStat = robot.joints[i].fricPar['stat']
+                tauFric[i] = tauStat*np.sign(tau[i])
+            elif np.isclose(tauPID[i], 0, atol=1e-05) and not np.isclose(dthetaCurr[i],0,atol=1e-01):
+                tauKin = robot.joints[i].fricPar['kin']
+                tauFric[i] = tauKin*np.sign(tau[i]) 
+        tau += tauFric
+        #Diff-drive properties:
+        tauJ4 = tau[3]
+        tauJ5 = tau[4]
+        tau[3] = (-tauJ4*1.1 - tauJ5) #This motor struggle more than the other
+        tau[4] = tauJ4 - tauJ5
+        # I = [Tau2Curr(tau[i], robot.joints[i].gearRatio, robot.joints[i].km, 
+        #               currLim=2) for i in range(len(robot.joints))]
+        PWM[:] = tau*33.78 #EXPERIMENTAL
+        PWM[:] = np.round(LimDamping(thetaCurr, PWM, limList, k=20))
+
+    def CommTask():
+        serial.mSpeed[:-1] = list(PWM)
+        SExchange(serial, localMu, timing)
+
+    #Fixed-rate tasks, executed in this order when due at the same time.
+    scheduler.AddTask("FF", dt, FFTask)
+    scheduler.AddTask("PID", dtPID, PIDTask, phase=dtPID)
+    scheduler.AddTask("comm", dtComm, CommTask, phase=dtComm)
+    if screen is not None:
+        scheduler.AddTask("UI", dtFrame, lambda: UpdateFrame(screen, 
+                          background), phase=dtFrame)
+    print("Starting trajectory...")
+    if loop is None:
+        scheduler.Run(duration=dt*nTraj)
+    else:
+        loop.run_until_complete(scheduler.RunAsync(duration=dt*nTraj))
     print("Finished trajectory!")
     return None
     
+def UpdateFrame(screen: pygame.Surface, background: pygame.Surface):
+    """Refreshes the PyGame screen and handles its events, to avoid 
+    freezing of the UI.
+    :param screen: Pygame screen object.
+    :param background: Pygame background image object.
+    """
+    events = pygame.event.get()
+    for event in events:
+        if event.type == pygame.QUIT:
+            raise KeyboardInterrupt
+    screen.blit(background, (0,0))
+    pygame.display.update()
+    return events
+
 def Grip(gripping: bool, serial: SerialData):
     """Function to control the gripper.
     :param gripping: Boolean indicating if the gripper should be closed
@@ -193,8 +238,8 @@ def Grip(gripping: bool, serial: SerialData):
 
 def VelControl(robot: Robot, serial: SerialData, vel: 
                Union[List, np.ndarray], dthetaPrev: np.ndarray, 
-               dt: float, method: str, dtComm: float,PIDObj: PID) -> \
-               np.ndarray:
+               dt: float, method: str, dtComm: float,PIDObj: PID, 
+               rneaWorkspace: RNEAWorkspace=None) -> np.ndarray:
     """Single velocity control loop using feed-forward and PID to 
     compute the torque required to obtain the desired velocity, either
     in joint space or end-effector space.
@@ -212,17 +257,15 @@ def VelControl(robot: Robot, serial: SerialData, vel:
                    Teensy's code (in Teensy in [ms], here in [s])!
     :param PIDObj: PID class for storage & execution of PID-related 
                    computations.
+    :param rneaWorkspace: Optional RNEAWorkspace of the robot, reused 
+                          by the FeedForward of every control tick.
     :return dtheta: Current desired joint velocities (w/ limit damping) 
     """
     vel = np.array(vel)
     theta = serial.currAngle[:-1]
     if method == 'twist' or method == 'Twist':
         #Calculate joint velocities with pseudo-inverse Jacobian
-        Slist = np.c_[robot.screwAxes[0], robot.screwAxes[1]]
-        for i in range(2, len(robot.screwAxes)):
-            Slist = np.c_[Slist, robot.screwAxes[i]]
-        dtheta = np.dot(np.linalg.pinv(mr.JacobianSpace(Slist, theta)),
-                        vel)
+        dtheta = np.dot(Kinematics(robot, theta).JsPinv, vel)
     elif method == 'joint' or method == 'Joint':
         dtheta = vel
     else:
@@ -236,7 +279,9 @@ def VelControl(robot: Robot, serial: SerialData, vel:
                   np.array(serial.prevAngle[:-1]))/dtComm
     g = np.array([0,0,-9.81])
     FTip = np.zeros(6) #Velocity control, no FTip
-    tauFF = FeedForward(robot, theta, dtheta, ddtheta, g, FTip)
+    tauFF = FeedForward(robot, theta, dtheta, ddtheta, g, FTip, 
+                        out=None if rneaWorkspace is None else 
+                        rneaWorkspace.tau, workspace=rneaWorkspace)
     tauPID = PIDObj.Execute(dtheta, dthetaCurr, dt)
     tau = tauFF + tauPID
     #Diff-drive properties:
@@ -249,7 +294,7 @@ def VelControl(robot: Robot, serial: SerialData, vel:
     #TODO: Confirm conversion factor I --> PWM
     PWM = [Curr2MSpeed(current) for current in I]
     #Add 'directional limit damping' (k might need tweaking):
-    PWM = LimDamping(theta, PWM, robot.limList, k=20)
+    PWM = LimDamping(theta, PWM, robot.Compile().limList, k=20)
     PWM = [round(val) for val in PWM]
     serial.mSpeed[:-1] = PWM
     #TODO: Add current / PWM for gripper
@@ -257,7 +302,8 @@ def VelControl(robot: Robot, serial: SerialData, vel:
 
     
 def ForceControl(robot: Robot, serial: SerialData,
-    FTip: np.ndarray, damping: float, dt: float):
+    FTip: np.ndarray, damping: float, dt: float, 
+    rneaWorkspace: RNEAWorkspace=None):
     """ Feed-forward force control with velocity damping to ensure
     safety.
     :param robot: A Robot object describing the robot mathematically.
@@ -266,6 +312,8 @@ def ForceControl(robot: Robot, serial: SerialData,
     :param FTip: Desired end-effector wrench
     :param damping: Gain term to limit velocity of the end-effector.
     :param dt: Interval between ForceControl updates.
+    :param rneaWorkspace: Optional RNEAWorkspace of the robot, reused 
+                          by the FeedForward of every control tick.
 
     NOTE: Due to the lack of force sensors, this code is highly 
     reliant on an accurate model of the robot, which as of writing this
@@ -285,14 +333,13 @@ def ForceControl(robot: Robot, serial: SerialData,
     ddtheta = np.zeros(len(robot.joints))
     kDamping = np.eye(6)*damping
     dthetaCurr = (theta - np.array(serial.prevAngle[:-1]))/dt
-    Slist = np.c_[robot.screwAxes[0], robot.screwAxes[1]]
-    for i in range(2, len(robot.screwAxes)):
-        Slist = np.c_[Slist, robot.screwAxes[i]]
-    twist = np.dot(mr.JacobianSpace(Slist, theta), dthetaCurr)
+    twist = np.dot(Kinematics(robot, theta).Js, dthetaCurr)
     """The final term in FTip prevents the end-effector from quickly
     moving / accelerating when it is not pushing against anything."""
     FTip -= np.dot(kDamping,twist)
-    tau = FeedForward(robot, theta, dtheta, ddtheta, g, FTip)
+    tau = FeedForward(robot, theta, dtheta, ddtheta, g, FTip, 
+                      out=None if rneaWorkspace is None else 
+                      rneaWorkspace.tau, workspace=rneaWorkspace)
     #Diff-drive properties:
     tauJ4 = tau[3]
     tauJ5 = tau[4]
@@ -308,7 +355,8 @@ def ForceControl(robot: Robot, serial: SerialData,
 def ImpControl(robot: Robot, serial: SerialData, TDes: np.ndarray,
                VPrev: np.ndarray, dthetaPrev: np.ndarray, dt: float, 
                M: np.ndarray, B: np.ndarray, Kx: np.ndarray, 
-               Ka: np.ndarray, PIDObj: PID):
+               Ka: np.ndarray, PIDObj: PID, 
+               rneaWorkspace: RNEAWorkspace=None):
     """Impedance control loop in the end-effector space.
     :param robot: A Robot object describing the robot mathematically.
     :param serial: SerialData object for data transmission and 
@@ -321,13 +369,17 @@ def ImpControl(robot: Robot, serial: SerialData, TDes: np.ndarray,
     :param M: Positive-definite 6x6 impedance mass matrix
     :param B: Positive-definite 6x6 impedance damping matrix.
     :param Kx: Postive-definite 3x3 impedance linear spring matrix.
-    :param Ka: 3x3 impedance rotational spring matrix."""
+    :param Ka: 3x3 impedance rotational spring matrix.
+    :param rneaWorkspace: Optional RNEAWorkspace of the robot, reused 
+                          by the FeedForward of every control tick."""
     """Determine position & end-effector angles relative to the desired 
     configuration."""
     R,posDes = mr.TransToRp(TDes)
-    thetaDes = IKSpace(robot.TsbHome, TDes, robot.screwAxes, robot.limList)
+    model = robot.Compile()
+    thetaDes = IKSpace(model.TsbHome, TDes, model.screwS, model.limList)
     anglesDes = RToEuler(R)
-    TCurr = FKSpace(robot.TsbHome, robot.screwAxes, serial.currAngle[:-1])
+    kin = Kinematics(robot, serial.currAngle[:-1])
+    TCurr = kin.Tsb
     RCurr, posCurr = mr.TransToRp(TCurr)
     anglesCurr = RToEuler(RCurr)
     pos = posCurr - posDes
@@ -336,10 +388,7 @@ def ImpControl(robot: Robot, serial: SerialData, TDes: np.ndarray,
     """Obtain the error twist and derivative of the error twist"""
     theta = serial.currAngle[:-1]
     dtheta = (np.array(serial.currAngle[:-1]) - np.array(serial.prevAngle[:-1]))/dt
-    Slist = np.c_[robot.screwAxes[0], robot.screwAxes[1]]
-    for i in range(2, len(robot.screwAxes)):
-        Slist = np.c_[Slist, robot.screwAxes[i]]
-    V = np.dot(mr.JacobianSpace(Slist, theta), dtheta)
+    V = np.dot(kin.Js, dtheta)
     dV = (V - VPrev)/dt
     ddtheta = (dtheta - dthetaPrev)/dt
     g = np.array([0,0,-9.81])
@@ -360,7 +409,9 @@ def ImpControl(robot: Robot, serial: SerialData, TDes: np.ndarray,
     #     PIDObj.errPrev = 0
     #     PIDObj.termI = np.zeros(len(robot.joints))
     #     tauPID = 0
-    tauFF = FeedForward(robot, theta, dtheta, ddtheta, g, FTip)
+    tauFF = FeedForward(robot, theta, dtheta, ddtheta, g, FTip, 
+                        out=None if rneaWorkspace is None else 
+                        rneaWorkspace.tau, workspace=rneaWorkspace)
     tauPID = np.zeros(len(tauFF)) #Remove if experimental PID is uncommented
     tau = tauFF + tauPID
     #Diff-drive properties:
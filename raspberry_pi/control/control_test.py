@@ -8,8 +8,10 @@ sys.path.append(parent)
 
 import numpy as np
 import pygame
-from control import PosControl
-from classes import SerialData, PID
+import asyncio
+from control import PosControl, VelControl, ForceControl
+from classes import SerialData, PID, Scheduler, TimingLog, RNEAWorkspace, \
+                    SimClock, NULL_TIMING
 from robot_init import robot, robotFric
 from util import LimDamping
 
@@ -58,5 +60,187 @@ def test_LimDamping():
     assert dtheta1[1] == dtheta[1]
     assert dtheta1[2] == 0
 
+def test_LimDampingBatch():
+    """Batches match the single configurations, lists are accepted."""
+    limList = np.array([[-np.pi,np.pi], [-0.5*np.pi, 0.5*np.pi], 
+                        [-np.inf,np.inf]])
+    rng = np.random.default_rng(0)
+    theta = rng.uniform(-4, 4, (50,3))
+    dtheta = rng.uniform(-1, 1, (50,3))
+    dtheta1 = LimDamping(theta, dtheta, limList, k=20)
+    assert dtheta1.shape == (50,3)
+    for i in range(50):
+        assert np.allclose(dtheta1[i], LimDamping(theta[i], 
+                           list(dtheta[i]), limList, k=20))
+    assert np.all(np.abs(dtheta1) <= np.abs(dtheta))
+    assert np.array_equal(dtheta1[:,2], dtheta[:,2]) #No limits
+
+def test_ControlWorkspace():
+    """A shared RNEAWorkspace gives the same commands as none, with the
+    feed-forward torques written into its buffer."""
+    serial = SerialData(6, robot.joints)
+    serial.currAngle = [0.1, 0.3, -0.2, 0.1, 0.2, 0]
+    serial.prevAngle = [0.09, 0.3, -0.2, 0.1, 0.2, 0]
+    rneaWorkspace = RNEAWorkspace(robot)
+    mSpeed = []
+    for ws in [None, rneaWorkspace, rneaWorkspace]:
+        VelControl(robot, serial, np.array([0.1, 0, 0, 0, 0]), np.zeros(5), 
+                   0.05, 'joint', 0.05, PID(1, 0, 0, np.ones(5)), ws)
+        mSpeed.append(list(serial.mSpeed))
+        ForceControl(robot, serial, np.zeros(6), 0.1, 0.05, ws)
+        mSpeed.append(list(serial.mSpeed))
+    assert mSpeed[0:2] == mSpeed[2:4] == mSpeed[4:6]
+    assert np.any(rneaWorkspace.tau != 0)
+
+def test_SchedulerOrder():
+    """Check the number of executions and the deterministic order of
+    tasks that are due at the same time, using simulated time."""
+    t = [0.]
+    scheduler = Scheduler(clock=lambda: t[0], 
+                          sleep=lambda dt: t.__setitem__(0, t[0] + dt))
+    log = []
+    scheduler.AddTask("FF", 0.05, lambda: log.append(("FF", round(t[0], 3))))
+    scheduler.AddTask("PID", 0.1, lambda: log.append(("PID", round(t[0], 3))))
+    scheduler.Run(duration=1)
+    stats = scheduler.Stats()
+    assert stats["FF"]["runs"] == 20 and stats["PID"]["runs"] == 10
+    assert stats["FF"]["overruns"] == 0 and stats["PID"]["overruns"] == 0
+    assert log[0:4] == [("FF", 0), ("PID", 0), ("FF", 0.05), ("FF", 0.1)]
+    assert log[4] == ("PID", 0.1)
+
+def test_SchedulerAsync():
+    """RunAsync matches Run, awaits coroutine tasks, and shares the 
+    event loop with other coroutines while waiting."""
+    t = [0.]
+    async def AsyncSleep(dt: float):
+        t[0] += dt
+        await asyncio.sleep(0)
+    scheduler = Scheduler(clock=lambda: t[0], asyncSleep=AsyncSleep)
+    log = []
+    async def CommTask():
+        log.append(("comm", round(t[0], 3)))
+    scheduler.AddTask("FF", 0.05, lambda: log.append(("FF", round(t[0], 3))))
+    scheduler.AddTask("comm", 0.1, CommTask)
+    other = []
+    async def Other():
+        while scheduler.running or not other:
+            other.append(t[0])
+            await asyncio.sleep(0)
+    async def Main():
+        await asyncio.gather(scheduler.RunAsync(until=lambda: t[0] >= 0.5),
+                             Other())
+    asyncio.run(Main())
+    stats = scheduler.Stats()
+    assert stats["FF"]["runs"] == 11 and stats["comm"]["runs"] == 6
+    assert log[0:4] == [("FF", 0), ("comm", 0), ("FF", 0.05), ("FF", 0.1)]
+    assert len(other) >= 10 #Ran during every wait
+
+def test_SchedulerOverrun():
+    """Check if late tasks are recorded as overruns and skipped, and if
+    Stop() ends the run."""
+    t = [0.]
+    scheduler = Scheduler(clock=lambda: t[0], 
+                          sleep=lambda dt: t.__setitem__(0, t[0] + dt))
+    def SlowTask():
+        t[0] += 0.12 #Takes longer than two periods
+    scheduler.AddTask("slow", 0.05, SlowTask)
+    scheduler.Run(duration=1)
+    stats = scheduler.Stats()["slow"]
+    assert stats["overruns"] > 0
+    assert stats["runs"] + stats["overruns"] <= 21
+    assert stats["maxLate"] >= 0.05
+
+    t = [0.]
+    scheduler = Scheduler(clock=lambda: t[0], 
+                          sleep=lambda dt: t.__setitem__(0, t[0] + dt))
+    scheduler.AddTask("stop", 0.1, lambda: scheduler.Stop() if t[0] >= 0.3 
+                      else None)
+    scheduler.Run()
+    assert scheduler.Stats()["stop"]["runs"] == 4
+
+def test_TimingLog():
+    """Check the ring buffer statistics and the recording of task
+    latency & missed deadlines by the scheduler."""
+    timing = TimingLog(size=100)
+    for i in range(250):
+        timing.Record("FF", i/1000)
+    stats = timing.Summary()["FF"]
+    #Only the latest 100 samples (0.150 - 0.249 s) are kept.
+    assert stats["n"] == 250
+    assert np.isclose(stats["max"], 0.249)
+    assert np.isclose(stats["p50"], 0.1995)
+    assert 0.247 <= stats["p99"] <= 0.249
+
+    t = [0.]
+    timing = TimingLog(clock=lambda: t[0])
+    scheduler = Scheduler(clock=lambda: t[0], 
+                          sleep=lambda dt: t.__setitem__(0, t[0] + dt), 
+                          timing=timing)
+    def PIDTask():
+        with timing.Measure("PID.Execute"):
+            t[0] += 0.01 if t[0] < 0.5 else 0.12
+    scheduler.AddTask("PID", 0.05, PIDTask)
+    scheduler.Run(duration=1)
+    summary = timing.Summary()
+    assert np.isclose(summary["PID.Execute"]["p50"], 0.01)
+    assert np.isclose(summary["PID.Execute"]["max"], 0.12)
+    assert summary["PID late"]["missed"] == \
+           scheduler.Stats()["PID"]["overruns"] > 0
+    assert "PID late" in timing.Dump()
+
+def test_NullTimingLog():
+    """The shared null log records nothing, also from a scheduler."""
+    with NULL_TIMING.Measure("FeedForward"):
+        pass
+    NULL_TIMING.Record("PID", 0.01, 1)
+    scheduler = Scheduler(timing=NULL_TIMING)
+    scheduler.AddTask("PID", 0.01, lambda: None)
+    scheduler.Run(duration=0.05)
+    assert NULL_TIMING.stages == {} and NULL_TIMING.Summary() == {}
+
+def test_TimingLogDrain(tmp_path):
+    """Drain returns each sample once, at most the ring buffer, and 
+    Append writes them to a CSV file."""
+    timing = TimingLog(size=100)
+    for i in range(5):
+        timing.Record("FF", i/1000)
+    assert np.allclose(timing.Drain()["FF"], [0, 0.001, 0.002, 0.003, 0.004])
+    assert timing.Drain() == {}
+    for i in range(150):
+        timing.Record("FF", i/1000)
+    timing.Record("PID", 0.5)
+    samples = timing.Drain()
+    assert samples["FF"].size == 100 and np.isclose(samples["FF"][0], 0.05)
+    assert np.allclose(samples["PID"], [0.5])
+    csvTitle = str(tmp_path/"samples.csv")
+    timing.Record("FF", 0.002)
+    assert timing.Append(csvTitle) == 1
+    timing.Record("FF", 0.003)
+    assert timing.Append(csvTitle) == 1
+    with open(csvTitle) as csvFile:
+        assert csvFile.read() == "stage,duration [ms]\nFF,2.0000\nFF,3.0000\n"
+
+def test_SimClockAsync():
+    """Coroutines sleeping on one SimClock wake in the order of their
+    wake-up times, without each advancing the time."""
+    clock = SimClock()
+    log = []
+    schedulers = []
+    for name, period in [("fast", 0.03), ("slow", 0.05)]:
+        scheduler = Scheduler(clock, clock.Sleep, asyncSleep=clock.AsyncSleep)
+        scheduler.AddTask(name, period, lambda name=name: 
+                          log.append((name, round(clock.t, 3))))
+        schedulers.append(scheduler)
+    async def Main():
+        await asyncio.gather(*[scheduler.RunAsync(duration=0.3) 
+                               for scheduler in schedulers])
+    asyncio.run(Main())
+    assert np.isclose(clock.t, 0.3)
+    assert [t for name, t in log] == sorted(t for name, t in log)
+    stats = [scheduler.Stats() for scheduler in schedulers]
+    assert stats[0]["fast"]["runs"] == 10 and stats[1]["slow"]["runs"] == 6
+    assert stats[0]["fast"]["overruns"] == stats[1]["slow"]["overruns"] == 0
+    assert clock.sleepers == []
+
 if __name__ == "__main__":
     test_LimDamping()
@@ -6,8 +6,10 @@ current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
 
-from classes import Robot, Joint, Link
+from classes import Robot, Joint, Link, RNEAWorkspace, PID
 from robot_init import robot, robotFric
+from util import RevoluteExp6, AdjointInto, SmallAdInto, SmallAdTransInto, \
+                 RevoluteExp6Batch, AdjointBatch, SmallAdBatch, SmallAdTransBatch
 from typing import List, Tuple
 import modern_robotics as mr
 import numpy as np
@@ -36,7 +38,8 @@ def FricTau(tauComm: float, dtheta: float,  tauStat: float,
     the internal & external gearbox!
     """
     tauFric = 0
-    if np.isclose(dtheta, 0, atol=1e-04) and \
+    #Same as np.isclose(dtheta, 0, atol=1e-04), without array overhead
+    if abs(dtheta) <= 1e-04 and \
         not tauComm == 0: #Static friction
         if dtheta != 0:
             dir = np.sign(dtheta)
@@ -49,8 +52,34 @@ def FricTau(tauComm: float, dtheta: float,  tauStat: float,
     tauFric += tauComm/eff - tauComm
     return tauFric
 
+def FricTauBatch(tauComm: np.ndarray, dtheta: np.ndarray, 
+                 tauStat: np.ndarray, bVisc: np.ndarray, 
+                 tauKin: np.ndarray, eff: np.ndarray) -> np.ndarray:
+    """Element-wise version of FricTau for arrays of torques and 
+    velocities, e.g. Kxn for K simulated robots. The friction 
+    parameters broadcast against them, so n-vectors apply per joint.
+    :param tauComm: Desired torques at the output shafts.
+    :param dtheta: Joint velocities.
+    :param tauStat: Static friction torques.
+    :param bVisc: Viscous friction coefficients in (N*m^2*s)/rad
+    :param tauKin: Kinetic friction torques.
+    :param eff: Efficiencies.
+    :return tauFric: Friction torques, element-wise equal to FricTau.
+    """
+    tauComm = np.asarray(tauComm, dtype=float)
+    dtheta = np.asarray(dtheta, dtype=float)
+    moving = tauComm != 0
+    static = np.logical_and(np.abs(dtheta) <= 1e-04, moving)
+    dir = np.where(dtheta != 0, np.sign(dtheta), np.sign(tauComm))
+    tauFric = np.where(static, tauStat*dir, 
+                       np.where(moving, tauKin*np.sign(dtheta) + 
+                                bVisc*dtheta, 0))
+    tauFric += tauComm/eff - tauComm
+    return tauFric
+
 def FeedForward(robot: Robot, theta: List, dtheta: List, ddtheta: List, 
-                g: np.ndarray, FTip: np.ndarray) -> np.ndarray:
+                g: np.ndarray, FTip: np.ndarray, out: np.ndarray=None, 
+                workspace: RNEAWorkspace=None) -> np.ndarray:
     """Optimized feed-forward for the Pegasus arm, only going through 
     the Newton-Euler inverse dynamics algorithm once. Based on the
     Modern Robotics Python Library.
@@ -60,6 +89,9 @@ def FeedForward(robot: Robot, theta: List, dtheta: List, ddtheta: List,
     :param ddtheta: List of desired joint accelerations.
     :param g: 3-dimensional gravity vector in [m/s^2].
     :param FTip: 6-dimensional End-effector wrench.
+    :param out: Optional preallocated n-array to write the torques in.
+    :param workspace: Optional RNEAWorkspace of the robot, reused 
+                      between calls to avoid allocating new arrays.
     :return tau: A list of required joint torques at the output shaft.
 
     Example input:
@@ -74,92 +106,158 @@ def FeedForward(robot: Robot, theta: List, dtheta: List, ddtheta: List,
     [ 0.81  -1.343  0.767  1.754  0.958]
     """
     #Initialization
-    #Note: 6,shape is used to obtain column vectors for calculations.
     n = len(theta) #Number of joints
-    Tsi = np.eye(4)
-    AdHis = np.zeros((n+1,6,6))
-    screwS = np.c_[robot.screwAxes[0], robot.screwAxes[1]]
-    for i in range(2,n):
-        screwS = np.c_[screwS, robot.screwAxes[i]]
-    screwA = np.zeros((6, n))
-    expT = np.zeros((n,4,4))
-    AdTiiN = np.zeros((n+1,6,6))
-    """The end-effector frame (TllList[n]) is rigidly connected
-    to the frame of the previous link --> constant T_(n-1,n)"""
-    AdTiiN[n] = mr.Adjoint(mr.TransInv(robot.TllList[n]))
-    V = np.zeros((6, n+1))
-    dV = np.zeros((6, n+1))
-    dV[3:,0] = -g #Gravity is equivalent to upward acceleration
+    #Configuration-independent quantities are precomputed once.
+    model = robot.Compile()
+    screwA = model.screwA
+    if workspace is None:
+        workspace = RNEAWorkspace(robot)
+    if out is None:
+        out = np.zeros(n)
+    tau = out
+    #NOTE: Row i+1 of V, dV, and F belongs to link i, row 0 to the base.
+    expT = workspace.expT
+    AdTiiN = workspace.AdTiiN
+    V = workspace.V
+    dV = workspace.dV
+    F = workspace.F
+    Adtheta = workspace.Adtheta #Screw axis times joint velocity
+    tmp = workspace.tmp
+    tmp2 = workspace.tmp2
+    V[0] = 0
+    dV[0,0:3] = 0
+    dV[0,3:] = g
+    dV[0,3:] *= -1 #Gravity is equivalent to upward acceleration
     #This way, the gravity gets 'carried on' in forward iterations.
-    F = np.zeros((6, n+1))
-    F[:, n] = FTip
-    tau = np.zeros(n)
+    F[n] = FTip
     #Forward iterations
     for i in range(n):
+        #Exponential of A with angle theta (closed-form, revolute)
+        RevoluteExp6(screwA[i], -theta[i], out=expT[i])
+        #Adjoint of T_(i,i-1), given current config:
+        np.dot(expT[i], model.TllInv[i], out=workspace.Tii)
+        AdjointInto(workspace.Tii, out=AdTiiN[i])
         if i != n-1 and i != 1:
-            #Adjoint of the transformation matrix {i} to {s} in the home config
-            Tsi = robot.links[i].Tsi
-            AdHis[i] = mr.Adjoint(mr.TransInv(Tsi))
-            #Screw axis in frame {i}. np.array([]) to go from 1D to 2D
-            screwA[:,i] = np.dot(AdHis[i],screwS[:,i])
-            #Exponential of A with angle theta
-            expT[i] = mr.MatrixExp6(mr.VecTose3(screwA[:,i]*-theta[i]))
-            #Adjoint of T_(i,i-1), given current config:
-            AdTiiN[i] = mr.Adjoint(np.dot(expT[i],mr.TransInv(robot.TllList[i])))
-            #Twist due to joint velocity + twist due to prev. link
-            V[:,i+1] = screwA[:,i]*dtheta[i] + np.dot(AdTiiN[i], V[:,i])
-            #Acceleration due to joint acceleration + vel-prod. term + prev link
-            dV[:,i+1] = screwA[:,i]*ddtheta[i] + np.dot(AdTiiN[i], dV[:,i]) + \
-                    np.dot(mr.ad(V[:,i+1]), screwA[:,i]*dtheta[i])
+            prev = i
         elif i == n-1:
-            AdHis[i] = mr.Adjoint(mr.TransInv(Tsi))
-            screwA[:,i] = np.dot(AdHis[i],screwS[:,i])
-            expT[i] = mr.MatrixExp6(mr.VecTose3(screwA[:,i]*-theta[i]))
-            AdTiiN[i] = mr.Adjoint(np.dot(expT[i],mr.TransInv(robot.TllList[i])))
             #NOTE: Prev twist == V[:,i-1] & Prev acc == dV[:,i-1]
-            V[:,i+1] = screwA[:,i]*dtheta[i] + np.dot(AdTiiN[i], V[:,i-1])
-            dV[:,i+1] = screwA[:,i]*ddtheta[i] + np.dot(AdTiiN[i], dV[:,i-1]) + \
-                    np.dot(mr.ad(V[:,i+1]), screwA[:,i]*dtheta[i])
+            prev = i-1
         elif i == 1:
             #EXPERIMENTAL, feel free to remove.
-            #Since Joint 2 is a wormgear, expect no effect from previous joint vel.
-            AdHis[i] = mr.Adjoint(mr.TransInv(Tsi))
-            screwA[:,i] = np.dot(AdHis[i],screwS[:,i])
-            expT[i] = mr.MatrixExp6(mr.VecTose3(screwA[:,i]*-theta[i]))
-            AdTiiN[i] = mr.Adjoint(np.dot(expT[i],mr.TransInv(robot.TllList[i])))
-            V[:,i+1] = screwA[:,i]*dtheta[i]
-            dV[:,i+1] = screwA[:,i]*ddtheta[i] + np.dot(AdTiiN[i], dV[:,i-1]) + \
-                    np.dot(mr.ad(V[:,i+1]), screwA[:,i]*dtheta[i])
+            #Since Joint 2 is a wormgear, expect no effect from previous 
+            #joint vel. (V[0] == 0), only from the base acceleration.
+            prev = 0
+        np.multiply(screwA[i], dtheta[i], out=Adtheta)
+        #Twist due to joint velocity + twist due to prev. link
+        np.dot(AdTiiN[i], V[prev], out=V[i+1])
+        V[i+1] += Adtheta
+        #Acceleration due to joint acceleration + vel-prod. term + prev link
+        np.dot(AdTiiN[i], dV[prev], out=dV[i+1])
+        np.multiply(screwA[i], ddtheta[i], out=tmp)
+        dV[i+1] += tmp
+        dV[i+1] += SmallAdInto(V[i+1], Adtheta, out=tmp)
 
     #Backward iterations
     for i in range(n-1, -1, -1):
+        """Wrench due to wrench next link + link acceleration - 
+        Coriolis/centripetal terms"""
         if i != n-2 and i != 1:
-            """Wrench due to wrench next link + link acceleration - 
-            Coriolis/centripetal terms"""
-            F[:,i] = np.dot(AdTiiN[i+1].T, F[:,i+1]) + \
-                np.dot(robot.GiList[i], dV[:,i+1]) - \
-                np.dot(mr.ad(V[:,i+1]).T, np.dot(robot.GiList[i], V[:,i+1]))
+            np.dot(F[i+1], AdTiiN[i+1], out=F[i])
         elif i == n-2: #Pegasus arm specific mechanics
-            F[:,i] = np.dot(AdTiiN[i+2].T, F[:,i+2]) + \
-                np.dot(robot.GiList[i], dV[:,i+1]) - \
-                np.dot(mr.ad(V[:,i+1]).T, np.dot(robot.GiList[i], V[:,i+1]))
+            np.dot(F[i+2], AdTiiN[i+2], out=F[i])
         elif i == 1:
             #EXPERIMENTAL, feel free to remove.
             #Since Joint 2 is a wormgear, expect no effect from previous joint force.
-            F[:,i] = np.dot(robot.GiList[i], dV[:,i+1]) - \
-                     np.dot(mr.ad(V[:,i+1]).T, np.dot(robot.GiList[i], 
-                                                      V[:,i+1]))
+            F[i] = 0
+        F[i] += np.dot(model.GiList[i], dV[i+1], out=tmp)
+        np.dot(model.GiList[i], V[i+1], out=tmp2)
+        F[i] -= SmallAdTransInto(V[i+1], tmp2, out=tmp)
         """Obtain torques by projection through screwA, effectively a
         column of the Jacobian between wrenches/twists in {i} and 
         joint space"""
-        tau[i] = np.dot(F[:,i].T, screwA[:,i])
-        tau[i] /= robot.joints[i].fricPar['eff']  
+        tau[i] = np.dot(F[i], screwA[i])
+    tau /= model.eff
     return tau
 
+def FeedForwardBatch(robot: Robot, thetaN: np.ndarray, dthetaN: np.ndarray,
+                     ddthetaN: np.ndarray, g: np.ndarray, 
+                     FTipN: np.ndarray) -> np.ndarray:
+    """Vectorized version of FeedForward, evaluating the Pegasus arm 
+    specific Newton-Euler inverse dynamics for N samples (e.g. a whole 
+    trajectory) at once. The loops only run over the joints, all 
+    samples are handled by stacked NumPy operations.
+    :param robot: A Robot class describing the robot mathematically.
+    :param thetaN: Nxn array of desired joint angles.
+    :param dthetaN: Nxn array of desired joint velocities.
+    :param ddthetaN: Nxn array of desired joint accelerations.
+    :param g: 3-dimensional gravity vector in [m/s^2].
+    :param FTipN: End-effector wrench, either one 6-vector for all 
+                  samples or an Nx6 array.
+    :return tauN: Nxn array of required joint torques at the output 
+                  shaft, row k being FeedForward of sample k.
+
+    Example input:
+    (Init of Robot parameters not included for brevity)
+    robot = Robot(joints, links, TsbHome)
+    thetaN = np.array([[0,0.5*np.pi, 0.25*np.pi, 0.25*np.pi, 0]])
+    dthetaN = np.array([[0,1,0,0,0]])
+    ddthetaN = np.array([[0,1,1,1,1]])
+    g = np.array([0,0,-9.81])
+    FTipN = np.array([1,1,1,1,1,1])
+    Output:
+    [[-0.169 -0.117  0.92   0.88   1.01 ]]
+    """
+    model = robot.Compile()
+    screwA = model.screwA
+    thetaN = np.atleast_2d(np.asarray(thetaN, dtype=float))
+    dthetaN = np.atleast_2d(np.asarray(dthetaN, dtype=float))
+    ddthetaN = np.atleast_2d(np.asarray(ddthetaN, dtype=float))
+    N, n = thetaN.shape
+    #NOTE: V[i+1], dV[i+1], and F[i+1] are Nx6 arrays for link i.
+    AdTiiN = np.zeros((n+1,N,6,6))
+    AdTiiN[n] = model.AdTEF
+    V = np.zeros((n+1,N,6))
+    dV = np.zeros((n+1,N,6))
+    dV[0,:,3:] = -np.asarray(g, dtype=float)
+    F = np.zeros((n+1,N,6))
+    F[n] = FTipN
+    tauN = np.zeros((N,n))
+    #Forward iterations
+    for i in range(n):
+        expTN = RevoluteExp6Batch(screwA[i], -thetaN[:,i])
+        AdTiiN[i] = AdjointBatch(np.matmul(expTN, model.TllInv[i]))
+        if i != n-1 and i != 1:
+            prev = i
+        elif i == n-1:
+            prev = i-1
+        elif i == 1: #Wormgear, see FeedForward.
+            prev = 0
+        Adtheta = screwA[i]*dthetaN[:,i,None]
+        V[i+1] = np.einsum('kij,kj->ki', AdTiiN[i], V[prev]) + Adtheta
+        dV[i+1] = screwA[i]*ddthetaN[:,i,None] + \
+                  np.einsum('kij,kj->ki', AdTiiN[i], dV[prev]) + \
+                  SmallAdBatch(V[i+1], Adtheta)
+    #Backward iterations
+    for i in range(n-1, -1, -1):
+        if i != n-2 and i != 1:
+            F[i] = np.einsum('kji,kj->ki', AdTiiN[i+1], F[i+1])
+        elif i == n-2: #Pegasus arm specific mechanics
+            F[i] = np.einsum('kji,kj->ki', AdTiiN[i+2], F[i+2])
+        #i == 1: Wormgear, no effect from the next joint force.
+        GV = np.dot(V[i+1], model.GiList[i].T)
+        F[i] += np.dot(dV[i+1], model.GiList[i].T) - \
+                SmallAdTransBatch(V[i+1], GV)
+        tauN[:,i] = np.dot(F[i], screwA[i])
+    tauN /= model.eff
+    return tauN
+
 def MassMatrix(robot: Robot, theta: List) -> np.ndarray:
-    """Computes the mass matrix at the given configuration by calling
-    the inverse dynamics n-times, once for each column with everything
-    set to zero except one joint accelleration, set at 1.
+    """Computes the mass matrix at the given configuration with the 
+    composite rigid body algorithm, following the same Pegasus arm 
+    specific couplings as FeedForward. A forward sweep gives, for 
+    every link, the Jacobian mapping joint accelerations to its 
+    twist-derivative; a backward sweep then accumulates the composite 
+    wrenches, of which the projection on each joint screw is a row of M.
     :param robot: A Robot object describing the robot mathematically. 
     :param theta: List of current joint angles
     :return M: nxn Mass matrix, mapping joint accellerations to 
@@ -176,15 +274,43 @@ def MassMatrix(robot: Robot, theta: List) -> np.ndarray:
      [ 0.       0.00282  0.0032   0.00364  0.     ]
      [-0.00008  0.00008  0.00001  0.       0.00048]]
     """
-    n = len(theta)
+    model = robot.Compile()
+    n = model.n
+    screwA = model.screwA
+    expT = np.zeros((4,4))
+    Tii = np.zeros((4,4))
+    AdTiiN = np.zeros((n+1,6,6))
+    #NOTE: J[i+1] and C[i+1] belong to link i, row 0 is the base.
+    J = np.zeros((n+1,6,n)) #dV[i+1] = J[i+1] @ ddtheta
+    C = np.zeros((n+1,6,n)) #F[i] = C[i+1] @ ddtheta
     M = np.zeros((n,n))
-    dtheta = [0 for i in range(n)]
-    g = np.array([0,0,0])
-    FTip = np.array([0,0,0,0,0,0])
-    for i in range(n): #Obtain the ith column of the mass matrix
-        ddtheta = [0 for i in range(n)]
-        ddtheta[i] = 1 
-        M[:, i] = FeedForward(robot, theta, dtheta, ddtheta, g, FTip)
+    #Forward iterations
+    for i in range(n):
+        RevoluteExp6(screwA[i], -theta[i], out=expT)
+        np.dot(expT, model.TllInv[i], out=Tii)
+        AdjointInto(Tii, out=AdTiiN[i])
+        if i != n-1 and i != 1:
+            prev = i
+        elif i == n-1:
+            prev = i-1
+        elif i == 1: #Wormgear, see FeedForward.
+            prev = 0
+        np.dot(AdTiiN[i], J[prev], out=J[i+1])
+        J[i+1,:,i] += screwA[i]
+    #Backward iterations
+    for i in range(n-1, -1, -1):
+        #The tip wrench does not depend on ddtheta, so src == n adds 0.
+        if i != n-2 and i != 1:
+            src = i+1
+        elif i == n-2: #Pegasus arm specific mechanics
+            src = i+2
+        elif i == 1: #Wormgear, no effect from the next joint force.
+            src = None
+        np.dot(model.GiList[i], J[i+1], out=C[i+1])
+        if src is not None and src < n:
+            C[i+1] += np.dot(AdTiiN[src].T, C[src+1])
+        np.dot(screwA[i], C[i+1], out=M[i])
+    M /= model.eff[:,None]
     return M
 
 def CorrCentTorques(robot: Robot, theta: List, dtheta: List) -> np.ndarray:
@@ -266,8 +392,9 @@ def ForwardDynamics(robot: Robot, theta: List, dtheta: List,
                     -> List:
     """Calculates the joint accellerations given the supplied torque,
     current joint configuration and -velocities, as well as a gravity 
-    vector and end-effector wrench, by calling the inverse dynamics 
-    algorithm n+3 times, for n being the number of robot joints.
+    vector and end-effector wrench. Uses one pass of the composite 
+    rigid body algorithm for the mass matrix and one inverse dynamics 
+    pass for the Coriolis-, gravity- and end-effector torques.
     :param robot: A Robot object describing the robot mathematically.
     :param theta: List of current joint angles.
     :param dtheta: List of current joint velocities.
@@ -288,22 +415,226 @@ def ForwardDynamics(robot: Robot, theta: List, dtheta: List,
     Output:
     [8.3721, 25.2644, -24.1423, 23.0293, 22.2858]
     """
+    n = len(theta)
     M = MassMatrix(robot, theta)
-    tauC = CorrCentTorques(robot, theta, dtheta)
-    tauG = GravTorques(robot, theta, g)
-    tauF = FTipTorques(robot, theta, FTip)
-    tauFric = np.zeros(len(theta))
-    for i in range(len(theta)):
+    #Coriolis, gravity and end-effector torques in a single pass.
+    tauBias = FeedForward(robot, theta, dtheta, np.zeros(n), g, FTip)
+    tauFric = np.zeros(n)
+    for i in range(n):
         tauStat = robot.joints[i].fricPar['stat']
         tauKin = robot.joints[i].fricPar['kin']
         bVisc = robot.joints[i].fricPar['visc']
         eff = robot.joints[i].fricPar['eff']
         tauFric[i] = FricTau(tau[i], dtheta[i], tauStat, bVisc, tauKin, eff)
     #TODO: Consult Sander on wormgear integration
-    tauAcc = tau - tauC - tauG - tauF - tauFric
-    ddtheta = np.dot(np.linalg.inv(M), tauAcc)
+    tauAcc = tau - tauBias - tauFric
+    #M is not symmetric for the Pegasus couplings, so LU instead of 
+    #Cholesky.
+    ddtheta = np.linalg.solve(M, tauAcc)
+    return ddtheta.tolist()
+
+def ForwardDynamicsABA(robot: Robot, theta: List, dtheta: List, 
+                       tau: np.ndarray, g: np.ndarray, FTip: np.ndarray) \
+                       -> List:
+    """Calculates the joint accellerations with the O(n) articulated 
+    body algorithm, without building the mass matrix. Same interface 
+    and outcome as ForwardDynamics, including the friction model of 
+    FricTau and the Pegasus arm specific couplings of FeedForward:
+    - Link 1 (wormgear) only moves with the base, and its wrench is 
+      passed on to joint 0 without coupling back. Joint 1 is therefore 
+      solved before joint 0, after which its wrench is a known bias.
+    - The last link moves with link n-3 but does not push back on it, 
+      so it is a chain of its own, solved last.
+    :param robot: A Robot object describing the robot mathematically.
+    :param theta: List of current joint angles.
+    :param dtheta: List of current joint velocities.
+    :param tau: Array of current supplied joint torques.
+    :param g: 3-vector describing gravitational accelleration in the 
+              space frame.
+    :param FTip: 6-vector representing the desired wrench at the end-
+                 effector
+    
+    Example input:
+    (Init of Robot parameters not included for brevity)
+    robot = Robot(joints, links, TsbHome)
+    theta = [1,1,1,1,1]
+    dtheta = [1,1,1,1,1]
+    tau = [1,1,1,1,1]
+    g = np.array([0,0,-9.81])
+    FTip = np.array([1,1,1,1,1,1])
+    Output:
+    [7.273, 148.7691, -60.8764, 49.4183, 51.0472]
+    """
+    model = robot.Compile()
+    n = model.n
+    screwA = model.screwA
+    expT = np.zeros((4,4))
+    Tii = np.zeros((4,4))
+    AdTiiN = np.zeros((n+1,6,6))
+    AdTiiN[n] = model.AdTEF
+    #NOTE: Row i+1 belongs to link i, row 0 is the base.
+    V = np.zeros((n+1,6))
+    dV = np.zeros((n+1,6))
+    dV[0,3:] = -np.asarray(g, dtype=float)
+    c = np.zeros((n+1,6)) #Velocity-product accelerations
+    IA = np.zeros((n+1,6,6)) #Articulated inertias
+    pA = np.zeros((n+1,6)) #Articulated bias wrenches
+    U = np.zeros((n+1,6))
+    D = np.zeros(n+1)
+    u = np.zeros(n+1)
+    prevList = [None for i in range(n)]
+    #Forward iterations: Twists and velocity-product terms
+    for i in range(n):
+        RevoluteExp6(screwA[i], -theta[i], out=expT)
+        np.dot(expT, model.TllInv[i], out=Tii)
+        AdjointInto(Tii, out=AdTiiN[i])
+        if i != n-1 and i != 1:
+            prev = i
+        elif i == n-1:
+            prev = i-1
+        elif i == 1: #Wormgear, see FeedForward.
+            prev = 0
+        prevList[i] = prev
+        Adtheta = screwA[i]*dtheta[i]
+        V[i+1] = np.dot(AdTiiN[i], V[prev]) + Adtheta
+        SmallAdInto(V[i+1], Adtheta, out=c[i+1])
+    #Backward iterations: Articulated inertias and bias wrenches
+    for i in range(n-1, -1, -1):
+        IA[i+1] = model.GiList[i]
+        pA[i+1] = -SmallAdTransInto(V[i+1], np.dot(model.GiList[i], V[i+1]), 
+                                    out=np.zeros(6))
+        if i != n-2 and i != 1:
+            src = i+1
+        elif i == n-2: #Pegasus arm specific mechanics
+            src = i+2
+        elif i == 1: #Wormgear, no effect from the next joint force.
+            src = None
+        if src == n: #End-effector wrench is known
+            pA[i+1] += np.dot(FTip, AdTiiN[n])
+        elif src is not None and prevList[src] == i+1:
+            #Child moves with link i: Project out its joint.
+            Ia = IA[src+1] - np.outer(U[src+1], U[src+1])/D[src+1]
+            pa = pA[src+1] + np.dot(Ia, c[src+1]) + U[src+1]*u[src+1]/D[src+1]
+            IA[i+1] += np.dot(AdTiiN[src].T, np.dot(Ia, AdTiiN[src]))
+            pA[i+1] += np.dot(pa, AdTiiN[src])
+        #A child that does not move with link i (joint 0 <- link 1) is 
+        #added as known wrench in the acceleration sweep.
+        np.dot(IA[i+1], screwA[i], out=U[i+1])
+        D[i+1] = np.dot(screwA[i], U[i+1])
+        tauFric = FricTau(tau[i], dtheta[i], model.tauStat[i], 
+                          model.bVisc[i], model.tauKin[i], model.eff[i])
+        u[i+1] = model.eff[i]*(tau[i] - tauFric) - \
+                 np.dot(screwA[i], pA[i+1])
+    #Forward iterations: Accelerations, wormgear joint before joint 0.
+    ddtheta = np.zeros(n)
+    order = [1, 0] + list(range(2, n))
+    for i in order:
+        if i == 0:
+            #Wrench of link 1 is known by now
+            F1 = np.dot(IA[2], dV[2]) + pA[2]
+            biasF1 = np.dot(F1, AdTiiN[1])
+            pA[1] += biasF1
+            u[1] -= np.dot(screwA[0], biasF1)
+        dV[i+1] = np.dot(AdTiiN[i], dV[prevList[i]]) + c[i+1]
+        ddtheta[i] = (u[i+1] - np.dot(U[i+1], dV[i+1]))/D[i+1]
+        dV[i+1] += screwA[i]*ddtheta[i]
     return ddtheta.tolist()
 
+def ForwardDynamicsBatch(robot: Robot, thetaK: np.ndarray, 
+                         dthetaK: np.ndarray, tauK: np.ndarray, 
+                         g: np.ndarray, FTip: np.ndarray) -> np.ndarray:
+    """Vectorized version of ForwardDynamicsABA, computing the joint 
+    accelerations of K independent robot states at once. The loops 
+    only run over the joints, all states are handled by stacked NumPy 
+    operations.
+    :param robot: A Robot object describing the robot mathematically.
+    :param thetaK: Kxn array of current joint angles.
+    :param dthetaK: Kxn array of current joint velocities.
+    :param tauK: Kxn array of current supplied joint torques.
+    :param g: 3-vector describing gravitational accelleration in the 
+              space frame.
+    :param FTip: End-effector wrench, either one 6-vector for all 
+                 states or a Kx6 array.
+    :return ddthetaK: Kxn array of joint accelerations, row k being 
+                      ForwardDynamicsABA of state k.
+    """
+    model = robot.Compile()
+    n = model.n
+    screwA = model.screwA
+    thetaK = np.atleast_2d(np.asarray(thetaK, dtype=float))
+    dthetaK = np.atleast_2d(np.asarray(dthetaK, dtype=float))
+    tauK = np.atleast_2d(np.asarray(tauK, dtype=float))
+    K = thetaK.shape[0]
+    #NOTE: Row i+1 belongs to link i, row 0 is the base.
+    AdTiiN = np.zeros((n,K,6,6))
+    V = np.zeros((n+1,K,6))
+    dV = np.zeros((n+1,K,6))
+    dV[0,:,3:] = -np.asarray(g, dtype=float)
+    c = np.zeros((n+1,K,6))
+    IA = np.zeros((n+1,K,6,6))
+    pA = np.zeros((n+1,K,6))
+    U = np.zeros((n+1,K,6))
+    D = np.zeros((n+1,K))
+    u = np.zeros((n+1,K))
+    prevList = [None for i in range(n)]
+    tauFric = FricTauBatch(tauK, dthetaK, model.tauStat, model.bVisc, 
+                           model.tauKin, model.eff)
+    #Forward iterations: Twists and velocity-product terms
+    for i in range(n):
+        expTN = RevoluteExp6Batch(screwA[i], -thetaK[:,i])
+        AdTiiN[i] = AdjointBatch(np.matmul(expTN, model.TllInv[i]))
+        if i != n-1 and i != 1:
+            prev = i
+        elif i == n-1:
+            prev = i-1
+        elif i == 1: #Wormgear, see FeedForward.
+            prev = 0
+        prevList[i] = prev
+        Adtheta = screwA[i]*dthetaK[:,i,None]
+        V[i+1] = np.einsum('kij,kj->ki', AdTiiN[i], V[prev]) + Adtheta
+        c[i+1] = SmallAdBatch(V[i+1], Adtheta)
+    #Backward iterations: Articulated inertias and bias wrenches
+    for i in range(n-1, -1, -1):
+        IA[i+1] = model.GiList[i]
+        GV = np.dot(V[i+1], model.GiList[i].T)
+        pA[i+1] = -SmallAdTransBatch(V[i+1], GV)
+        if i != n-2 and i != 1:
+            src = i+1
+        elif i == n-2: #Pegasus arm specific mechanics
+            src = i+2
+        elif i == 1: #Wormgear, no effect from the next joint force.
+            src = None
+        if src == n: #End-effector wrench is known
+            pA[i+1] += np.dot(FTip, model.AdTEF)
+        elif src is not None and prevList[src] == i+1:
+            Ia = IA[src+1] - U[src+1,:,:,None]*U[src+1,:,None,:]/ \
+                 D[src+1,:,None,None]
+            pa = pA[src+1] + np.einsum('kij,kj->ki', Ia, c[src+1]) + \
+                 U[src+1]*(u[src+1]/D[src+1])[:,None]
+            IA[i+1] += np.matmul(AdTiiN[src].transpose(0,2,1), 
+                                 np.matmul(Ia, AdTiiN[src]))
+            pA[i+1] += np.einsum('kji,kj->ki', AdTiiN[src], pa)
+        np.dot(IA[i+1], screwA[i], out=U[i+1])
+        D[i+1] = np.dot(U[i+1], screwA[i])
+        u[i+1] = model.eff[i]*(tauK[:,i] - tauFric[:,i]) - \
+                 np.dot(pA[i+1], screwA[i])
+    #Forward iterations: Accelerations, wormgear joint before joint 0.
+    ddthetaK = np.zeros((K,n))
+    order = [1, 0] + list(range(2, n))
+    for i in order:
+        if i == 0:
+            #Wrench of link 1 is known by now
+            F1 = np.einsum('kij,kj->ki', IA[2], dV[2]) + pA[2]
+            biasF1 = np.einsum('kji,kj->ki', AdTiiN[1], F1)
+            pA[1] += biasF1
+            u[1] -= np.dot(biasF1, screwA[0])
+        dV[i+1] = np.einsum('kij,kj->ki', AdTiiN[i], dV[prevList[i]]) + \
+                  c[i+1]
+        ddthetaK[:,i] = (u[i+1] - np.einsum('ki,ki->k', U[i+1], dV[i+1]))/\
+                        D[i+1]
+        dV[i+1] += screwA[i]*ddthetaK[:,i,None]
+    return ddthetaK
+
 def SimulateStep(robot: Robot, thetaPrev: List, dthetaPrev: List, 
                  ddthetaPrev: List, tau: np.ndarray, g: np.ndarray, 
                  FTip: np.ndarray, dt: float) -> Tuple[List]:
@@ -344,13 +675,99 @@ def SimulateStep(robot: Robot, thetaPrev: List, dthetaPrev: List,
     n = len(thetaPrev)
     theta = [None for i in range(n)]
     dtheta = [None for i in range(n)]
-    ddtheta = ForwardDynamics(robot, thetaPrev, dthetaPrev, tau, g, FTip)
+    ddtheta = ForwardDynamicsABA(robot, thetaPrev, dthetaPrev, tau, g, FTip)
     for i in range(len(ddtheta)):
          #Trapezoidal integration
         dtheta[i] = dthetaPrev[i] + ((ddthetaPrev[i] + ddtheta[i])/2)*dt
         theta[i] = thetaPrev[i] + ((dthetaPrev[i] + dtheta[i])/2)*dt 
     return (theta, dtheta, ddtheta)
 
+def SimulateBatch(robot: Robot, theta0: np.ndarray, dtheta0: np.ndarray, 
+                  thetaRef: np.ndarray, tauIn: np.ndarray, kP: np.ndarray, 
+                  kI: np.ndarray, kD: np.ndarray, ILim: np.ndarray, 
+                  g: np.ndarray, FTip: np.ndarray, dt: float, 
+                  tauConst: np.ndarray=None) -> np.ndarray:
+    """Simulates K independent robots in lockstep, each under its own 
+    PID gains and torque input, for instance to sweep candidate gains 
+    for sett['kPP'], sett['kIP'] and sett['kDP']. Every time step, 
+    the output of a PID object executing all K controllers is added to 
+    the input torque, after which ForwardDynamicsBatch and the 
+    trapezoidal integration of SimulateStep advance all states.
+    :param robot: A Robot object describing the robot mathematically.
+    :param theta0: Initial joint angles, Kxn or one n-vector for all.
+    :param dtheta0: Initial joint velocities, Kxn or one n-vector.
+    :param thetaRef: Reference joint angles for the PID, either Txn 
+                     (shared) or KxTxn, for T time steps.
+    :param tauIn: Input torques (e.g. feed-forward), either one 
+                  n-vector (constant, for all robots), Txn (shared) or 
+                  KxTxn.
+    :param kP: Proportional gain matrices, Kxnxn or one nxn matrix.
+    :param kI: Integral gain matrices, Kxnxn or one nxn matrix.
+    :param kD: Differential gain matrices, Kxnxn or one nxn matrix.
+    :param ILim: n-vector limiting the integral term (anti-windup).
+    :param g: 3-vector describing gravitational acceleration in the 
+              space frame.
+    :param FTip: 6-vector representing the wrench at the end-effector.
+    :param dt: Time step in seconds, also used as PID interval.
+    :param tauConst: Optional Kxn input torques, constant in time, of
+                     each robot, added to tauIn.
+    :return traj: 3xKx(T+1)xn array, traj[0] being the joint angles,
+                  traj[1] the joint velocities, and traj[2] the joint 
+                  accelerations of each robot, starting at theta0.
+
+    Example input:
+    (Init of Robot parameters not included for brevity)
+    robot = Robot(joints, links, TsbHome)
+    K, T = 1000, 2000
+    theta0 = np.zeros(5)
+    dtheta0 = np.zeros(5)
+    thetaRef = np.tile([0,0.1,0.1,0.1,0], (T,1))
+    tauIn = np.zeros(5)
+    kP = np.random.rand(K,1,5)*30*np.eye(5)
+    kI = sett['kIP']
+    kD = sett['kDP']
+    ILim = np.array([2,2,2,2,2])
+    g = np.array([0,0,-9.81])
+    FTip = np.zeros(6)
+    dt = 0.001
+    Output:
+    Array of shape (3, 1000, 2001, 5)
+    """
+    thetaRef = np.asarray(thetaRef, dtype=float)
+    tauIn = np.asarray(tauIn, dtype=float)
+    kP = np.asarray(kP, dtype=float)
+    kI = np.asarray(kI, dtype=float)
+    kD = np.asarray(kD, dtype=float)
+    T, n = thetaRef.shape[-2:]
+    #Only stacked (3-D) arguments, and the explicit Kxn ones, set K
+    K = max(np.atleast_2d(theta0).shape[0], np.atleast_2d(dtheta0).shape[0], 
+            kP.shape[0] if kP.ndim == 3 else 1, 
+            kI.shape[0] if kI.ndim == 3 else 1, 
+            kD.shape[0] if kD.ndim == 3 else 1, 
+            thetaRef.shape[0] if thetaRef.ndim == 3 else 1, 
+            tauIn.shape[0] if tauIn.ndim == 3 else 1,
+            np.atleast_2d(tauConst).shape[0] if tauConst is not None else 1)
+    tauIn = np.broadcast_to(tauIn, (K,T,n))
+    if tauConst is not None:
+        tauIn = tauIn + np.atleast_2d(tauConst)[:,None,:]
+    thetaRef = np.broadcast_to(thetaRef, (K,T,n))
+    PIDObj = PID(kP, kI, kD, ILim, K=K)
+    tauPID = np.zeros((K,n))
+    traj = np.zeros((3,K,T+1,n))
+    traj[0,:,0] = theta0
+    traj[1,:,0] = dtheta0
+    for t in range(T):
+        theta = traj[0,:,t]
+        dtheta = traj[1,:,t]
+        PIDObj.Execute(thetaRef[:,t], theta, dt, out=tauPID)
+        tau = tauIn[:,t] + tauPID
+        ddtheta = ForwardDynamicsBatch(robot, theta, dtheta, tau, g, FTip)
+        #Trapezoidal integration
+        traj[2,:,t+1] = ddtheta
+        traj[1,:,t+1] = dtheta + ((traj[2,:,t] + ddtheta)/2)*dt
+        traj[0,:,t+1] = theta + ((dtheta + traj[1,:,t+1])/2)*dt
+    return traj
+
 if __name__ == "__main__":
     theta = np.array([0, 0.05*np.pi, 0.05*np.pi, 0.05*np.pi, 0.05*np.pi])
     dtheta = np.array([0.1*np.pi, 0.1*np.pi, 0.1*np.pi, 0.1*np.pi, 0.1*np.pi])
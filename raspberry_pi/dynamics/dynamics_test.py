@@ -8,11 +8,12 @@ current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
 
+import tracemalloc
 import numpy as np
 import modern_robotics as mr
-from classes import Robot, Link, Joint
-from robot_init import robot
-from dynamics.dynamics_funcs import FricTau, FeedForward, MassMatrix, CorrCentTorques, GravTorques, FTipTorques, ForwardDynamics, SimulateStep
+from classes import Robot, Link, Joint, RNEAWorkspace, PID
+from robot_init import robot, robotFric
+from dynamics.dynamics_funcs import FricTau, FeedForward, FeedForwardBatch, MassMatrix, CorrCentTorques, GravTorques, FTipTorques, ForwardDynamics, ForwardDynamicsABA, SimulateStep, SimulateBatch
 
 np.set_printoptions(precision=3)
 
@@ -358,4 +359,146 @@ def test_SimStep():
                  FTip, dt)
     for i in range(len(thetaTup)):
         for j in range(len(thetaTup[i])):
-            assert thetaTup[i][j] != 0
\ No newline at end of file
+            assert thetaTup[i][j] != 0
+def test_Compile():
+    """Check if the compiled robot packs the same quantities as the 
+    Robot object, and is only rebuilt on request."""
+    compiled = robot.Compile()
+    assert compiled is robot.Compile()
+    Slist = np.c_[robot.screwAxes[0], robot.screwAxes[1]]
+    for i in range(2, len(robot.screwAxes)):
+        Slist = np.c_[Slist, robot.screwAxes[i]]
+    assert np.array_equal(compiled.screwS, Slist)
+    assert compiled.screwS.flags['C_CONTIGUOUS']
+    for i in range(len(robot.joints)):
+        assert np.allclose(compiled.TllInv[i], mr.TransInv(robot.TllList[i]))
+        assert compiled.eff[i] == robot.joints[i].fricPar['eff']
+    assert robot.Compile(recompile=True) is not compiled
+
+def test_FFWorkspace():
+    """Check if reusing a workspace gives the same torques as a fresh
+    FeedForward call, and that it does not allocate in steady state."""
+    theta = np.random.rand(5)
+    dtheta = np.random.rand(5)
+    ddtheta = np.random.rand(5)
+    g = np.array([0,0,-9.81])
+    FTip = np.random.rand(6)
+    tau = FeedForward(robot, theta, dtheta, ddtheta, g, FTip)
+    workspace = RNEAWorkspace(robot)
+    tauOut = np.zeros(5)
+    tau2 = FeedForward(robot, theta, dtheta, ddtheta, g, FTip, out=tauOut,
+                       workspace=workspace)
+    assert tau2 is tauOut
+    assert np.allclose(tau, tau2)
+    tracemalloc.start()
+    for i in range(100):
+        FeedForward(robot, theta, dtheta, ddtheta, g, FTip, out=tauOut,
+                    workspace=workspace)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    #Only short-lived scalars, no arrays: Smaller than a single 5x6x6.
+    assert peak < 5*36*8
+
+def test_FFBatch():
+    """Check if the batched FeedForward matches the per-sample one."""
+    N = 50
+    thetaN = np.random.rand(N,5)
+    dthetaN = np.random.rand(N,5)
+    ddthetaN = np.random.rand(N,5)
+    g = np.array([0,0,-9.81])
+    FTipN = np.random.rand(N,6)
+    tauN = FeedForwardBatch(robot, thetaN, dthetaN, ddthetaN, g, FTipN)
+    assert tauN.shape == (N,5)
+    for k in range(N):
+        tau = FeedForward(robot, thetaN[k], dthetaN[k], ddthetaN[k], g, 
+                          FTipN[k])
+        assert np.allclose(tauN[k], tau)
+
+def test_MassMatrixColumns():
+    """Check if the composite rigid body mass matrix equals the one 
+    obtained by n inverse dynamics calls with unit accelerations."""
+    theta = np.random.rand(5)*2*np.pi
+    M = MassMatrix(robot, theta)
+    for i in range(5):
+        ddtheta = np.zeros(5)
+        ddtheta[i] = 1
+        col = FeedForward(robot, theta, np.zeros(5), ddtheta, np.zeros(3), 
+                          np.zeros(6))
+        assert np.allclose(M[:,i], col)
+
+def test_FDABA():
+    """Check if the articulated body algorithm obtains the same joint
+    accelerations as the mass matrix based Forward Dynamics, with and
+    without friction."""
+    for robotObj in [robot, robotFric]:
+        theta = np.random.rand(5)*2*np.pi
+        dtheta = np.random.rand(5)
+        dtheta[2] = 0 #Static friction branch
+        tau = np.random.rand(5)
+        g = np.array([0,0,-9.81])
+        FTip = np.random.rand(6)
+        ddtheta = ForwardDynamics(robotObj, theta, dtheta, tau, g, FTip)
+        ddthetaABA = ForwardDynamicsABA(robotObj, theta, dtheta, tau, g, FTip)
+        assert np.allclose(ddtheta, ddthetaABA)
+
+def test_SimBatch():
+    """Check if the lockstep simulation of K robots with their own PID
+    gains equals running PID.Execute and SimulateStep for each robot."""
+    K, T = 3, 10
+    dt = 0.0001
+    kP = np.random.rand(K,1,5)*3*np.eye(5)
+    kI = np.diag([4,6,12,3,3])
+    kD = 0.01*np.diag([2,2,4,1,1])
+    ILim = np.array([2,2,2,2,2])
+    thetaRef = np.tile([0,0.1,0.1,0.1,0], (T,1))
+    tauIn = 0.1*np.random.rand(T,5)
+    g = np.array([0,0,-9.81])
+    FTip = np.zeros(6)
+    traj = SimulateBatch(robotFric, np.zeros(5), np.zeros(5), thetaRef, 
+                         tauIn, kP, kI, kD, ILim, g, FTip, dt)
+    assert traj.shape == (3,K,T+1,5)
+    for k in range(K):
+        PIDObj = PID(kP[k], kI, kD, ILim)
+        theta, dtheta, ddtheta = [0]*5, [0]*5, [0]*5
+        for t in range(T):
+            tau = tauIn[t] + PIDObj.Execute(thetaRef[t], np.array(theta), dt)
+            theta, dtheta, ddtheta = SimulateStep(robotFric, theta, dtheta, 
+                                                  ddtheta, tau, g, FTip, dt)
+            assert np.allclose(theta, traj[0,k,t+1], atol=1e-12)
+            assert np.allclose(ddtheta, traj[2,k,t+1])
+
+def test_SimBatchShapes():
+    """K follows only from the stacked arguments: A constant n-vector
+    tauIn is one robot, also when T equals n, and Kxn torques per robot
+    are passed explicitly as tauConst."""
+    T, dt = 5, 0.0001
+    kP = np.diag([3,3,3,3,3])
+    kI = np.diag([4,6,12,3,3])
+    kD = 0.01*np.diag([2,2,4,1,1])
+    ILim = np.array([2,2,2,2,2])
+    thetaRef = np.tile([0,0.1,0.1,0.1,0], (T,1))
+    g = np.array([0,0,-9.81])
+    FTip = np.zeros(6)
+    args = (kI, kD, ILim, g, FTip, dt)
+    traj = SimulateBatch(robot, np.zeros(5), np.zeros(5), thetaRef, 
+                         np.zeros(5), kP, *args)
+    assert traj.shape == (3,1,T+1,5)
+    kP3 = np.random.rand(3,1,5)*3*np.eye(5)
+    traj = SimulateBatch(robot, np.zeros(5), np.zeros(5), thetaRef, 
+                         0.1*np.ones(5), kP3, *args)
+    assert traj.shape == (3,3,T+1,5)
+    tauIn = 0.1*np.random.rand(T,5) #Txn with T == n: shared in time
+    trajShared = SimulateBatch(robot, np.zeros(5), np.zeros(5), thetaRef, 
+                               tauIn, kP, *args)
+    assert trajShared.shape == (3,1,T+1,5)
+    trajStacked = SimulateBatch(robot, np.zeros(5), np.zeros(5), thetaRef, 
+                                np.tile(tauIn, (2,1,1)), kP, *args)
+    assert trajStacked.shape == (3,2,T+1,5)
+    assert np.allclose(trajStacked[:,1], trajShared[:,0])
+    tauConst = 0.1*np.random.rand(4,5)
+    traj = SimulateBatch(robot, np.zeros(5), np.zeros(5), thetaRef, 
+                         np.zeros(5), kP, *args, tauConst=tauConst)
+    assert traj.shape == (3,4,T+1,5)
+    trajOne = SimulateBatch(robot, np.zeros(5), np.zeros(5), thetaRef, 
+                            tauConst[2], kP, *args)
+    assert np.allclose(traj[:,2], trajOne[:,0])
@@ -14,16 +14,19 @@ from dynamics.dynamics_funcs import FeedForward
 from robot_init import robot as Pegasus
 from settings import sett
 from typing import Tuple
-from classes import SerialData, Robot, PID
+from classes import SerialData, Robot, PID, Scheduler, TimingLog
 from util import Tau2Curr, Curr2MSpeed, LimDamping
-from serial_comm.serial_comm import StartComms, SReadAndParse
-from control.control import PosControl
-from main import HoldPos
+from serial_comm.serial_comm import StartComms, SReadAndParse, \
+                                    NegotiateProtocol
+from control.control import PosControl, UpdateFrame
+from main import HoldPos, CommTask
 
 dataMat = np.zeros((1,8)) #First three for encoder readings, second three for output torques
 serial = SerialData(6, Pegasus.joints)
 #port = FindSerial(askInput=True)[0]
 Teensy = StartComms('COM13') #TEMPORARY, REPLACE WITH port
+NegotiateProtocol(serial, Teensy)
+timing = TimingLog()
 try:
     PIDObj = sett['PIDP']
     g = np.array([0,0,-9.81])
@@ -40,23 +43,28 @@ try:
     screen = pygame.display.set_mode([700, 500])
     background = pygame.image.load(os.path.join(parent,'control_overview.png'))
     PosControl(thetaStart, thetaDes, Pegasus, serial, 0.1, 0.1, 0.1, PIDObj, dtComm, dtAct, sett['dtFrame'], Teensy, screen, background)
-    lastHold = -100 #Last hold should run first
-    lastComm = time.perf_counter()
-    lastFrame = time.perf_counter()
     dtHold = sett['dtFF']
     dtFrame = sett['dtFrame']
-    PWM = serial.mSpeed[:-1]
     newRow = np.zeros((1,8)) #TEMP
+
+    def HoldTask():
+        global dataMat
+        tau = HoldPos(serial, Pegasus, PIDObj, thetaDes, dtHold, timing)
+        newRow[0,0:4] = np.array([np.array(serial.currAngle[1:-1]) - thetaDes[1:]])
+        newRow[0,4:] = tau[1:]
+        dataMat = np.vstack((dataMat, newRow))
+
+    scheduler = Scheduler(timing=timing)
+    scheduler.AddTask("hold", dtHold, HoldTask)
+    scheduler.AddTask("comm", dtComm, lambda: CommTask(serial, Teensy, timing), 
+                      phase=dtComm)
+    scheduler.AddTask("UI", dtFrame, lambda: UpdateFrame(screen, background), 
+                      phase=dtFrame)
     print("Start holding")
-    while True:
-        if time.perf_counter() - lastHold >= dtHold:
-            lastComm, lastFrame, tau = HoldPos(serial, Teensy, Pegasus, PIDObj, thetaDes, lastComm, lastFrame, dtComm, dtHold, dtFrame, screen, background)
-            lastHold = time.perf_counter()
-            newRow[0,0:4] = np.array([np.array(serial.currAngle[1:-1]) - thetaDes[1:]])
-            newRow[0,4:] = tau[1:]
-            dataMat = np.vstack((dataMat, newRow))
+    scheduler.Run()
 finally:
     np.savetxt("PIDDataLowAngle4.csv", dataMat, fmt="%.4f", delimiter=',')
+    timing.Dump()
     serial.dataOut = [f"{0|0}" for i in range(serial.lenData)]
     Teensy.write(f"{serial.dataOut}\n".encode('utf-8'))
     Teensy.__del__()
@@ -9,11 +9,35 @@ sys.path.append(parent)
 import modern_robotics as mr
 import numpy as np
 from typing import List, Tuple
-from util import ThetaInitGuess, screwsToMat, screwsToMat1D, screwsToMatT
-from classes import IKAlgorithmError
+from util import ThetaInitGuess, screwsToMat1D, RevoluteExp6, AdjointInto, \
+                 RevoluteExp6Batch, AdjointBatch
+from classes import IKAlgorithmError, InputError, Robot, KinematicsCache, \
+                    WorkspaceIndex
 
 #TODO: REVISIT KINEMATICS: Reduces unreliable results for Pegasus Arm!
 
+def SpaceScrewMat(spaceScrews: List[np.ndarray]) -> np.ndarray:
+    """Translates screw axes into the 6xn matrix desired by the Modern
+    Robotics library, regardless of the shape of each screw vector.
+    :param spaceScrews: List of screw vectors, either 6x1, 1x6, or 1D 
+                        with 6 entries, or a 6xn matrix with the screw
+                        axes as its columns (e.g. CompiledRobot.screwS).
+    :return screwMat: 6xn matrix with the screw axes as the columns.
+    Example input:
+    spaceScrews = (np.array([0, 1, 0, 0, 0, 0.2]), 
+                   np.array([[0, 0, 1, 0.1, 0, 0]]))
+    Output:
+    np.array([[0, 0]
+              [1, 0]
+              [0, 1]
+              [0, 0.1]
+              [0, 0]
+              [0.2, 0]]"""
+    if isinstance(spaceScrews, np.ndarray) and spaceScrews.ndim == 2:
+        return spaceScrews
+    return screwsToMat1D([np.asarray(screw).reshape(-1) for screw in 
+                          spaceScrews])
+
 def FKSpace(TsbHome: np.ndarray, spaceScrews: List[np.ndarray], 
            thetaList: List[float]) -> np.ndarray:
     """Computes the 4x4 SO(3) matrix of the end-effector configuration
@@ -24,7 +48,8 @@ def FKSpace(TsbHome: np.ndarray, spaceScrews: List[np.ndarray],
                     robot is in its home configuration.
     :param spaceScrews: List of 6x1 screw vectors in the space frame, 
                         as per Definition 3.24 of the Modern Robotics 
-                        book.
+                        book, or a 6xn matrix with the screw axes as 
+                        its columns (e.g. CompiledRobot.screwS).
     :return TsbNew: The new end-effector configuration based on the 
                     list of joint angles.
     
@@ -37,32 +62,460 @@ def FKSpace(TsbHome: np.ndarray, spaceScrews: List[np.ndarray],
     spaceScrews = [np.array([0,0,1,0,0.1,0]), np.array([0,1,0,0.2,0,0])]
     thetaList = np.array([0.5*np.pi, 0.25*np.pi])
     Output:
-    [[ 0.     -1.      0.      0.1   ]
-    [ 0.7071  0.      0.7071  0.2414]
-    [-0.7071  0.      0.7071  0.0414]
+    [[ 0.     -1.      0.     -0.1   ]
+    [ 0.7071  0.      0.7071  0.4536]
+    [-0.7071  0.      0.7071 -0.1293]
     [ 0.      0.      0.      1.    ]]
     """
-    spaceMat = screwsToMat(spaceScrews)
-    try:
-        #Uses Product of Exponentials, see Modern Robotics, Chapter 4.1
-        TsbNew = mr.FKinSpace(TsbHome, spaceMat, thetaList) 
-    except IndexError as e:
-        if "array is 1-dimensional" in str(e):
-            spaceMat = screwsToMat1D(spaceScrews)
-        elif "out of bounds" in str(e): #Non-transposed screw axes.
-            spaceMat = screwsToMatT(spaceScrews)
-        TsbNew = mr.FKinBody(TsbHome, spaceMat, thetaList)
-        DistToSE3 = mr.DistanceToSE3(TsbNew)
-        if DistToSE3 < 1e+9 and DistToSE3 > 1e-15:
-            #Compensate for numerical rounding errors
-            TsbNew = mr.ProjectToSE3(TsbNew)
+    spaceMat = SpaceScrewMat(spaceScrews)
+    if not np.all(np.any(spaceMat[0:3] != 0, axis=0)): #Prismatic joints
+        return mr.FKinSpace(TsbHome, spaceMat, thetaList)
+    #Uses Product of Exponentials, see Modern Robotics, Chapter 4.1
+    TsbNew = np.eye(4)
+    expT = np.zeros((4,4))
+    for i in range(spaceMat.shape[1]):
+        TsbNew = np.dot(TsbNew, RevoluteExp6(spaceMat[:,i], thetaList[i], 
+                                             out=expT))
     #TODO: Add checks to see if screw axes are normalized 
     #(i.e. either |rotational part| == 1, or |linear part| == 1)
-    return TsbNew
+    return np.dot(TsbNew, TsbHome)
+
+def PoEBatch(TsbHome: np.ndarray, spaceScrews: List[np.ndarray], 
+             thetaN: np.ndarray) -> np.ndarray:
+    """Product of exponentials for N joint configurations at once: Per
+    joint, the exponentials of all configurations are stacked with 
+    RevoluteExp6Batch and multiplied in one matmul, without a Python 
+    loop over the configurations.
+    :param TsbHome: The SO(3) transformation matrix from the space 
+                    frame {s} to the end-effector frame {b} when the 
+                    robot is in its home configuration.
+    :param spaceScrews: List of screw vectors in the space frame, or a
+                        6xn matrix with the screw axes as its columns.
+    :param thetaN: Nxn array of joint angles.
+    :return TsbN: Nx4x4 array of end-effector configurations.
+    """
+    spaceMat = SpaceScrewMat(spaceScrews)
+    thetaN = np.atleast_2d(np.asarray(thetaN, dtype=float))
+    if not np.all(np.any(spaceMat[0:3] != 0, axis=0)): #Prismatic joints
+        return np.array([FKSpace(TsbHome, spaceMat, theta) for theta in 
+                         thetaN]).reshape(-1,4,4)
+    TsbN = RevoluteExp6Batch(spaceMat[:,0], thetaN[:,0])
+    for i in range(1, spaceMat.shape[1]):
+        TsbN = np.matmul(TsbN, RevoluteExp6Batch(spaceMat[:,i], 
+                                                 thetaN[:,i]))
+    return np.matmul(TsbN, TsbHome)
+
+def FKSpaceBatch(robot: Robot, thetaN: np.ndarray) -> np.ndarray:
+    """Computes the end-effector configurations of N joint 
+    configurations at once, e.g. for workspace sampling or checking a
+    whole trajectory. Vectorized equivalent of FKSpace, see PoEBatch.
+    :param robot: A Robot object describing the robot mathematically.
+    :param thetaN: Nxn array of joint angles, e.g. a trajectory.
+    :return TsbN: Nx4x4 array of end-effector configurations.
+
+    Example input:
+    robot = robot #Of robot_init.py
+    thetaN = np.zeros((1000,5))
+    Output:
+    Array of shape (1000, 4, 4), each equal to robot.TsbHome
+    """
+    model = robot.Compile()
+    return PoEBatch(model.TsbHome, model.screwS, thetaN)
+
+def JacobianSpace(spaceScrews: List[np.ndarray], thetaList: List[float]) \
+                  -> np.ndarray:
+    """Computes the space Jacobian of a robot with revolute joints, 
+    equal to mr.JacobianSpace, using closed-form joint exponentials.
+    :param spaceScrews: List of 6x1 screw vectors in the space frame, 
+                        or a 6xn matrix with the screw axes as its 
+                        columns (e.g. CompiledRobot.screwS).
+    :param thetaList: List of joint angles.
+    :return Js: 6xn space Jacobian, mapping joint velocities to the 
+                end-effector twist in the space frame.
+
+    Example input:
+    spaceScrews = [np.array([0,0,1,0,0,0]), np.array([0,1,0,-0.1,0,0])]
+    thetaList = [0.5*np.pi, 0]
+    Output:
+    [[ 0.  -1. ]
+     [ 0.   0. ]
+     [ 1.   0. ]
+     [ 0.   0. ]
+     [ 0.  -0.1]
+     [ 0.   0. ]]
+    """
+    spaceMat = SpaceScrewMat(spaceScrews)
+    if not np.all(np.any(spaceMat[0:3] != 0, axis=0)): #Prismatic joints
+        return mr.JacobianSpace(spaceMat, thetaList)
+    Js = np.array(spaceMat, dtype=float)
+    T = np.eye(4)
+    expT = np.zeros((4,4))
+    AdT = np.zeros((6,6))
+    for i in range(1, spaceMat.shape[1]):
+        T = np.dot(T, RevoluteExp6(spaceMat[:,i-1], thetaList[i-1], 
+                                   out=expT))
+        Js[:,i] = np.dot(AdjointInto(T, out=AdT), spaceMat[:,i])
+    return Js
+
+def JacobianSpaceBatch(spaceScrews: List[np.ndarray], thetaN: np.ndarray) \
+                       -> np.ndarray:
+    """Space Jacobians of N joint configurations at once, e.g. along a
+    trajectory. Vectorized equivalent of JacobianSpace, see PoEBatch.
+    :param spaceScrews: List of 6x1 screw vectors in the space frame, 
+                        or a 6xn matrix with the screw axes as its 
+                        columns (e.g. CompiledRobot.screwS).
+    :param thetaN: Nxn array of joint angles.
+    :return JsN: Nx6xn array of space Jacobians.
+
+    Example input:
+    spaceScrews = [np.array([0,0,1,0,0,0]), np.array([0,1,0,-0.1,0,0])]
+    thetaN = np.array([[0.5*np.pi, 0]])
+    Output:
+    [[[ 0.  -1. ]
+      [ 0.   0. ]
+      [ 1.   0. ]
+      [ 0.   0. ]
+      [ 0.  -0.1]
+      [ 0.   0. ]]]
+    """
+    spaceMat = SpaceScrewMat(spaceScrews)
+    thetaN = np.atleast_2d(np.asarray(thetaN, dtype=float))
+    if not np.all(np.any(spaceMat[0:3] != 0, axis=0)): #Prismatic joints
+        return np.array([mr.JacobianSpace(spaceMat, theta) for theta in 
+                         thetaN]).reshape(-1,6,spaceMat.shape[1])
+    N, n = thetaN.shape
+    JsN = np.zeros((N,6,n))
+    JsN[:,:,0] = spaceMat[:,0]
+    T = RevoluteExp6Batch(spaceMat[:,0], thetaN[:,0])
+    for i in range(1, n):
+        JsN[:,:,i] = np.dot(AdjointBatch(T), spaceMat[:,i])
+        T = np.matmul(T, RevoluteExp6Batch(spaceMat[:,i], thetaN[:,i]))
+    return JsN
+
+def Kinematics(robot: Robot, thetaList: List[float]) -> KinematicsCache:
+    """Computes the end-effector pose, the space & body Jacobian, and 
+    the damped least-squares pseudo-inverse of the space Jacobian in 
+    one pass over the joints, cached on the robot. Repeated calls with
+    the same joint angles (e.g. VelControl & ImpControl in one control
+    tick) return the cache without recomputing anything.
+    :param robot: A Robot object describing the robot mathematically.
+    :param thetaList: List of joint angles.
+    :return cache: KinematicsCache with Tsb, Js, Jb and JsPinv of the 
+                   joint angles. Its arrays are overwritten by the next
+                   call with different angles.
+
+    Example input:
+    robot = robot #Of robot_init.py
+    thetaList = [0, 0.2, 0.1, 0, 0]
+    Output:
+    KinematicsCache(n: 5, theta: [0.  0.2 0.1 0.  0. ], updates: 1, 
+                    hits: 0)
+    """
+    model = robot.Compile()
+    if robot.kinCache is None:
+        robot.kinCache = KinematicsCache(robot)
+    cache = robot.kinCache
+    theta = np.array(thetaList, dtype=float)
+    if cache.theta is not None and np.array_equal(cache.theta, theta):
+        cache.nHits += 1
+        return cache
+    spaceMat = model.screwS
+    if not np.all(np.any(spaceMat[0:3] != 0, axis=0)): #Prismatic joints
+        cache.Tsb[:] = FKSpace(model.TsbHome, spaceMat, theta)
+        cache.Js[:] = JacobianSpace(spaceMat, theta)
+    else: #Product of exponentials & space Jacobian share the exponentials
+        T = cache.T
+        T[:] = np.eye(4)
+        for i in range(model.n):
+            cache.Js[:,i] = np.dot(AdjointInto(T, out=cache.AdT), 
+                                   spaceMat[:,i])
+            T[:] = np.dot(T, RevoluteExp6(spaceMat[:,i], theta[i], 
+                                          out=cache.expT))
+        np.dot(T, model.TsbHome, out=cache.Tsb)
+    #Jb = [Ad_(Tbs)]Js
+    AdjointInto(mr.TransInv(cache.Tsb), out=cache.AdT)
+    np.dot(cache.AdT, cache.Js, out=cache.Jb)
+    #Damped least-squares: (Js^T*Js + lambda^2*I)^-1*Js^T, no SVD
+    JsT = cache.Js.T
+    cache.JsPinv[:] = np.linalg.solve(np.dot(JsT, cache.Js) + 
+                                      cache.damping**2*np.eye(model.n), JsT)
+    cache.theta = theta
+    cache.nUpdates += 1
+    return cache
+
+def PegasusScrews(spaceScrews: List[np.ndarray]) -> bool:
+    """Checks if the screw axes have the structure of the Pegasus arm
+    in its home configuration, for which IKAnalytic applies: joint 0 
+    about z, joints 1-3 parallel about y, and joint 4 about x.
+    :param spaceScrews: List of 6x1 screw vectors in the space frame, 
+                        or a 6xn matrix with the screw axes as its 
+                        columns (e.g. CompiledRobot.screwS).
+    :return pegasus: True if IKAnalytic can be used.
+    """
+    spaceMat = SpaceScrewMat(spaceScrews)
+    return spaceMat.shape == (6,5) and \
+           np.allclose(spaceMat[0:3].T, [[0,0,1], [0,1,0], [0,1,0], 
+                                         [0,1,0], [1,0,0]])
+
+def PoseError(Tsb: np.ndarray, TsbTarget: np.ndarray) -> Tuple[float]:
+    """Computes the orientation- and position error between two end-
+    effector configurations.
+    :param Tsb: Current end-effector configuration in SE(3).
+    :param TsbTarget: Desired end-effector configuration in SE(3).
+    :return eOmg: Rotation error, ||R - RTarget||/sqrt(2) which equals
+                  2*sin(angle/2) ~ angle in [rad]. Unlike the angle, it 
+                  is insensitive to rounding of the rotation matrices.
+    :return eV: Distance between both positions.
+    """
+    return (np.linalg.norm(TsbTarget[0:3,0:3] - Tsb[0:3,0:3])/np.sqrt(2),
+            np.linalg.norm(TsbTarget[0:3,3] - Tsb[0:3,3]))
+
+def IKIterate(TsbHome: np.ndarray, TsbTarget: np.ndarray, spaceMat: 
+              np.ndarray, jointLimits: np.ndarray, thetaN: np.ndarray, 
+              eRad: float=2e-2, eLin: float=1e-2, maxIter: int=30, 
+              damping: float=1e-2) -> Tuple[np.ndarray, bool, int]:
+    """Projected damped least-squares iterations of the inverse 
+    kinematics, from N initial guesses at once. Every iteration, the 
+    joint angles are clipped into the joint limits, such that the 
+    result never has to be clipped afterwards. The rotation- & position
+    errors are scaled by eRad & eLin, to weigh both equally.
+    :param TsbHome: The SO(3) representation of the end-effector home 
+                    configuration.
+    :param TsbTarget: The SO(3) representation of the desired end-
+                      effector configuration.
+    :param spaceMat: 6xn matrix with the screw axes as its columns.
+    :param jointLimits: nx2 array of the lower & upper joint limits.
+    :param thetaN: Nxn array of initial guesses, in order of preference.
+    :param eRad: The maximum allowed end-effector orientation error.
+    :param eLin: The maximum allowed end-effector position error.
+    :param maxIter: Maximum number of iterations.
+    :param damping: Damping factor of the least-squares steps.
+    :return thetaList: The first converged solution, or the guess with
+                       the smallest error if none converged.
+    :return success: Whether thetaList is within eRad & eLin.
+    :return nIter: Number of iterations performed.
+    Known limits: Only works with revolute joints.
+    """
+    n = spaceMat.shape[1]
+    theta = np.clip(np.array(thetaN, dtype=float), jointLimits[:,0], 
+                    jointLimits[:,1])
+    N = theta.shape[0]
+    RTarget = TsbTarget[0:3,0:3]
+    pTarget = TsbTarget[0:3,3]
+    scale = np.r_[np.full(3, 1/eRad), np.full(3, 1/eLin)]
+    Js = np.zeros((N,6,n))
+    for nIter in range(maxIter + 1):
+        #Forward kinematics & space Jacobians of all guesses
+        T = np.broadcast_to(np.eye(4), (N,4,4))
+        for i in range(n):
+            Js[:,:,i] = np.dot(AdjointBatch(T), spaceMat[:,i])
+            T = np.matmul(T, RevoluteExp6Batch(spaceMat[:,i], theta[:,i]))
+        Tsb = np.matmul(T, TsbHome)
+        #Rotation vector of RTarget*R^T & position error, scaled
+        RErr = np.matmul(RTarget, np.swapaxes(Tsb[:,0:3,0:3], 1, 2))
+        skew = np.stack((RErr[:,2,1] - RErr[:,1,2], RErr[:,0,2] - 
+                         RErr[:,2,0], RErr[:,1,0] - RErr[:,0,1]), 1)/2
+        sinErr = np.linalg.norm(skew, axis=1)
+        angle = np.arctan2(sinErr, (np.trace(RErr, axis1=1, axis2=2) - 1)/2)
+        ratio = np.divide(angle, sinErr, out=np.ones(N), where=sinErr>1e-9)
+        p = Tsb[:,0:3,3]
+        err = np.hstack((skew*ratio[:,None], pTarget - p))*scale
+        converged = (np.linalg.norm(err[:,0:3], axis=1) <= 1) & \
+                    (np.linalg.norm(err[:,3:6], axis=1) <= 1)
+        if np.any(converged):
+            return (theta[np.argmax(converged)], True, nIter)
+        if nIter == maxIter:
+            break
+        #Jacobian of [omega, dp/dt]: dp/dt = v_s + omega x p
+        J = Js.copy()
+        J[:,3:6] += np.cross(Js[:,0:3], p[:,:,None], axis=1)
+        J *= scale[:,None]
+        JT = np.swapaxes(J, 1, 2)
+        step = np.linalg.solve(np.matmul(JT, J) + damping**2*np.eye(n), 
+                               np.matmul(JT, err[:,:,None]))[:,:,0]
+        theta = np.clip(theta + step, jointLimits[:,0], jointLimits[:,1])
+    best = np.argmin(np.linalg.norm(err, axis=1))
+    return (theta[best], False, nIter)
+
+def IKNumeric(TsbHome: np.ndarray, TsbTarget: np.ndarray, spaceScrews: 
+              List[np.ndarray], jointLimits: List[List[float]], 
+              thetaWarm: np.ndarray=None, nSeeds: int=8, 
+              eRad: float=2e-2, eLin: float=1e-2, maxIter: int=30, 
+              damping: float=1e-2, thetaSeeds: np.ndarray=None) -> \
+              Tuple[np.ndarray, bool, int]:
+    """Numeric, limit-aware inverse kinematics. It first iterates from 
+    the warm start (e.g. the solution of the previous sample of a 
+    trajectory), which typically converges in a few iterations, and 
+    only if that fails from nSeeds fixed seeds spread over the joint 
+    limits, all iterated at once. See IKIterate.
+    :param TsbHome: The SO(3) representation of the end-effector home 
+                    configuration.
+    :param TsbTarget: The SO(3) representation of the desired end-
+                      effector configuration.
+    :param spaceScrews: List of screw vectors in the space frame, or a
+                        6xn matrix with the screw axes as its columns.
+    :param jointLimits: A list of the lower- and upper joint limit of 
+                        each joint.
+    :param thetaWarm: Optional initial guess of the joint angles, also
+                      the first of the seeds.
+    :param nSeeds: Number of seeds if the warm start fails, the home 
+                   configuration being the first. 0 for none, in which
+                   case IK fails without thetaWarm or thetaSeeds.
+    :param eRad: The maximum allowed end-effector orientation error.
+    :param eLin: The maximum allowed end-effector position error.
+    :param maxIter: Maximum number of iterations per attempt.
+    :param damping: Damping factor of the least-squares steps.
+    :param thetaSeeds: Optional extra seeds, e.g. WorkspaceIndex.Seed,
+                       preferred over the fixed seeds.
+    :return thetaList: Joint angles within the joint limits.
+    :return success: Whether thetaList is within eRad & eLin.
+    :return nIter: Total number of iterations performed.
+
+    Example input:
+    robot = robot #Of robot_init.py
+    model = robot.Compile()
+    TsbTarget = FKSpace(model.TsbHome, model.screwS, [0,0.2,0.1,0,0])
+    thetaWarm = [0.1,0.3,0,0.1,0.1]
+    Output:
+    (array([ 0.    ,  0.311 , -0.1221,  0.1111,  0.    ]), True, 5)
+    """
+    spaceMat = SpaceScrewMat(spaceScrews)
+    n = spaceMat.shape[1]
+    lims = np.asarray(jointLimits, dtype=float)
+    TsbTarget = np.asarray(TsbTarget, dtype=float)
+    args = (eRad, eLin, maxIter, damping)
+    nIter = 0
+    if thetaWarm is not None:
+        theta, success, nIter = IKIterate(TsbHome, TsbTarget, spaceMat, 
+                                          lims, [thetaWarm], *args)
+        if success or (nSeeds == 0 and thetaSeeds is None):
+            return (theta, success, nIter)
+    #Fixed seeds, such that the results are reproducible
+    limsFinite = np.clip(lims, -np.pi, np.pi)
+    seeds = limsFinite[:,0] + np.random.default_rng(0).random((nSeeds,n))*\
+            (limsFinite[:,1] - limsFinite[:,0])
+    if nSeeds > 0:
+        seeds[0] = 0
+    if thetaSeeds is not None:
+        seeds = np.vstack((np.reshape(thetaSeeds, (-1,n)), seeds))
+    if seeds.shape[0] == 0:
+        #Nothing to iterate from: the home configuration, unsuccessful
+        return (np.clip(np.zeros(n), lims[:,0], lims[:,1]), False, nIter)
+    theta, success, nSeed = IKIterate(TsbHome, TsbTarget, spaceMat, lims, 
+                                      seeds, *args)
+    return (theta, success, nIter + nSeed)
+
+def IKAnalytic(TsbHome: np.ndarray, TsbTarget: np.ndarray, spaceScrews: 
+               List[np.ndarray], jointLimits: List[List[float]], 
+               thetaRef: np.ndarray=None, eRad: float=2e-2, 
+               eLin: float=1e-2, refine: bool=True) -> List[np.ndarray]:
+    """Closed-form inverse kinematics of the Pegasus arm, returning all
+    solution branches within the joint limits. The orientation yields
+    joint 0, joint 4 and the sum of joints 1-3 (a z-y-x Euler angle 
+    decomposition), after which joints 1 & 2 follow from the planar 
+    two-link problem of the axis of joint 3. If no branch is exact 
+    (e.g. targets slightly outside of the 5-DOF workspace), they are 
+    refined numerically with IKNumeric.
+    :param TsbHome: The SO(3) representation of the end-effector home 
+                    configuration.
+    :param TsbTarget: The SO(3) representation of the desired end-
+                      effector configuration.
+    :param spaceScrews: The screw axes of the joints in the space 
+                        frame, see PegasusScrews for their structure.
+    :param jointLimits: A list of the lower- and upper joint limit of 
+                        each joint.
+    :param thetaRef: Joint angles to sort the solutions by, e.g. the 
+                     current configuration. Zeros by default.
+    :param eRad: The maximum allowed end-effector orientation error.
+    :param eLin: The maximum allowed end-effector position error.
+    :param refine: Refine the branches numerically if none is exact.
+    :return solutions: List of joint angle arrays reaching TsbTarget, 
+                       sorted by their distance to thetaRef. Empty if 
+                       the target cannot be reached within the limits.
+
+    Example input:
+    robot = robot #Of robot_init.py
+    model = robot.Compile()
+    TsbTarget = FKSpace(model.TsbHome, model.screwS, [0,0.2,0.1,0,0])
+    Output:
+    [array([0. , 0.2, 0.1, 0. , 0. ]), 
+     array([ 0.    ,  0.2978, -0.0957,  0.0978,  0.    ])]
+    """
+    spaceMat = SpaceScrewMat(spaceScrews)
+    if not PegasusScrews(spaceMat):
+        raise InputError("IKAnalytic requires screw axes about z, y, " +
+                         "y, y and x in the home configuration.")
+    lims = np.asarray(jointLimits, dtype=float)
+    if thetaRef is None:
+        thetaRef = np.zeros(5)
+    TsbTarget = np.asarray(TsbTarget, dtype=float)
+    #e^[S0]theta0 * ... * e^[S4]theta4
+    TExp = np.dot(TsbTarget, np.linalg.inv(TsbHome))
+    Rd = TExp[0:3,0:3]
+    #Points on the axes of joints 1-3, in the complex coordinates 
+    #(z + ix) of their plane: Rotating about y multiplies by e^(i*theta)
+    q = np.cross(spaceMat[0:3,1:4].T, spaceMat[3:6,1:4].T)
+    u = complex(q[1][2] - q[0][2], q[1][0] - q[0][0])
+    w = complex(q[2][2] - q[1][2], q[2][0] - q[1][0])
+    uw = u.conjugate()*w
+    if np.hypot(Rd[0,0], Rd[1,0]) > 1e-9:
+        theta0 = np.arctan2(Rd[1,0], Rd[0,0])
+    else: #Gimbal lock, joint 0 & 4 coupled: Face the target
+        theta0 = np.arctan2(TsbTarget[1,3], TsbTarget[0,3])
+    candidates = []
+    for theta0 in (theta0, theta0 + np.pi):
+        #Rz(-theta0)*Rd = Ry(theta1+theta2+theta3)*Rx(theta4)
+        E0Inv = RevoluteExp6(spaceMat[:,0], -theta0)
+        A = np.dot(E0Inv[0:3,0:3], Rd)
+        phi = np.arctan2(-A[2,0], A[0,0])
+        theta4 = np.arctan2(-A[1,2], A[1,1])
+        #e^[S1]theta1 * e^[S2]theta2 * e^[S3]theta3
+        X = np.dot(np.dot(E0Inv, TExp), RevoluteExp6(spaceMat[:,4], 
+                                                     -theta4))
+        p = np.dot(X[0:3,0:3], q[2]) + X[0:3,3]
+        d = complex(p[2] - q[0][2], p[0] - q[0][0])
+        cosArg = (abs(d)**2 - abs(u)**2 - abs(w)**2)/(2*abs(uw))
+        if abs(cosArg) > 1 + 1e-9: #Out of reach
+            continue
+        for elbow in (1, -1):
+            theta2 = elbow*np.arccos(np.clip(cosArg, -1, 1)) - np.angle(uw)
+            theta1 = np.angle(d) - np.angle(u + w*np.exp(1j*theta2))
+            theta3 = phi - theta1 - theta2
+            candidates.append(np.array([theta0, theta1, theta2, theta3, 
+                                        theta4]))
+    solutions = []
+    inexact = []
+    candidates = np.angle(np.exp(1j*np.array(candidates).reshape(-1,5)))
+    TsbN = PoEBatch(TsbHome, spaceMat, candidates) #Wrapped to [-pi, pi]
+    for theta, Tsb in zip(candidates, TsbN):
+        eOmg, eV = PoseError(Tsb, TsbTarget)
+        if eOmg > eRad or eV > eLin:
+            inexact.append((eOmg/eRad + eV/eLin, theta))
+            continue
+        solutions.append(theta)
+    if not solutions and refine: #Numeric refinement, closest first
+        for error, theta in sorted(inexact, key=lambda x: x[0]):
+            theta, success, nIter = IKNumeric(TsbHome, TsbTarget, 
+                                              spaceMat, lims, theta, 0, 
+                                              eRad, eLin)
+            if success:
+                solutions.append(theta)
+    solutions = [theta for theta in solutions if not (
+                 np.any(theta < lims[:,0] - 1e-9) or 
+                 np.any(theta > lims[:,1] + 1e-9))]
+    unique = []
+    for theta in solutions:
+        if not any(np.allclose(theta, sol, atol=1e-6) for sol in unique):
+            unique.append(theta)
+    solutions = unique
+    solutions.sort(key=lambda sol: np.linalg.norm(sol - thetaRef))
+    return solutions
 
 def IKSpace(TsbHome: np.ndarray, TsbTarget: np.ndarray, spaceScrews: 
             List[np.ndarray], jointLimits: List[List[float]], nGuessJoints: 
-            int=2, eRad: float=2e-2, eLin: float=1e-2) -> Tuple[np.ndarray, bool]:
+            int=2, eRad: float=2e-2, eLin: float=1e-2, thetaRef: 
+            np.ndarray=None, workspace: WorkspaceIndex=None) -> \
+            Tuple[np.ndarray, bool]:
     """Iteratively computes the list of joint angles of a robot that 
     result in the desired end-effector configuration. If multiple 
     solutions exist, it will return the solution with the smallest
@@ -74,7 +527,9 @@ def IKSpace(TsbHome: np.ndarray, TsbTarget: np.ndarray, spaceScrews:
                       effector configuration
     :param spaceScrews: A list of 6x1 vectors describing the screw axes
                         of each joint in the space frame, as per 
-                        Definition 3.24 of the Modern Robotics book.
+                        Definition 3.24 of the Modern Robotics book, or
+                        a 6xn matrix with the screw axes as its columns
+                        (e.g. CompiledRobot.screwS).
     :param jointLimits: A list of joint limits per joint, with the n-th
                         entry being a list of the lower- and upper 
                         joint limit of the n-th joint.
@@ -85,15 +540,23 @@ def IKSpace(TsbHome: np.ndarray, TsbTarget: np.ndarray, spaceScrews:
                  with respect to the target configuration.
     :param eLin: The maximum allowed end-effector position error with
                  respect to the target configuration.
+    :param thetaRef: Optional joint angles (e.g. the current or previous
+                     configuration): IKAnalytic returns the solution 
+                     closest to it, IKNumeric starts from it. Otherwise
+                     the start is guessed with ThetaInitGuess.
+    :param workspace: Optional WorkspaceIndex of the robot: Targets 
+                      outside of it are rejected without iterating, and
+                      its seed is added to the seeds of IKNumeric.
     :return thetaList: List of joint angles which result in an end-
                        effector configuration that is within the error 
                        limits eRad and eLin to the target configuration 
                        TsbTarget.
     :return success: Boolean that returns whether a valid solution was
                      found (True) or not (False).
-    NOTE: Something seems to go wrong in the inverse kinematics, 
-    atleast when using the Pegasus model!It is incredibly inaccurate 
-    and almost always fails to find a satisfactory set of joint angles.
+    NOTE: For screw axes with the structure of the Pegasus arm (see 
+    PegasusScrews), the closed-form IKAnalytic is used. The numeric 
+    IKNumeric is only a fallback for other robots or if it finds no
+    solution.
     Example input:
     TsbCurrent = np.array([[1,0,0,0],
                            [0,1,0,5],
@@ -110,38 +573,30 @@ def IKSpace(TsbHome: np.ndarray, TsbTarget: np.ndarray, spaceScrews:
     eLin=1e-2
     Output: ([1.5708, 0.0, 0.0], True)
     """
-    nJoints = len(spaceScrews)
+    if workspace is not None and not workspace.Reachable(TsbTarget):
+        raise IKAlgorithmError("Target position outside of the workspace.")
+    spaceMat = SpaceScrewMat(spaceScrews)
+    if PegasusScrews(spaceMat):
+        solutions = IKAnalytic(TsbHome, TsbTarget, spaceMat, jointLimits, 
+                               thetaRef, eRad, eLin)
+        if solutions:
+            return (solutions[0], True)
+    majorScrewJoints = list(spaceMat.T[0:nGuessJoints])
     #Extract location from home transformation matrices
     psbHome = mr.TransToRp(TsbHome)[1]
     psbTarget = mr.TransToRp(TsbTarget)[1]
-    majorScrewJoints = spaceScrews[0:nGuessJoints]
-    thetaGuessList = ThetaInitGuess(psbHome, psbTarget, majorScrewJoints, 
-                                    jointLimits)
-    spaceMat = screwsToMat(spaceScrews)
-    try:
-        #Uses Product of Exponentials, see Modern Robotics, Chapter 4.1
-        thetaList, success = mr.IKinSpace(spaceMat, TsbHome, TsbTarget, 
-                                          thetaGuessList, eomg=eRad, ev=eLin)
-    except IndexError as e:
-        if "array is 1-dimensional" in str(e):
-            spaceMat = screwsToMat1D(spaceScrews)
-        elif "out of bounds" in str(e): #Non-transposed screw axes.
-            spaceMat = screwsToMatT(spaceScrews)
-        thetaList, success = mr.IKinSpace(spaceMat, TsbHome, TsbTarget, 
-                                          thetaGuessList, eomg=eRad, ev=eLin)
+    if thetaRef is None:
+        thetaRef = ThetaInitGuess(psbHome, psbTarget, majorScrewJoints, 
+                                  jointLimits)
+    #Limits are enforced while iterating, no clipping afterwards
+    thetaList, success, nIter = IKNumeric(TsbHome, TsbTarget, spaceMat, 
+                                          jointLimits, thetaRef, eRad=eRad,
+                                          eLin=eLin, thetaSeeds=None if 
+                                          workspace is None else 
+                                          workspace.Seed(TsbTarget))
     if not success:
         print("Best guess: ", thetaList)
         print("Leads to:\n", FKSpace(TsbHome, spaceScrews, thetaList))
         print("Versus original:\n", TsbTarget)
         raise IKAlgorithmError()
-    #Normalize & check limits
-    for i in range(nJoints):
-        if thetaList[i] > np.pi:
-            thetaList[i] = thetaList[i] % np.pi
-        elif thetaList[i] < -np.pi:
-            thetaList[i] = thetaList[i] % -np.pi
-        if thetaList[i] > jointLimits[i][1]:
-            thetaList[i] = jointLimits[i][1]
-        elif thetaList[i] < jointLimits[i][0]:
-            thetaList[i] = jointLimits[i][0]
     return (thetaList, success)
\ No newline at end of file
@@ -6,9 +6,12 @@ current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
 
-from kinematics.kinematic_funcs import FKSpace, IKSpace
-from util import ThetaInitGuess
-from classes import Joint, IKAlgorithmError
+from kinematics.kinematic_funcs import FKSpace, IKSpace, JacobianSpace, \
+                                       Kinematics, IKAnalytic, PoseError, \
+                                       IKNumeric, FKSpaceBatch
+from util import ThetaInitGuess, RevoluteExp6, AdjointInto
+from robot_init import robot
+from classes import Joint, IKAlgorithmError, KinematicsCache
 import modern_robotics as mr
 import numpy as np
 import math
@@ -156,4 +159,168 @@ def test_IKSpaceOutOfWorkSpace():
     try:
         thetaList, success = IKSpace(TsbCurrent, TsbTarget, spaceScrews, jointLimits, nGuessJoints, eRad, eLin)
     except IKAlgorithmError:
-        assert True
\ No newline at end of file
+        assert True
+def test_RevoluteExp6MR():
+    """Check if the closed-form revolute exponential & adjoint match
+    the results of the Modern Robotics library, including screw axes
+    with a non-unit rotational part."""
+    np.random.seed(0)
+    expT = np.zeros((4,4))
+    AdT = np.zeros((6,6))
+    for i in range(100):
+        screw = np.random.randn(6)
+        theta = 4*np.pi*(np.random.rand() - 0.5)
+        expMR = mr.MatrixExp6(mr.VecTose3(screw*theta))
+        assert np.allclose(RevoluteExp6(screw, theta, out=expT), expMR)
+        assert np.allclose(AdjointInto(expT, out=AdT), mr.Adjoint(expMR))
+    screw = np.array([0,0,1,0,-0.2,0])
+    assert np.allclose(RevoluteExp6(screw, 0), np.eye(4))
+
+def test_FKSpaceRevoluteMR():
+    """Check if the forward kinematics & space Jacobian of the Pegasus
+    arm match the results of the Modern Robotics library."""
+    np.random.seed(1)
+    Slist = robot.Compile().screwS
+    for i in range(50):
+        theta = 2*np.pi*(np.random.rand(5) - 0.5)
+        TsbMR = mr.FKinSpace(robot.TsbHome, Slist, theta)
+        assert np.allclose(FKSpace(robot.TsbHome, robot.screwAxes, theta), 
+                           TsbMR)
+        assert np.allclose(FKSpace(robot.TsbHome, Slist, theta), TsbMR)
+        assert np.allclose(JacobianSpace(Slist, theta), 
+                           mr.JacobianSpace(Slist, theta))
+
+def test_KinematicsCache():
+    """Check the cached pose & Jacobians against the Modern Robotics 
+    library, and that they are only recomputed for new joint angles."""
+    np.random.seed(2)
+    model = robot.Compile()
+    robot.kinCache = KinematicsCache(robot, damping=0)
+    for i in range(20):
+        theta = 2*np.pi*(np.random.rand(5) - 0.5)
+        cache = Kinematics(robot, theta)
+        assert np.allclose(cache.Tsb, mr.FKinSpace(model.TsbHome, 
+                                                   model.screwS, theta))
+        assert np.allclose(cache.Js, mr.JacobianSpace(model.screwS, theta))
+        #Not mr.JacobianBody: The rotation of TsbHome is rounded
+        assert np.allclose(cache.Jb, np.dot(mr.Adjoint(mr.TransInv(
+                           cache.Tsb)), cache.Js))
+        assert np.allclose(cache.JsPinv, np.linalg.pinv(cache.Js))
+    assert Kinematics(robot, list(theta)) is cache
+    assert cache.nUpdates == 20 and cache.nHits == 1
+    robot.kinCache = None
+    Js = Kinematics(robot, theta).JsPinv.copy()
+    assert robot.kinCache.damping > 0 #Damped by default
+    assert np.linalg.norm(Js) < np.linalg.norm(np.linalg.pinv(cache.Js))
+
+def test_IKAnalytic():
+    """Every branch reaches the target within the joint limits, and the
+    original joint angles are among them."""
+    np.random.seed(3)
+    model = robot.Compile()
+    lims = model.limList
+    for i in range(50):
+        theta = lims[:,0] + np.random.rand(5)*(lims[:,1] - lims[:,0])
+        TsbTarget = FKSpace(model.TsbHome, model.screwS, theta)
+        solutions = IKAnalytic(model.TsbHome, TsbTarget, model.screwS, 
+                               lims, thetaRef=theta)
+        assert np.allclose(solutions[0], theta, atol=1e-6)
+        for sol in solutions:
+            assert np.all(sol >= lims[:,0]) and np.all(sol <= lims[:,1])
+            eOmg, eV = PoseError(FKSpace(model.TsbHome, model.screwS, 
+                                         sol), TsbTarget)
+            assert eOmg < 1e-6 and eV < 1e-6
+        thetaList, success = IKSpace(model.TsbHome, TsbTarget, 
+                                     robot.screwAxes, robot.limList, 
+                                     thetaRef=theta)
+        assert success and np.allclose(thetaList, theta, atol=1e-6)
+
+def test_IKAnalyticRefine():
+    """Targets slightly outside of the 5-DOF workspace are refined, 
+    unreachable targets yield no solutions."""
+    model = robot.Compile()
+    theta = np.array([0.3, 0.2, 0.4, -0.3, 0.5])
+    TsbTarget = FKSpace(model.TsbHome, model.screwS, theta)
+    TsbTarget[1,3] += 0.005
+    solutions = IKAnalytic(model.TsbHome, TsbTarget, model.screwS, 
+                           model.limList)
+    assert len(solutions) > 0
+    assert PoseError(FKSpace(model.TsbHome, model.screwS, solutions[0]), 
+                     TsbTarget)[1] <= 1e-2
+    TsbTarget[0,3] += 10
+    assert IKAnalytic(model.TsbHome, TsbTarget, model.screwS, 
+                      model.limList) == []
+
+def test_IKNumericWarmStart():
+    """Along a trajectory, warm starting from the previous solution 
+    takes far fewer iterations than the cold multi-start, and every 
+    solution respects the joint limits."""
+    model = robot.Compile()
+    lims = model.limList
+    thetaS = np.array([0.1, 0.2, 0.3, -0.3, 0.2])
+    thetaE = np.array([0.8, -0.3, 0.6, -0.8, -0.5])
+    thetaWarm = thetaS
+    nWarm, nCold = 0, 0
+    for s in np.linspace(0, 1, 20):
+        TsbTarget = FKSpace(model.TsbHome, model.screwS, 
+                            thetaS + s*(thetaE - thetaS))
+        thetaWarm, success, nIter = IKNumeric(model.TsbHome, TsbTarget, 
+                                              model.screwS, lims, thetaWarm)
+        assert success
+        nWarm += nIter
+        theta, success, nIter = IKNumeric(model.TsbHome, TsbTarget, 
+                                          model.screwS, lims)
+        assert success
+        assert np.all(theta >= lims[:,0]) and np.all(theta <= lims[:,1])
+        eOmg, eV = PoseError(FKSpace(model.TsbHome, model.screwS, theta), 
+                             TsbTarget)
+        assert eOmg <= 2e-2 and eV <= 1e-2
+        nCold += nIter
+    assert 3*nWarm < nCold
+
+def test_IKNumericLimits():
+    """A target only reachable outside of the limits is not clipped 
+    into a false solution."""
+    model = robot.Compile()
+    lims = np.array(model.limList)
+    theta = np.array([0.3, 0.2, 0.4, -0.3, 0.5])
+    TsbTarget = FKSpace(model.TsbHome, model.screwS, theta)
+    lims[0] = [-0.5, 0.1]
+    thetaList, success, nIter = IKNumeric(model.TsbHome, TsbTarget, 
+                                          model.screwS, lims, theta)
+    assert not success
+    assert lims[0,0] <= thetaList[0] <= lims[0,1]
+
+def test_IKNumericNoSeeds():
+    """Without fixed seeds, only the given seeds are iterated, and 
+    without any seed IK fails instead of crashing."""
+    model = robot.Compile()
+    lims = model.limList
+    theta = np.array([0.3, 0.2, 0.4, -0.3, 0.5])
+    TsbTarget = FKSpace(model.TsbHome, model.screwS, theta)
+    thetaList, success, nIter = IKNumeric(model.TsbHome, TsbTarget, 
+                                          model.screwS, lims, nSeeds=0)
+    assert not success and nIter == 0
+    assert thetaList.shape == (5,)
+    thetaList, success, nIter = IKNumeric(model.TsbHome, TsbTarget, 
+                                          model.screwS, lims, nSeeds=0, 
+                                          thetaSeeds=theta + 0.05)
+    assert success and nIter > 0
+    #A failing warm start falls back to the given seeds
+    thetaList, success, nIter = IKNumeric(model.TsbHome, TsbTarget, 
+                                          model.screwS, lims, -theta, 
+                                          nSeeds=0, maxIter=3, 
+                                          thetaSeeds=theta + 0.01)
+    assert success
+
+def test_FKSpaceBatch():
+    """Check the batched forward kinematics against FKSpace, for single
+    and many configurations."""
+    np.random.seed(4)
+    model = robot.Compile()
+    thetaN = 2*np.pi*(np.random.rand(200,5) - 0.5)
+    TsbN = FKSpaceBatch(robot, thetaN)
+    assert TsbN.shape == (200,4,4)
+    for theta, Tsb in zip(thetaN, TsbN):
+        assert np.allclose(Tsb, FKSpace(model.TsbHome, model.screwS, theta))
+    assert np.allclose(FKSpaceBatch(robot, [0,0,0,0,0]), model.TsbHome)
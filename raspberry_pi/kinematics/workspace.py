@@ -0,0 +1,101 @@
+import os
+import sys
+
+#Find directory path of current file
+current = os.path.dirname(os.path.realpath(__file__))
+#Find directory path of parent folder and add to sys path
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import numpy as np
+from settings import sett
+from classes import Robot, WorkspaceIndex
+from kinematics.kinematic_funcs import FKSpaceBatch
+
+"""Reachable-workspace index of the robot: The joint space is sampled
+within the joint limits, the end-effector positions are computed with
+FKSpaceBatch, and the occupied voxels are stored in a WorkspaceIndex
+(see classes.py) together with one joint vector per voxel. Run this
+file to (re)build the persisted index (in sett['cacheDir']):
+python kinematics/workspace.py [nSamples] [voxelSize]
+"""
+
+#Default location of the persisted index, see sett['cacheDir'].
+WORKSPACE_FILE = os.path.join(sett['cacheDir'], "workspace_index.npz")
+
+def ModelKey(robot: Robot) -> np.ndarray:
+    """Identifies the kinematic model of a robot, such that a persisted
+    WorkspaceIndex of a different model is not used.
+    :param robot: A Robot object describing the robot mathematically.
+    :return key: 1D array of the screw axes, limits & home configuration.
+    """
+    model = robot.Compile()
+    return np.concatenate((model.screwS.ravel(), model.limList.ravel(),
+                           model.TsbHome.ravel()))
+
+def BuildWorkspaceIndex(robot: Robot, nSamples: int=1000000,
+                        voxelSize: float=0.03, seed: int=0,
+                        batchSize: int=50000) -> WorkspaceIndex:
+    """Samples the joint space uniformly within the joint limits and
+    indexes the reached end-effector positions in a voxel grid. Each
+    voxel keeps the sample closest to its centre as IK seed.
+    :param robot: A Robot object describing the robot mathematically.
+    :param nSamples: Number of joint space samples.
+    :param voxelSize: Edge length of each voxel in [m].
+    :param seed: Seed of the random samples, for reproducible indices.
+    :param batchSize: Number of samples per FKSpaceBatch call.
+    :return index: WorkspaceIndex of the robot.
+
+    Example input:
+    robot = robot #Of robot_init.py
+    Output:
+    WorkspaceIndex(shape: (73, 74, 65), voxelSize: 0.03, occupied: 138547)
+    """
+    model = robot.Compile()
+    lims = np.clip(model.limList, -np.pi, np.pi)
+    thetaN = lims[:,0] + np.random.default_rng(seed).random((nSamples,
+             model.n))*(lims[:,1] - lims[:,0])
+    pos = np.concatenate([FKSpaceBatch(robot, thetaN[i:i+batchSize])[:,0:3,3]
+                          for i in range(0, nSamples, batchSize)])
+    #One voxel of margin on each side, for the dilation
+    origin = np.floor(pos.min(axis=0)/voxelSize)*voxelSize - voxelSize
+    index = np.floor((pos - origin)/voxelSize).astype(int)
+    shape = tuple(index.max(axis=0) + 2)
+    flat = np.ravel_multi_index(index.T, shape)
+    #Per voxel, the sample closest to its centre
+    dist = np.linalg.norm(pos - origin - (index + 0.5)*voxelSize, axis=1)
+    order = np.lexsort((dist, flat))
+    flatUnique, first = np.unique(flat[order], return_index=True)
+    occupied = np.zeros(shape, dtype=bool)
+    occupied.flat[flatUnique] = True
+    seeds = np.zeros(shape + (model.n,), dtype=np.float32)
+    seeds.reshape(-1, model.n)[flatUnique] = thetaN[order[first]]
+    return WorkspaceIndex(origin, voxelSize, occupied, seeds,
+                          ModelKey(robot))
+
+def LoadWorkspaceIndex(robot: Robot, path: str=WORKSPACE_FILE,
+                       **kwargs) -> WorkspaceIndex:
+    """Loads the persisted WorkspaceIndex of a robot, or builds and
+    stores it if it does not exist yet or belongs to another model.
+    :param robot: A Robot object describing the robot mathematically.
+    :param path: File path of the persisted index.
+    :param kwargs: Arguments of BuildWorkspaceIndex, e.g. voxelSize.
+    :return index: WorkspaceIndex of the robot.
+    """
+    key = ModelKey(robot)
+    if os.path.exists(path):
+        index = WorkspaceIndex.Load(path)
+        if index.key is not None and index.key.shape == key.shape and \
+           np.allclose(index.key, key):
+            return index
+    index = BuildWorkspaceIndex(robot, **kwargs)
+    index.Save(path)
+    return index
+
+if __name__ == "__main__":
+    from robot_init import robot
+    nSamples = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    voxelSize = float(sys.argv[2]) if len(sys.argv) > 2 else 0.03
+    index = BuildWorkspaceIndex(robot, nSamples, voxelSize)
+    index.Save(WORKSPACE_FILE)
+    print(index)
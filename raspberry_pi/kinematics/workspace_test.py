@@ -0,0 +1,70 @@
+import os
+import sys
+#Find directory path of current file
+current = os.path.dirname(os.path.realpath(__file__))
+#Find directory path of parent folder and add to sys path
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import numpy as np
+import pytest
+from robot_init import robot
+from classes import WorkspaceIndex, IKAlgorithmError
+from kinematics import kinematic_funcs
+from kinematics.kinematic_funcs import FKSpaceBatch, IKSpace
+from kinematics.workspace import BuildWorkspaceIndex, LoadWorkspaceIndex
+
+@pytest.fixture(scope="module")
+def index():
+    return BuildWorkspaceIndex(robot, nSamples=200000, voxelSize=0.05)
+
+def test_WorkspaceReachable(index):
+    """Samples of the joint space fall in reachable voxels, points far
+    from the robot do not."""
+    model = robot.Compile()
+    lims = np.clip(model.limList, -np.pi, np.pi)
+    thetaN = lims[:,0] + np.random.default_rng(1).random((200,model.n))*\
+             (lims[:,1] - lims[:,0])
+    TN = FKSpaceBatch(robot, thetaN)
+    assert np.mean([index.Reachable(T) for T in TN]) > 0.99
+    assert not index.Reachable(np.array([3, 0, 0]))
+    assert not index.Reachable(np.array([0, 0, 1.5]))
+    assert index.Seed(np.array([3, 0, 0])) is None
+    seed = index.Seed(TN[0])
+    assert seed.shape == (model.n,)
+    assert np.all(seed >= lims[:,0]) and np.all(seed <= lims[:,1])
+
+def test_WorkspaceSaveLoad(index, tmp_path):
+    """The index survives a round trip (creating its directory), and is
+    rebuilt for another model."""
+    path = str(tmp_path/"cache"/"workspace.npz")
+    index.Save(path)
+    loaded = WorkspaceIndex.Load(path)
+    assert np.array_equal(loaded.reachable, index.reachable)
+    assert np.array_equal(loaded.seeds, index.seeds)
+    assert LoadWorkspaceIndex(robot, path).key is not None
+    WorkspaceIndex(index.origin, index.voxelSize, index.occupied[0:2],
+                   index.seeds[0:2], np.zeros(3)).Save(path)
+    rebuilt = LoadWorkspaceIndex(robot, path, nSamples=20000, voxelSize=0.1)
+    assert rebuilt.voxelSize == 0.1
+    assert WorkspaceIndex.Load(path).voxelSize == 0.1
+
+def test_IKSpaceWorkspace(index, monkeypatch):
+    """Unreachable targets are rejected without iterating."""
+    model = robot.Compile()
+    T = np.eye(4)
+    T[0:3,3] = [2, 0, 0.3]
+    calls = []
+    IKNumeric = kinematic_funcs.IKNumeric
+    def IKNumericSpy(*args, **kwargs):
+        calls.append(args)
+        return IKNumeric(*args, **kwargs)
+    monkeypatch.setattr(kinematic_funcs, "IKNumeric", IKNumericSpy)
+    with pytest.raises(IKAlgorithmError, match="outside of the workspace"):
+        IKSpace(model.TsbHome, T, model.screwS, model.limList,
+                workspace=index)
+    assert len(calls) == 0
+    theta = np.array([0.3, -0.2, 0.4, 0.1, -0.5])
+    thetaIK, success = IKSpace(model.TsbHome, FKSpaceBatch(robot, [theta])[0],
+                               model.screwS, model.limList, workspace=index)
+    assert success
@@ -15,22 +15,35 @@ import pygame
 import serial
 import time
 import csv
-from typing import List, Tuple, Dict
+import asyncio
+import argparse
+import threading
+from typing import List, Tuple, Dict, Callable, Any
 from robot_init import robot as R1 
 from robot_init import robotFric as R2
 from settings import sett
-from classes import SerialData, Robot, InputError, PID
+from classes import SerialData, Robot, InputError, PID, Scheduler, TimingLog, \
+                    SimClock, IKAlgorithmError, WorkspaceIndex, RNEAWorkspace, \
+                    NULL_TIMING
 from util import LimDamping
 from kinematics.kinematic_funcs import FKSpace
-from serial_comm.serial_comm import FindSerial, StartComms, GetComms, SReadAndParse
+from kinematics.workspace import LoadWorkspaceIndex
+from serial_comm.serial_comm import FindSerial, StartComms, GetComms, SReadAndParse, \
+                                    SWriteCommand, NegotiateProtocol, StartAsyncSerial, \
+                                    SExchange
 from dynamics.dynamics_funcs import FeedForward
-from control.control import PosControl, VelControl, ForceControl, ImpControl
+from control.control import PosControl, VelControl, ForceControl, ImpControl, \
+                            UpdateFrame
+from simulation.sim import SimTeensy, TAU_PER_PWM_POS, SIM_B_VISC
 
-def GetEConfig(sConfig: np.ndarray, Pegasus: Robot) -> np.ndarray:
+def GetEConfig(sConfig: np.ndarray, Pegasus: Robot, 
+               workspace: WorkspaceIndex=None) -> np.ndarray:
     """Obtain a desired end-effector configuration based on the input 
     of the user.
     :param sConfig: Start configuration in joint space.
     :param Pegasus: A mathematical model of the robot.
+    :param workspace: Optional WorkspaceIndex of the robot, to reject 
+                      unreachable end-effector configurations directly.
     :return sConfig: Start configuration in joint- or end-effector
                      space, based on eConfig input.
     :return eConfig: Desired end configuration in joint- or end-
@@ -50,6 +63,9 @@ def GetEConfig(sConfig: np.ndarray, Pegasus: Robot) -> np.ndarray:
         if eConfig.shape != sConfig.shape:
             raise InputError("Start- and end configuration are not the same "+
                              "shape.")
+        if workspace is not None and not workspace.Reachable(eConfig):
+            raise InputError("End configuration is outside of the " +
+                             "workspace of the robot.")
         return sConfig, eConfig
     elif userInput[0] == "[":
         userInput = userInput[1:-1]
@@ -240,28 +256,35 @@ def GetKeysEF(VPrev: np.ndarray, events: List["pygame.Event"], keyDownPrev: \
                 print(f"angular velocity: {wSel} rad/s")
     return keyDown, noInput, wSel, vSel, V
 
-def HoldPos(serial: SerialData, Teensy: serial.Serial, robot: Robot, PIDObj: PID, 
-            thetaDes: np.ndarray, lastComm: float, lastFrame: float, 
-            dtComm: float, dtFrame: float, dtHold: float, screen: pygame.Surface, background: pygame.Surface, eLim: float=np.ones(5)*0.017) -> \
-            Tuple[float]:
-    """Execute one step to hold a desired position, using FF and PID
+def HoldPos(serial: SerialData, robot: Robot, PIDObj: PID, 
+            thetaDes: np.ndarray, dtHold: float, timing: TimingLog=None, 
+            rneaWorkspace: RNEAWorkspace=None) -> np.ndarray:
+    """Execute one step to hold a desired position, using FF and PID.
+    The resulting motor commands are stored in serial.mSpeed, sending 
+    them is left to the communication task (see SWriteCommand).
     :param serial: SerialData object for data transmission.
     :param robot: Robot object to store robot data / model.
     :param PIDObj: PID-class object for position PID.
     :param thetaDes: Desired joint space configuration in [rad].
-    :param lastComm: Last time communication was executed.
-    :param lastFrame: Last time pygame was refreshed.
-    :param dtComm: Time between communication updates in [s].
-    :param dtFrame: Time between pygame updates in [s].
-    :param eLim: Maximal acceptable error magnitude.
+    :param dtHold: Time between two HoldPos steps in [s].
+    :param timing: Optional TimingLog to record the FF & PID latency in.
+    :param rneaWorkspace: Optional RNEAWorkspace of the robot, reused 
+                          by the FeedForward of every step.
+    :return tau: Commanded motor torques.
     """
+    if timing is None:
+        timing = NULL_TIMING
     thetaCurr = np.array(serial.currAngle[:-1]) #Minus gripper
     thetaPrev = np.array(serial.prevAngle[:-1])
     dthetaCurr = (thetaCurr - thetaPrev)/dtHold
     FTip = np.array([0 for i in range(6)])
     g = np.array([0,0,-9.81])
-    tauFF = FeedForward(robot, thetaDes, np.zeros(5), np.zeros(5), g, FTip)
-    tauPID = PIDObj.Execute(thetaDes, thetaCurr, dtHold)
+    with timing.Measure("FeedForward"):
+        tauFF = FeedForward(robot, thetaDes, np.zeros(5), np.zeros(5), g, 
+                            FTip, out=None if rneaWorkspace is None 
+                            else rneaWorkspace.tau, workspace=rneaWorkspace)
+    with timing.Measure("PID.Execute"):
+        tauPID = PIDObj.Execute(thetaDes, thetaCurr, dtHold)
     tau = tauFF + tauPID
     tauFric = np.zeros(5)
     for i in range(tau.size):
@@ -282,33 +305,156 @@ def HoldPos(serial: SerialData, Teensy: serial.Serial, robot: Robot, PIDObj: PID
     tau[4] = tauJ4 - tauJ5
     PWM = np.round(tau*33.78)
     #PWM = np.round(LimDamping(thetaCurr, PWM, robot.limList, k=20)) #DEBUG COMMENTED
+    serial.mSpeed[:-1] = list(PWM)
+    return tau #TAU IS TEMP!
 
-    if time.perf_counter() - lastComm >= dtComm:
-        SReadAndParse(serial, Teensy)
-        serial.mSpeed[:-1] = [abs(val) if abs(val) < 255 else 255 for val in PWM]
-        serial.rotDirDes = [np.sign(PWM[i]) if 
-                            np.sign(PWM[i]) == 1 else 0 for i in 
-                            range(serial.lenData-1)]
-        for i in range(serial.lenData-1): #TODO: Add Gripper function
-            serial.dataOut[i] = f"{serial.mSpeed[i]}|"+\
-                                f"{serial.rotDirDes[i]}"
-        print(f"HoldPos: {serial.dataOut}")
-        #TODO: Replace last entry w/ gripper commands
-        serial.dataOut[-1] = f"{0|0}"
-        Teensy.write(f"{serial.dataOut}\n".encode('utf-8')) 
-        lastComm = time.perf_counter()
+def CommTask(serial: SerialData, Teensy: serial.Serial, timing: TimingLog):
+    """Periodic communication: Read the Teensy, send the motor commands.
+    :param serial: SerialData object for data transmission.
+    :param Teensy: serial.Serial() instance of the local microcontroller,
+                   or a SerialWorker/AsyncSerial handling it in the 
+                   background.
+    :param timing: TimingLog to record the read & write latency in.
+    """
+    SExchange(serial, Teensy, timing)
 
-    if time.perf_counter() - lastFrame >= dtFrame:
-        events = pygame.event.get() #To interact with pygame, avoids freezing.
-        for event in events:
-            if event.type == pygame.QUIT:
-                raise KeyboardInterrupt
-        screen.blit(background, (0,0))
-        pygame.display.update()
-        lastFrame = time.perf_counter()
-    return lastComm, lastFrame, tau #TAU IS TEMP!
+def HoldUntilStable(serial: SerialData, Teensy: serial.Serial, robot: Robot,
+                    PIDObj: PID, thetaDes: np.ndarray, errThetaMax: np.ndarray,
+                    dtHold: float, dtComm: float, dtFrame: float, 
+                    screen: pygame.Surface, background: pygame.Surface,
+                    timing: TimingLog, 
+                    loop: asyncio.AbstractEventLoop=None,
+                    clock: Callable[[], float]=None, 
+                    sleep: Callable[[float], None]=None,
+                    asyncSleep: Callable[[float], Any]=None) -> dict:
+    """Holds a desired position with HoldPos until all joint errors are 
+    within errThetaMax.
+    :param serial: SerialData object for data transmission.
+    :param Teensy: serial.Serial() instance of the local microcontroller,
+                   or a SerialWorker/AsyncSerial handling it in the 
+                   background.
+    :param robot: Robot object to store robot data / model.
+    :param PIDObj: PID-class object for position PID.
+    :param thetaDes: Desired joint space configuration in [rad].
+    :param errThetaMax: Maximal acceptable error of each joint in [rad].
+    :param dtHold: Time between HoldPos updates in [s].
+    :param dtComm: Time between communication updates in [s].
+    :param dtFrame: Time between pygame updates in [s].
+    :param screen: Pygame screen object, None if the UI is refreshed 
+                   by another coroutine on the loop (see UILoop).
+    :param background: Pygame background image object.
+    :param timing: TimingLog to record the latency of each task in.
+    :param loop: Optional asyncio event loop to run the tasks on, see 
+                 Scheduler.RunAsync. Blocking Scheduler.Run otherwise.
+    :param clock: Optional time source of the scheduler, e.g. a 
+                  SimClock. Real time if None.
+    :param sleep: Function sleeping in clock, e.g. SimClock.Sleep.
+    :param asyncSleep: Coroutine function sleeping in clock, e.g. 
+                       SimClock.AsyncSleep.
+    :return stats: Task statistics of the scheduler, see Scheduler.Stats.
+    """
+    scheduler = Scheduler(clock, sleep, timing, asyncSleep)
+    rneaWorkspace = RNEAWorkspace(robot) #One for all steps of the loop
+    scheduler.AddTask("hold", dtHold, lambda: HoldPos(serial, robot, PIDObj, 
+                      thetaDes, dtHold, timing, rneaWorkspace))
+    scheduler.AddTask("comm", dtComm, lambda: CommTask(serial, Teensy, timing), 
+                      phase=dtComm)
+    if screen is not None:
+        scheduler.AddTask("UI", dtFrame, lambda: UpdateFrame(screen, 
+                          background), phase=dtFrame)
+    until = lambda: not any(np.greater(np.abs(thetaDes - 
+                            np.array(serial.currAngle[:-1])), errThetaMax))
+    if loop is None:
+        scheduler.Run(until=until)
+    else:
+        loop.run_until_complete(scheduler.RunAsync(until=until))
+    return scheduler.Stats()
+
+async def UILoop(screen: pygame.Surface, background: pygame.Surface, 
+                 dtFrame: float, state: dict, timing: TimingLog=None,
+                 clock: Callable[[], float]=None, 
+                 asyncSleep: Callable[[float], Any]=None):
+    """Coroutine refreshing the UI & handling its events every dtFrame,
+    in every control mode and phase, until cancelled.
+    :param screen: Pygame screen object.
+    :param background: Pygame background image object.
+    :param dtFrame: Time between pygame updates in [s].
+    :param state: Dictionary shared with the control tasks. The events 
+                  are passed to state['onEvents'], if not None (e.g. 
+                  the keyboard input of velocity control).
+    :param timing: Optional TimingLog to record the UI latency in.
+    :param clock: Optional time source, e.g. a SimClock. Real time if None.
+    :param asyncSleep: Coroutine function sleeping in clock.
+    """
+    def UITask():
+        events = UpdateFrame(screen, background)
+        if state['onEvents'] is not None:
+            state['onEvents'](events)
+    scheduler = Scheduler(clock, None, timing, asyncSleep)
+    scheduler.AddTask("UI", dtFrame, UITask)
+    await scheduler.RunAsync()
+
+async def LogLoop(timing: TimingLog, csvTitle: str, dtLog: float,
+                  clock: Callable[[], float]=None, 
+                  asyncSleep: Callable[[float], Any]=None):
+    """Coroutine appending the timing samples recorded since its 
+    previous run to a CSV file every dtLog, until cancelled.
+    :param timing: TimingLog of the control loop, see TimingLog.Append.
+    :param csvTitle: Address of the CSV file.
+    :param dtLog: Time between two appends in [s].
+    :param clock: Optional time source, e.g. a SimClock. Real time if None.
+    :param asyncSleep: Coroutine function sleeping in clock.
+    """
+    scheduler = Scheduler(clock, None, asyncSleep=asyncSleep)
+    scheduler.AddTask("log", dtLog, lambda: timing.Append(csvTitle), 
+                      phase=dtLog)
+    await scheduler.RunAsync()
+
+def Prompt(loop: asyncio.AbstractEventLoop, realTime: bool, func, *args):
+    """Calls a blocking function waiting for user input (e.g. 
+    GetEConfig), while the event loop keeps running the serial, UI & 
+    logging coroutines. In simulated time, it is called directly, as 
+    the simulated time would run away while waiting.
+    :param loop: Event loop of the coroutines.
+    :param realTime: False in simulated time.
+    :param func: Blocking function, called with *args.
+    :return result: The return value of func, its exceptions are raised.
+    """
+    if not realTime:
+        return func(*args)
+    future = loop.create_future()
+    def Call():
+        try:
+            result = func(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(future.set_result, result)
+    #Daemon thread: A pending input() does not block quitting.
+    threading.Thread(target=Call, daemon=True, name="Prompt").start()
+    return loop.run_until_complete(future)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PegasusArm OS")
+    parser.add_argument("--sim", action="store_true", help="Replace the " +
+                        "Teensy by the robot model (no hardware needed).")
+    parser.add_argument("--headless", action="store_true", help="With " +
+                        "--sim: No display, run faster than real time.")
+    parser.add_argument("--timing", default=os.path.join(sett['logDir'], 
+                        "timing.csv"), help="CSV file the control loop " +
+                        "timing is written to on exit.")
+    args = parser.parse_args()
+    if args.headless and not args.sim:
+        parser.error("--headless requires --sim")
+    if args.headless:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        #Simulated time, passed to every scheduler to skip its sleeps. 
+        #The TimingLog keeps measuring the real computation time.
+        clock = SimClock()
+        sleep, asyncSleep = clock.Sleep, clock.AsyncSleep
+    else:
+        clock = time.perf_counter
+        sleep, asyncSleep = time.sleep, asyncio.sleep
     robotSelected = False
     while not robotSelected:
         try:
@@ -328,19 +474,37 @@ if __name__ == "__main__":
             continue
     print("\nRobot type selected. Setting up serial communication...\n")
     serial = SerialData(6, Pegasus.joints)
-    #port = FindSerial(askInput=True)[0]
-    Teensy = StartComms('COM13') #TEMPORARY, REPLACE WITH PORT
-
+    #Built on the first start, loaded from file afterwards.
+    workspace = LoadWorkspaceIndex(Pegasus)
     method = False
-    frameInterval = sett['dtFrame']
-    lastFrame = time.perf_counter()
+    #Latency of each control loop stage, appended to samplesTitle while
+    #running & summarized in args.timing on exit.
+    timing = TimingLog()
+    os.makedirs(os.path.dirname(os.path.abspath(args.timing)), exist_ok=True)
+    samplesTitle = os.path.splitext(args.timing)[0] + "_samples.csv"
+    if os.path.exists(samplesTitle):
+        os.remove(samplesTitle)
     dtPID = sett['dtPID']
-    lastPID = time.perf_counter()
     dtComm = sett['dtComm']
-    lastComm = time.perf_counter()
-    lastCheck = time.perf_counter()
+    #Single event loop shared by the serial, UI & logging coroutines and
+    #the control loops of all modes & the hold-position phases.
+    loop = asyncio.new_event_loop()
+    if args.sim:
+        #The frictionless model is the plant, the friction of the real
+        #robot is lumped into the joint damping.
+        Teensy = SimTeensy(R1, np.zeros(5), dtComm, 
+                           [TAU_PER_PWM_POS for i in range(5)], 
+                           SIM_B_VISC, clock=clock)
+    else:
+        #port = FindSerial(askInput=True)[0]
+        Teensy = StartComms('COM13') #TEMPORARY, REPLACE WITH PORT
+        #Binary frames if the firmware supports them (serial_comm_v6).
+        print(f"Serial protocol: {NegotiateProtocol(serial, Teensy)}")
+    #From here on, only the serial coroutines touch the port (polling
+    #the emulator, in (simulated) time). They run whenever the loop does.
+    worker = StartAsyncSerial(serial, Teensy, dtComm, loop, timing, clock,
+                              asyncSleep)
     dtFrame = sett['dtFrame']
-    lastHold = time.perf_counter()
     dtHold = sett['dtHold']
 
     PIDPos = sett['PIDP']
@@ -348,6 +512,7 @@ if __name__ == "__main__":
     errThetaMax = np.ones(5)*sett['errThetaHold']
     vMax = sett['vMax']
     wMax = sett['wMax']
+    aMax = sett['aMax']
     jIncr = sett['jIncr']
     efIncrL = sett['eIncrLin']
     efIncrR = sett['eIncrRot']
@@ -358,17 +523,12 @@ if __name__ == "__main__":
     Kx = sett['Kx']
     Ka = sett['Ka']
 
-    #initialize empty objects
-    wDesJ = np.zeros(5)
-    vDesE = np.zeros(6)
-    vPrevJ = np.zeros(5)
-    wSelJ = jIncr
-    wSelE = efIncrR
-    vSelE = efIncrL
-    noInput = True
-    noInputPrev = False
-    VPrev= np.zeros(6)
-    dthetaPrev = np.zeros(5)
+    #initialize empty objects, shared between the scheduled tasks
+    state = dict(wDesJ=np.zeros(5), vDesE=np.zeros(6), vPrevJ=np.zeros(5),
+                 wSelJ=jIncr, wSelE=efIncrR, vSelE=efIncrL, noInput=True,
+                 noInputPrev=False, VPrev=np.zeros(6), 
+                 dthetaPrev=np.zeros(5), thetaDes=None, keyDownPrev=None, 
+                 n=-1)
 
     methodSelected = False
     while not methodSelected:
@@ -426,7 +586,7 @@ if __name__ == "__main__":
     elif method == 'imp':
         #Get robot into desired position.
         sConfig = np.array(serial.currAngle[:-1])
-        eConfig = GetEConfig(sConfig, Pegasus)[1]
+        eConfig = GetEConfig(sConfig, Pegasus, workspace)[1]
         if eConfig.shape != (4,4):
             TDes = FKSpace(Pegasus.TsbHome, Pegasus.screwAxes, eConfig)
         else:
@@ -437,196 +597,154 @@ if __name__ == "__main__":
     screen = pygame.display.set_mode([700, 500])
     background = pygame.image.load(os.path.join(current,'control_overview.png'))
     if method == 'vel':
-        keyDownPrev = pygame.key.get_pressed()
+        state['keyDownPrev'] = pygame.key.get_pressed()
+
+    def VelTask():
+        """Velocity control, or hold the position without user input."""
+        if space == 'joint':
+            vDes = state['wDesJ']
+            noVel = not np.any(state['wDesJ'])
+        else:
+            vDes = state['vDesE']
+            noVel = True
+        if state['noInput'] and not any(state['keyDownPrev']) and noVel:
+            if state['noInput'] != state['noInputPrev'] or \
+               state['thetaDes'] is None:
+                #Initiate PID
+                PIDPos.Reset()
+                thetaDes = np.array(serial.currAngle[:-1])
+                if space == 'joint':
+                    thetaDes[3] += thetaDes[2] #Pegasus Characteristics
+                    thetaDes[2] += thetaDes[1]
+                state['thetaDes'] = thetaDes
+            HoldPos(serial, Pegasus, PIDPos, state['thetaDes'], dtPID, timing,
+                    rneaWorkspace)
+        else:
+            #VelControl implicitely updates serial.mSpeed (FF+PID).
+            with timing.Measure("VelControl"):
+                state['vPrevJ'] = VelControl(Pegasus, serial, vDes, 
+                                         state['vPrevJ'], dtPID, 
+                                         'joint' if space == 'joint' else 
+                                         'twist', dtComm, PIDVel, 
+                                         rneaWorkspace)
+
+    def VelKeys(events: List["pygame.Event"]):
+        """Read the keyboard for velocity control, given the events of
+        the UI coroutine."""
+        state['noInputPrev'] = state['noInput']
+        if space == 'joint':
+            state['keyDownPrev'], state['noInput'], state['wSelJ'], \
+            state['wDesJ'] = GetKeysJoint(state['keyDownPrev'], events, 
+                                          state['wSelJ'], state['wDesJ'], 0, 
+                                          wMax, jIncr)
+        else:
+            state['keyDownPrev'], state['noInput'], state['wSelE'], \
+            state['vSelE'], state['vDesE'] = GetKeysEF(state['vDesE'], 
+                events, state['keyDownPrev'], state['vSelE'], 
+                state['wSelE'], 0, wMax, 0, vMax, efIncrL, efIncrR)
+
+    def ForceTask(scheduler: Scheduler):
+        """Apply the wrench of the current time step of the CSV file."""
+        nPrev = state['n']
+        state['n'] = round(scheduler.Elapsed()/dtWrench)
+        if state['n'] >= len(wrenchesList):
+            scheduler.Stop()
+        elif state['n'] != nPrev:
+            with timing.Measure("ForceControl"):
+                ForceControl(Pegasus, serial, wrenchesList[state['n']], 
+                             forceDamp, dtWrench, rneaWorkspace)
+
+    def ImpTask():
+        with timing.Measure("ImpControl"):
+            state['VPrev'], state['dthetaPrev'] = ImpControl(Pegasus, serial, 
+                TDes, state['VPrev'], state['dthetaPrev'], dtPID, M, B, Kx, 
+                Ka, PIDPos, rneaWorkspace)
+
+    def ModeTasks(scheduler: Scheduler) -> tuple:
+        """Control tick (period, callback, phase) of the continuously
+        running modes, which share the comm task."""
+        if method == 'vel':
+            return dtPID, VelTask, 0
+        if method == 'force':
+            return dtWrench, lambda: ForceTask(scheduler), 0
+        return dtPID, ImpTask, dtPID
+
+    #Inverse dynamics buffers, shared by the control ticks of all modes.
+    rneaWorkspace = RNEAWorkspace(Pegasus)
+    #Run as long as the loop does, next to the serial coroutines.
+    state['onEvents'] = VelKeys if method == 'vel' else None
+    bgTasks = [loop.create_task(UILoop(screen, background, dtFrame, state,
+                                       timing, clock, asyncSleep), 
+                                name="UI"),
+               loop.create_task(LogLoop(timing, samplesTitle, sett['dtLog'],
+                                        clock, asyncSleep), name="log")]
+
     try:
         while True: #Main loop!
+            #Fixed-rate tasks, executed in this order when due together.
+            scheduler = Scheduler(clock, sleep, timing, asyncSleep)
             if method == 'pos': #Position control
                 sConfig = np.array(serial.currAngle[:-1])
-                sConfig, eConfig = GetEConfig(sConfig, Pegasus)
                 try:
+                    sConfig, eConfig = Prompt(loop, not args.headless, 
+                                              GetEConfig, sConfig, Pegasus, 
+                                              workspace)
+                    #The UI is refreshed by its own coroutine.
                     PosControl(sConfig, eConfig, Pegasus, serial, dtPosConf, 
-                                vMax, wMax, PIDPos, dtComm, dtPID, dtFrame, Teensy, screen, background)
+                                vMax, wMax, PIDPos, dtComm, dtPID, dtFrame, worker, None, background,
+                                timing, loop, workspace, aMax, clock, sleep,
+                                asyncSleep)
                 except SyntaxError as e:
                     print(e.msg)
                     continue
-                except ValueError as e:
+                except (ValueError, InputError, IKAlgorithmError) as e:
                     print(e)
                     continue
                 #Initiate hold-pos
                 thetaDes = eConfig #exclude gripper
-                #Initialize with high value
-                errThetaCurr = np.array([100*np.pi for i in serial.currAngle[:-1]])
                 print("Stabilizing around new position...")
-                #Last argument to let play out the effects of transience
-                start = time.perf_counter()
-                while any(np.greater(errThetaCurr, errThetaMax)):
-                    if time.perf_counter() - lastHold >= dtHold: 
-                #While not stabilized within error bounds, do holdpos
-                        lastComm, lastFrame = HoldPos(serial, Teensy, Pegasus, 
-                                              PIDPos, thetaDes, lastComm, 
-                                              lastFrame, dtComm, dtFrame,
-                                              dtHold, screen, background)
-                        lastHold = time.perf_counter()
-                        errThetaCurr = (thetaDes - np.array([serial.currAngle[:-1]]))[0]
+                HoldUntilStable(serial, worker, Pegasus, PIDPos, thetaDes, 
+                                errThetaMax, dtHold, dtComm, dtFrame, None, 
+                                background, timing, loop, clock, sleep, 
+                                asyncSleep)
                 print("Stabilization complete.")
 
-            elif method == 'vel': #Velocity Control
-                if space == 'joint':
-                    if time.perf_counter() - lastPID > dtPID:
-                        if noInput and not any(keyDownPrev) and not np.any(wDesJ):
-                            if noInput != noInputPrev:
-                                #Initiate PID
-                                PIDPos.Reset()
-                                thetaDes = np.array(serial.currAngle[:-1])
-                                thetaDes[3] += thetaDes[2] #Pegasus Characteristics
-                                thetaDes[2] += thetaDes[1]
-                            serial.mSpeed[:-1] = HoldPos(serial, Pegasus, PIDPos, 
-                                                            thetaDes, dtPID)
-                        else:
-                        #VelControl implicitely updates serial.mSpeed (FF+PID).
-                            vPrevJ = VelControl(Pegasus, serial, wDesJ, vPrevJ, 
-                                                dtPID, 'joint', dtComm, PIDVel)
-                        lastPID = time.perf_counter()
-
-                    if time.perf_counter() - lastFrame >= dtFrame:
-                        events = pygame.event.get()
-                        for event in events:
-                            if event.type == pygame.QUIT:
-                                raise KeyboardInterrupt
-                        noInputPrev = noInput
-                        wDesPrev = wDesJ
-                        keyDownPrev, noInput, wSelJ, wDesJ = GetKeysJoint(keyDownPrev, events, wSelJ, wDesPrev, 0, wMax, jIncr)
-                        screen.blit(background, (0,0))
-                        lastFrame = time.perf_counter()
-                        
-                elif space == 'end-effector':
-                    if time.perf_counter() - lastPID > dtPID:
-                        #VelControl implicitely updates serial.mSpeed.
-                        if noInput and not any(keyDownPrev):
-                            if noInput != noInputPrev:
-                                #Initiate PID
-                                PIDPos.Reset()
-                                thetaDes = np.array(serial.currAngle[:-1])
-                                thetacurr = np.array(serial.currAngle[:-1])
-                            serial.mSpeed[:-1] = HoldPos(serial, Pegasus, PIDPos, 
-                                                            thetaDes, dtPID)
-                        else:
-                            #FF & PID!
-                            vPrevJ = VelControl(Pegasus, serial, vDesE, vPrevJ, 
-                                                dtPID, 'twist', dtComm, PIDVel)
-                        lastPID = time.perf_counter()
-
-                    if time.perf_counter() - lastFrame >= dtFrame:
-                        noInputPrev = noInput
-                        events = pygame.event.get()
-                        for event in events:
-                            if event.type == pygame.QUIT:
-                                raise KeyboardInterrupt
-                        VPrev = vDesE
-                        keyDownPrev, noInput, wSel, vSel, vDesE = \
-                        GetKeysEF(VPrev, events, keyDownPrev, vSelE, wSelE, 0, 
-                                    wMax, 0, vMax, efIncrL, efIncrR)
-                        pygame.display.update()
-                        screen.blit(background, (0,0))
-                        lastFrame = time.perf_counter()
-                if (time.perf_counter() - lastComm >= dtComm):
-                    SReadAndParse(serial, Teensy)
-                    serial.rotDirDes = [1 if np.sign(speed) == 1 else 0 for 
-                                        speed in serial.mSpeed]
-                    for i in range(serial.lenData-1): #TODO: Add Gripper function
-                        serial.dataOut[i] = f"{abs(serial.mSpeed[i])}|"+\
-                                            f"{serial.rotDirDes[i]}"
-                    #TODO: Replace last entry w/ 
-                    # gripper commands
-                    serial.dataOut[-1] = f"{0}|{0}"
-                    Teensy.write(f"{serial.dataOut}\n".encode('utf-8')) 
-                    lastComm = time.perf_counter()
-            
-            elif method == 'force': #Force control
-                n = -1 #iterator
-                startTime = time.perf_counter()
-                print(f"Expected total time: {dtWrench*len(wrenchesList)} s.")
-                while time.perf_counter() - startTime <= dtWrench*len(wrenchesList):
-                    nPrev = n
-                    n = round((time.perf_counter()-startTime)/dtWrench)
-                    if n >= len(wrenchesList):
-                        print("finished!")
-                        #Initiate hold-pos
-                        thetaDes = np.array(serial.currAngle[:-1])
-                        errThetaCurr = np.array([100*np.pi for i in serial.currAngle[:-1]])
-                        print("Stabilizing around new position...")
-                        while all(np.greater(errThetaCurr, errThetaMax)):
-                            if time.perf_counter() - lastHold >= dtHold: 
-                        #While not stabilized within error bounds, do holdpos
-                                serial.mSpeed[:-1] = HoldPos(serial, Pegasus, PIDPos, thetaDes, 
-                                                        dtHold)
-                                lastHold = time.perf_counter()
-
-                            if (time.perf_counter() - lastComm >= dtComm):
-                                SReadAndParse(serial, Teensy)
-                                errThetaCurr = thetaDes - np.array(serial.currAngle[:-1])
-                                serial.rotDirDes = [1 if np.sign(speed) == 1 else 0 for 
-                                                    speed in serial.mSpeed]
-                                for i in range(serial.lenData-1): 
-                                    serial.dataOut[i] = f"{abs(serial.mSpeed[i])}|"+\
-                                                        f"{serial.rotDirDes[i]}"
-                                serial.dataOut[-1] = f"{0|0}"
-                                Teensy.write(f"{serial.dataOut}\n".encode('utf-8')) 
-                                lastComm = time.perf_counter()
-                        print("Stabilization complete.")
-                        PIDPos.Reset()
-                        raise KeyboardInterrupt
-                    if n != nPrev:
-                        ForceControl(Pegasus, serial, wrenchesList[n], forceDamp, dtWrench)
-                    
-                    if time.perf_counter() - lastFrame >= dtFrame:
-                                events = pygame.event.get() #avoids freezing.
-                                for event in events:
-                                    if event.type == pygame.QUIT:
-                                        raise KeyboardInterrupt
-                                screen.blit(background, (0,0))
-                                pygame.display.update()
-                                lastFrame = time.perf_counter()
-
-                    if (time.perf_counter() - lastComm >= dtComm):
-                        SReadAndParse(serial, Teensy)
-                        serial.rotDirDes = [1 if np.sign(speed) == 1 else 0 for 
-                                            speed in serial.mSpeed]
-                        for i in range(serial.lenData-1): #TODO: Add Gripper function
-                            serial.dataOut[i] = f"{abs(serial.mSpeed[i])}|"+\
-                                                f"{serial.rotDirDes[i]}"
-                            #TODO: Replace last entry w/ gripper commands
-                            serial.dataOut[-1] = f"{0|0}"
-                            Teensy.write(f"{serial.dataOut}\n".encode('utf-8')) 
-                            lastComm = time.perf_counter()
-            
-            elif method == 'imp': #Impedance control
-                if time.perf_counter() - lastPID > dtPID:
-                    VPrev, dthetaPrev = ImpControl(Pegasus, serial, TDes, VPrev, dthetaPrev, dtPID, M, B, Kx, Ka, PIDPos)
-                if time.perf_counter() - lastFrame >= dtFrame:
-                    events = pygame.event.get() #avoids freezing.
-                    for event in events:
-                        if event.type == pygame.QUIT:
-                            raise KeyboardInterrupt
-                    screen.blit(background, (0,0))
-                    pygame.display.update()
-                    lastFrame = time.perf_counter()
-
-                if (time.perf_counter() - lastComm >= dtComm):
-                    SReadAndParse(serial, Teensy)
-                    serial.rotDirDes = [1 if np.sign(speed) == 1 else 0 for 
-                                        speed in serial.mSpeed]
-                    for i in range(serial.lenData-1): #TODO: Add Gripper function
-                        serial.dataOut[i] = f"{abs(serial.mSpeed[i])}|"+\
-                                            f"{serial.rotDirDes[i]}"
-                    #TODO: Replace last entry w/ gripper commands
-                    serial.dataOut[-1] = f"{0|0}"
-                    Teensy.write(f"{serial.dataOut}\n".encode('utf-8')) 
-                    lastComm = time.perf_counter()
+            else: #Velocity, force & impedance control
+                if method == 'force':
+                    print("Expected total time: " + 
+                          f"{dtWrench*len(wrenchesList)} s.")
+                    state['n'] = -1
+                period, callback, phase = ModeTasks(scheduler)
+                scheduler.AddTask("control", period, callback, phase=phase)
+                scheduler.AddTask("comm", dtComm, 
+                                  lambda: CommTask(serial, worker, timing))
+                loop.run_until_complete(scheduler.RunAsync())
+                if method == 'force':
+                    print("finished!")
+                    #Initiate hold-pos
+                    thetaDes = np.array(serial.currAngle[:-1])
+                    print("Stabilizing around new position...")
+                    HoldUntilStable(serial, worker, Pegasus, PIDPos, thetaDes, 
+                                    errThetaMax, dtHold, dtComm, dtFrame, 
+                                    None, background, timing, loop, clock,
+                                    sleep, asyncSleep)
+                    print("Stabilization complete.")
+                    PIDPos.Reset()
+                    raise KeyboardInterrupt
     finally:
         print("Quitting...") 
-        #Set motor speeds to zero & close serial.
-        Teensy.write(f"{['0|0'] * serial.lenData}\n".encode("utf-8"))
+        #Stop the coroutines, set motor speeds to zero & close serial.
+        worker.Stop()
+        for task in bgTasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*bgTasks, 
+                                               return_exceptions=True))
+        serial.mSpeed = [0 for i in range(serial.lenData)]
+        SWriteCommand(serial, Teensy)
         time.sleep(dtComm)
-        Teensy.__del__()
+        Teensy.close()
+        loop.close()
+        timing.Append(samplesTitle)
+        print("\nControl loop timing:")
+        timing.Dump(args.timing)
 
@@ -69,3 +69,47 @@ def test_PIDDerivative():
     assert PIDVal[2] > 0
 
 
+
+def test_PIDMatrix():
+    """Full gain matrices are applied to all terms, state in place."""
+    kP = np.array([[1, 0.5], [0, 1]])
+    kI = np.array([[1, 1], [0, 1]])
+    kD = np.array([[0, 0], [0.1, 0]])
+    PIDObj = PID(kP, kI, kD, np.array([5, 5]))
+    errPrev = PIDObj.errPrev
+    err = np.array([1., 2.])
+    PIDVal = PIDObj.Execute(err, np.zeros(2), 0.1)
+    termI = kI @ (0.1*err/2)
+    assert np.allclose(PIDVal, kP @ err + termI + kD @ (err/0.1))
+    assert PIDObj.errPrev is errPrev
+    assert np.array_equal(errPrev, err)
+
+def test_PIDBatch():
+    """K controllers at once equal K separate PID objects."""
+    K = 4
+    kPs = np.random.rand(K,1,5)*np.eye(5)
+    kI = 0.1*np.eye(5)
+    kD = 0.02*np.eye(5)
+    PIDBatch = PID(kPs, kI, kD, ILim, dMeas=True, tf=0.05)
+    PIDObjs = [PID(kPs[k], kI, kD, ILim, dMeas=True, tf=0.05) 
+               for k in range(K)]
+    for t in range(5):
+        FdbK = np.random.rand(K,5)
+        PIDVal = PIDBatch.Execute(ref, FdbK, dt)
+        assert PIDVal.shape == (K,5)
+        for k in range(K):
+            assert np.allclose(PIDVal[k], PIDObjs[k].Execute(ref, FdbK[k], 
+                                                             dt))
+
+def test_PIDDerivativeMeas():
+    """Derivative on measurement: No kick on a reference step."""
+    PIDObj = PID(0, 0, kD, ILim, dMeas=True)
+    PIDObj.Execute(np.zeros(5), Fdb, dt)
+    PIDVal = PIDObj.Execute(ref, Fdb, dt)
+    assert np.allclose(PIDVal, np.zeros(5))
+    PIDVal = PIDObj.Execute(ref, Fdb + 1, dt)
+    assert np.allclose(PIDVal, -kD/dt)
+    PIDObj = PID(0, 0, kD, ILim, dMeas=True, tf=dt)
+    PIDObj.Execute(ref, Fdb, dt)
+    PIDVal = PIDObj.Execute(ref, Fdb + 1, dt)
+    assert np.allclose(PIDVal, -kD/(2*dt)) #Filtered
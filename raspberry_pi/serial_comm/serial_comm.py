@@ -6,15 +6,41 @@ current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
 
-from classes import SerialData, InputError
+from classes import SerialData, InputError, FrameParser, SerialWorker, \
+                    TimingLog, AsyncSerial, SerialBuffers, NULL_TIMING
+import asyncio
 from robot_init import robot as Pegasus
-from typing import Tuple
+from typing import Tuple, List, Callable, Any
 import serial
 import serial.tools.list_ports
 import time
+import struct
+import binascii
 import numpy as np
 np.set_printoptions(precision=4, floatmode='fixed', suppress=True)
 
+"""Binary frame layout (little-endian), used next to the ASCII protocol:
+[sync: 0xA5 0x5A][length: uint8][type: uint8][seq: uint16][payload]
+[crc: uint16]
+- length: Number of payload bytes.
+- seq: Rolling frame counter, used to detect dropped frames.
+- crc: CRC-16/CCITT-FALSE over length, type, seq & payload.
+State frames (Teensy -> Pi) hold per motor: int32 encoder count, uint8 
+rotational direction, uint8 homing value & int16 current in [mA].
+Command frames (Pi -> Teensy) hold per motor a signed int16 PWM value.
+Hello frames (both ways, empty payload) negotiate the protocol, see
+NegotiateProtocol. Firmware: teensyduino/serial_comm_v6. Older firmware
+only speaks the ASCII protocol.
+"""
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_STATE = 0x01
+FRAME_CMD = 0x02
+FRAME_HELLO = 0x03
+FRAME_HEADER = struct.Struct('<2sBBH')
+FRAME_CRC = struct.Struct('<H')
+STATE_MOTOR = 'iBBh'
+CMD_MOTOR = 'h'
+
 
 #TODO: Docstrings, examples, & tests.
 def FindSerial(askInput=False) -> str:
@@ -126,29 +152,441 @@ def SReadAndParse(SPData: SerialData,  localMu: serial.Serial,
     controlBool = True
     if localMu.inWaiting() == 0:
         return controlBool
-    elif localMu.inWaiting() > 0:
+    if SPData.parser is None:
+        SPData.parser = NewFrameParser(SPData, encAlg)
+    nCorrupt = SPData.parser.nCorrupt
+    SPData.parser.Feed(localMu.read(localMu.inWaiting()))
+    #Apply every frame in order, such that prevAngle & currAngle are
+    #always one frame apart.
+    for tIn, state in SPData.parser.Poll():
+        SPData.UpdateCounts(*state)
+        SPData.tIn = tIn
+    SPData.seqIn = SPData.parser.seq
+    if SPData.parser.nCorrupt != nCorrupt:
+        controlBool = False
+    return controlBool
+
+def SWriteCommand(SPData: SerialData, localMu: serial.Serial, 
+                  encAlg: str = "utf-8"):
+    """Sends the current motor commands to the local microcontroller.
+    The signed PWM values in SPData.mSpeed are split into a magnitude 
+    (at most 255) and a rotational direction (1 for positive, else 0).
+    :param SPData: SerialData instance, stores the motor commands.
+    :param localMu: serial.Serial() instance representing the serial
+                    communication with the local microcontroller.
+    :param encAlg: Algorithm used to encode data into bytes for serial.
+
+    Example input:
+    SPData = SerialData(6, Pegasus.joints)
+    SPData.mSpeed = [100, -300, 0, 20, -20, 0]
+    localMu = StartComms("COM9", 115200)
+    Output (over serial):
+    "['100|1', '255|0', '0|0', '20|1', '20|0', '0|0']\n"
+    """
+    if SPData.protocol == 'bin':
+        localMu.write(EncodeCommandFrame(SPData))
+        return
+    for i in range(SPData.lenData-1): #TODO: Add Gripper function
+        speed = SPData.mSpeed[i]
+        SPData.rotDirDes[i] = 1 if np.sign(speed) == 1 else 0
+        SPData.dataOut[i] = f"{min(abs(int(speed)), 255)}|"+\
+                            f"{SPData.rotDirDes[i]}"
+    #TODO: Replace last entry w/ gripper commands
+    SPData.dataOut[-1] = f"{0}|{0}"
+    localMu.write(f"{SPData.dataOut}\n".encode(encAlg))
+
+def FrameCRC(data: bytes) -> int:
+    """Computes the CRC-16/CCITT-FALSE checksum of a binary frame.
+    :param data: Bytes after the sync bytes, up to the checksum.
+    :return crc: 16-bit checksum.
+
+    Example input:
+    data = b'123456789'
+    Output:
+    10673 (0x29B1)
+    """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+def EncodeFrame(frameType: int, seq: int, payload: bytes) -> bytes:
+    """Wraps a payload into a binary frame, see the top of this module.
+    :param frameType: FRAME_STATE or FRAME_CMD.
+    :param seq: Sequence number, wrapped to 16 bits.
+    :param payload: Payload bytes, at most 255.
+    :return frame: Complete frame, including sync bytes & checksum.
+
+    Example input:
+    frameType = FRAME_CMD
+    seq = 1
+    payload = b'\x01\x00'
+    Output:
+    b'\xa5\x5a\x02\x02\x01\x00\x01\x00' + 2 checksum bytes
+    """
+    if len(payload) > 255:
+        raise InputError(f"Payload too long: {len(payload)} > 255")
+    header = FRAME_HEADER.pack(FRAME_SYNC, len(payload), frameType, 
+                               seq & 0xFFFF)
+    crc = FrameCRC(header[2:] + payload)
+    return header + payload + FRAME_CRC.pack(crc)
+
+def DecodeFrame(frame: bytes) -> Tuple[int, int, bytes]:
+    """Checks & unpacks a single binary frame.
+    :param frame: Complete frame, starting at the sync bytes.
+    :return frameType: Type of the frame, e.g. FRAME_STATE.
+    :return seq: Sequence number of the frame.
+    :return payload: Payload bytes.
+
+    Example input:
+    frame = EncodeFrame(FRAME_CMD, 1, b'\x01\x00')
+    Output:
+    (2, 1, b'\x01\x00')
+    """
+    if len(frame) < FRAME_HEADER.size + FRAME_CRC.size:
+        raise InputError(f"Frame too short: {len(frame)} bytes")
+    sync, length, frameType, seq = FRAME_HEADER.unpack_from(frame)
+    if sync != FRAME_SYNC:
+        raise InputError(f"Invalid sync bytes: {sync}")
+    end = FRAME_HEADER.size + length
+    if len(frame) != end + FRAME_CRC.size:
+        raise InputError(f"Frame length mismatch: {len(frame)} != " +
+                         f"{end + FRAME_CRC.size}")
+    crc = FRAME_CRC.unpack_from(frame, end)[0]
+    if crc != FrameCRC(frame[2:end]):
+        raise InputError("Frame checksum mismatch")
+    return frameType, seq, bytes(frame[FRAME_HEADER.size:end])
+
+def StateStruct(lenData: int) -> struct.Struct:
+    """Returns the payload layout of a state frame with lenData motors."""
+    return struct.Struct('<' + STATE_MOTOR*lenData)
+
+def EncodeStateFrame(totCount: List[int], rotDir: List[int], 
+                     homing: List[int], current: List[float], 
+                     seq: int) -> bytes:
+    """Encodes motor states into a state frame, as sent by the Teensy.
+    :param totCount: Total encoder count of each motor.
+    :param rotDir: Rotational direction of each motor.
+    :param homing: Homing sensor value of each motor.
+    :param current: Current of each motor in [A].
+    :param seq: Sequence number of the frame.
+    :return frame: Complete state frame.
+    """
+    values = []
+    for i in range(len(totCount)):
+        values += [int(totCount[i]), int(rotDir[i]), int(homing[i]), 
+                   int(round(current[i]*1000))]
+    return EncodeFrame(FRAME_STATE, seq, 
+                       StateStruct(len(totCount)).pack(*values))
+
+def DecodeStatePayload(payload: bytes, lenData: int) \
+                       -> Tuple[List[int], List[int], List[int], List[float]]:
+    """Unpacks the payload of a state frame.
+    :param payload: Payload bytes of a state frame.
+    :param lenData: Number of motors.
+    :return totCount: Total encoder count of each motor.
+    :return rotDir: Rotational direction of each motor.
+    :return homing: Homing sensor value of each motor.
+    :return current: Current of each motor in [A].
+
+    Example input:
+    payload = DecodeFrame(EncodeStateFrame([10, -20], [1, 0], [0, 1], 
+                                           [0.25, 0], 0))[2]
+    lenData = 2
+    Output:
+    ([10, -20], [1, 0], [0, 1], [0.25, 0.0])
+    """
+    layout = StateStruct(lenData)
+    if len(payload) != layout.size:
+        raise InputError(f"State payload size {len(payload)} != " +
+                         f"{layout.size}")
+    values = layout.unpack(payload)
+    return (list(values[0::4]), list(values[1::4]), list(values[2::4]), 
+            [value/1000 for value in values[3::4]])
+
+def EncodeCommandFrame(SPData: SerialData) -> bytes:
+    """Encodes the motor commands in SPData into a command frame, the
+    binary equivalent of SWriteCommand, and increments SPData.seqOut.
+    :param SPData: SerialData instance, stores the motor commands.
+    :return frame: Complete command frame.
+
+    Example input:
+    SPData = SerialData(6, Pegasus.joints)
+    SPData.mSpeed = [100, -300, 0, 20, -20, 0]
+    Output:
+    Command frame with payload [100, -255, 0, 20, -20, 0] (int16)
+    """
+    PWM = [0 for i in range(SPData.lenData)]
+    for i in range(SPData.lenData-1): #TODO: Add Gripper function
+        speed = int(SPData.mSpeed[i])
+        SPData.rotDirDes[i] = 1 if speed > 0 else 0
+        PWM[i] = max(min(speed, 255), -255)
+    frame = EncodeFrame(FRAME_CMD, SPData.seqOut, 
+                        struct.pack('<' + CMD_MOTOR*SPData.lenData, *PWM))
+    SPData.seqOut = (SPData.seqOut + 1) & 0xFFFF
+    return frame
+
+def DecodeCommandPayload(payload: bytes, lenData: int) -> List[int]:
+    """Unpacks the signed PWM values of a command frame payload."""
+    return list(struct.unpack('<' + CMD_MOTOR*lenData, payload))
+
+def SplitTextFrames(buffer: bytearray) -> Tuple[List[bytes], int, int]:
+    """Finds all complete ASCII frames ('[...]\r\n') in a buffer.
+    :param buffer: Received bytes, possibly ending in a partial frame.
+    :return frames: Complete frames, without the line ending.
+    :return consumed: Number of bytes processed, the rest is a partial
+                      frame.
+    :return nCorrupt: Number of lines not starting with '['.
+
+    Example input:
+    buffer = bytearray(b'0|1]\r\n[10|1][20|0]\r\n[30|')
+    Output:
+    ([b'[10|1][20|0]'], 20, 1)
+    """
+    frames = []
+    pos = 0
+    nCorrupt = 0
+    while True:
+        end = buffer.find(b'\r\n', pos)
+        if end == -1:
+            break
+        start = buffer.find(b'[', pos, end)
+        if start != pos:
+            nCorrupt += 1
+        if start != -1:
+            frames.append(bytes(buffer[start:end]))
+        pos = end + 2
+    return frames, pos, nCorrupt
+
+def DecodeTextFrame(frame: bytes, lenData: int, encAlg: str="utf-8") \
+                    -> Tuple[None, Tuple[List[int], List[int], list, list]]:
+    """Decodes an ASCII frame from SplitTextFrames, the equivalent of
+    SerialData.ExtractVars. The homing value may be a digit or the raw
+    byte written by the firmware.
+    :param frame: Frame of the form '[totCount|rotDir|homing|curr]...'.
+    :param lenData: Number of motors.
+    :param encAlg: Algorithm used to encode data into bytes for serial.
+    :return seq: None, the ASCII protocol has no sequence numbers.
+    :return state: totCount, rotDir, homing & current of each motor,
+                   the latter two None if not sent.
+
+    Example input:
+    frame = b'[10|1|0|0.50][20|0]'
+    lenData = 2
+    Output:
+    (None, ([10, 20], [1, 0], [0, None], [0.5, None]))
+    """
+    try:
+        text = frame.decode(encAlg)
+        if text[0] != '[' or text[-1] != ']':
+            raise InputError(f"Invalid frame: {text}")
+        dataPacket = text[1:-1].split('][')
+        if len(dataPacket) != lenData:
+            raise InputError(f"Frame length {len(dataPacket)} != {lenData}")
+        totCount = [0 for i in range(lenData)]
+        rotDir = [0 for i in range(lenData)]
+        homing = [None for i in range(lenData)]
+        current = [None for i in range(lenData)]
+        for i in range(lenData):
+            args = dataPacket[i].split('|')
+            if not 2 <= len(args) <= 4:
+                raise InputError(f"Invalid data packet: {dataPacket[i]}")
+            totCount[i] = int(args[0])
+            rotDir[i] = int(args[1])
+            if len(args) >= 3:
+                homing[i] = int(args[2]) if args[2].isdigit() \
+                            else ord(args[2])
+            if len(args) == 4:
+                current[i] = float(args[3])
+    except (ValueError, TypeError, IndexError, UnicodeDecodeError) as e:
+        raise InputError(f"Invalid frame: {frame}: {e}")
+    return None, (totCount, rotDir, homing, current)
+
+def SplitBinFrames(buffer: bytearray) -> Tuple[List[bytes], int, int]:
+    """Finds all complete & valid binary frames in a buffer. After a 
+    corrupt frame, the search resumes right after its sync bytes.
+    :param buffer: Received bytes, possibly ending in a partial frame.
+    :return frames: Complete frames with a valid checksum.
+    :return consumed: Number of bytes processed, the rest is a partial
+                      frame.
+    :return nCorrupt: Number of corrupt frames & skipped chunks.
+    """
+    frames = []
+    pos = 0
+    nCorrupt = 0
+    resync = False #Bytes skipped after a corrupt frame belong to it
+    while True:
+        idx = buffer.find(FRAME_SYNC, pos)
+        if idx == -1:
+            #Keep a trailing first sync byte, its partner may follow.
+            keep = 1 if buffer[-1:] == FRAME_SYNC[:1] else 0
+            if len(buffer) - keep > pos:
+                nCorrupt += 0 if resync else 1
+                pos = len(buffer) - keep
+            break
+        if idx > pos and not resync:
+            nCorrupt += 1
+        resync = False
+        if idx + FRAME_HEADER.size > len(buffer):
+            pos = idx
+            break
+        end = idx + FRAME_HEADER.size + buffer[idx+2] + FRAME_CRC.size
+        if end > len(buffer):
+            pos = idx
+            break
+        frame = bytes(buffer[idx:end])
         try:
-            dataIn = GetComms(localMu, encAlg)
-        except InputError as e:
-            controlBool = False
-            print(str(e))
-            localMu.reset_input_buffer()
-            return controlBool
-        except UnicodeDecodeError as e:
-            controlBool = False
-            localMu.reset_input_buffer()
-            return controlBool
-        dataPacket = dataIn[1:-1].split('][')
-        if len(dataPacket) != SPData.lenData: #flush & retry
-            print("error")
-            controlBool = False
-            localMu.reset_input_buffer()
-            return controlBool
-        localMu.reset_input_buffer()
-        #Expected form dataPacket[i]: "totCount|rotDir"
-        #Or "totCount|rotDir|currentVal|homingBool"
-        #Extract both variables, put into SPData object.
-        SPData.ExtractVars(dataPacket)
+            DecodeFrame(frame)
+        except InputError:
+            nCorrupt += 1
+            pos = idx + 1
+            resync = True
+            continue
+        frames.append(frame)
+        pos = end
+    return frames, pos, nCorrupt
+
+def DecodeStateFrame(frame: bytes, lenData: int) \
+                     -> Tuple[int, Tuple[List[int], List[int], list, list]]:
+    """Decodes a binary state frame.
+    :param frame: Complete frame, starting at the sync bytes.
+    :param lenData: Number of motors.
+    :return seq: Sequence number of the frame.
+    :return state: totCount, rotDir, homing & current of each motor.
+    """
+    frameType, seq, payload = DecodeFrame(frame)
+    if frameType != FRAME_STATE:
+        raise InputError(f"Unexpected frame type: {frameType}")
+    return seq, DecodeStatePayload(payload, lenData)
+
+def NewFrameParser(SPData: SerialData, encAlg: str="utf-8", 
+                   clock=time.perf_counter) -> FrameParser:
+    """Creates a FrameParser for the protocol in SPData.protocol.
+    :param SPData: SerialData instance, sets protocol & lenData.
+    :param encAlg: Algorithm used to encode data into bytes for serial.
+    :param clock: Function returning the current time in seconds.
+    :return parser: FrameParser returning (totCount, rotDir, homing, 
+                    current) of each frame.
+    """
+    lenData = SPData.lenData
+    if SPData.protocol == 'bin':
+        return FrameParser(SplitBinFrames, 
+                           lambda frame: DecodeStateFrame(frame, lenData),
+                           clock=clock)
+    return FrameParser(SplitTextFrames, 
+                       lambda frame: DecodeTextFrame(frame, lenData, encAlg),
+                       clock=clock)
+
+def NegotiateProtocol(SPData: SerialData, localMu: serial.Serial, 
+                      timeout: float=1, clock=time.perf_counter) -> str:
+    """Asks the local microcontroller to switch to the binary protocol
+    with a hello frame, and configures SPData accordingly. Firmware 
+    speaking it (serial_comm_v6) acknowledges with a hello frame and 
+    sends binary state frames from then on. The hello frame is followed
+    by a newline, such that ASCII-only firmware discards it as an 
+    invalid command. Without a binary frame before the timeout, the
+    ASCII protocol is kept. Replies (SWriteCommand) follow SPData.protocol.
+    :param SPData: SerialData instance, SPData.protocol is set.
+    :param localMu: serial.Serial() instance representing the serial
+                    communication with the local microcontroller.
+    :param timeout: Maximum time to wait for an acknowledgement [s].
+    :param clock: Function returning the current time in seconds.
+    :return protocol: 'bin' or 'text'.
+    """
+    localMu.write(EncodeFrame(FRAME_HELLO, 0, b'') + b'\n')
+    data = b''
+    tStart = clock()
+    while clock() - tStart < timeout:
+        if localMu.inWaiting() > 0:
+            data += localMu.read(localMu.inWaiting())
+        if len(SplitBinFrames(data)[0]) > 0:
+            SPData.protocol = 'bin'
+            SPData.parser = None
+            return SPData.protocol
+        time.sleep(0.001)
+    SPData.protocol = 'text'
+    SPData.parser = None
+    return SPData.protocol
+
+def StartSerialWorker(SPData: SerialData, localMu: serial.Serial, 
+                      dtComm: float, timing: TimingLog=None) -> SerialWorker:
+    """Starts a SerialWorker thread reading (SReadAndParse) & writing 
+    (SWriteCommand) the local microcontroller. The worker uses its own
+    copy of SPData, exchange data through SerialWorker.Exchange(SPData).
+    :param SPData: SerialData instance of the control loop.
+    :param localMu: serial.Serial() instance representing the serial
+                    communication with the local microcontroller, 
+                    afterwards only to be used by the worker.
+    :param dtComm: Time between two sent commands in [s].
+    :param timing: Optional TimingLog for the read & write tasks.
+    :return worker: The running SerialWorker.
+
+    Example input:
+    SPData = SerialData(6, Pegasus.joints)
+    localMu = StartComms("COM9", 115200)
+    dtComm = 0.05
+    Output:
+    SerialWorker(running=True, snapshots=0)
+    """
+    SPWorker = SPData.Snapshot()
+    return SerialWorker(SPWorker, localMu, SReadAndParse, SWriteCommand, 
+                        dtComm, timing=timing).Start()
+
+def StartAsyncSerial(SPData: SerialData, localMu, dtComm: float, 
+                     loop: asyncio.AbstractEventLoop, 
+                     timing: TimingLog=None, 
+                     clock: Callable[[], float]=None, 
+                     asyncSleep: Callable[[float], Any]=None) -> AsyncSerial:
+    """Schedules the receiving (SReadAndParse) & sending (SWriteCommand)
+    coroutines of an AsyncSerial on the event loop of the control loop. 
+    Like StartSerialWorker, it uses its own copy of SPData, exchange
+    data through AsyncSerial.Exchange(SPData) (or SExchange).
+    :param SPData: SerialData instance of the control loop.
+    :param localMu: serial.Serial() instance representing the serial
+                    communication with the local microcontroller, 
+                    afterwards only to be used by the coroutines.
+    :param dtComm: Time between two sent commands in [s].
+    :param loop: Event loop shared with the control loop.
+    :param timing: Optional TimingLog for the read & write tasks.
+    :param clock: Optional time source of the coroutines, e.g. a 
+                  SimClock. Real time if None.
+    :param asyncSleep: Coroutine function sleeping in clock, e.g. 
+                       SimClock.AsyncSleep. asyncio.sleep if None.
+    :return SPAsync: The scheduled AsyncSerial, running whenever the 
+                     loop runs.
+
+    Example input:
+    SPData = SerialData(6, Pegasus.joints)
+    localMu = StartComms("COM9", 115200)
+    dtComm = 0.05
+    loop = asyncio.new_event_loop()
+    Output:
+    AsyncSerial(running=True, snapshots=0)
+    """
+    SPAsync = SPData.Snapshot()
+    return AsyncSerial(SPAsync, localMu, SReadAndParse, SWriteCommand, 
+                       dtComm, timing=timing, clock=clock, 
+                       asyncSleep=asyncSleep).Start(loop)
+
+def SExchange(SPData: SerialData, localMu, timing: TimingLog=None) -> bool:
+    """One communication step of the control loop: Receives the newest
+    data into SPData & sends SPData.mSpeed. With a SerialWorker (or
+    AsyncSerial) this only exchanges in-memory state, otherwise the 
+    port is read & written directly.
+    :param SPData: SerialData instance of the control loop.
+    :param localMu: SerialWorker, AsyncSerial, or serial.Serial() 
+                    instance representing the local microcontroller.
+    :param timing: Optional TimingLog to record the duration in.
+    :return controlBool: Boolean indicating if control can be done on 
+                         new data. With a SerialWorker, True if data 
+                         was received since the previous exchange.
+    """
+    timing = NULL_TIMING if timing is None else timing
+    if isinstance(localMu, SerialBuffers):
+        with timing.Measure("SerialWorker.Exchange"):
+            controlBool = localMu.Exchange(SPData)
+        return controlBool
+    with timing.Measure("SReadAndParse"):
+        controlBool = SReadAndParse(SPData, localMu)
+    with timing.Measure("SWriteCommand"):
+        SWriteCommand(SPData, localMu)
     return controlBool
 
 #Proof-of-concept function: No tests available
@@ -8,8 +8,14 @@ sys.path.append(parent)
 import numpy as np
 import serial
 import time
-from serial_comm import FindSerial, StartComms, GetComms, SReadAndParse, SetPointControl1
-from classes import SerialData
+import asyncio
+from serial_comm import FindSerial, StartComms, GetComms, SReadAndParse, SetPointControl1, \
+                        SWriteCommand, EncodeFrame, DecodeFrame, EncodeStateFrame, \
+                        DecodeStatePayload, DecodeCommandPayload, NegotiateProtocol, \
+                        FrameCRC, FRAME_CMD, NewFrameParser, StartSerialWorker, SExchange, \
+                        StartAsyncSerial, FRAME_HELLO
+from classes import InputError
+from classes import SerialData, Scheduler
 from robot_init import robot
 
 """Trying to do multiple test cases for FindSerial() and GetComms() is 
@@ -154,4 +160,260 @@ def test_SReadAndParseNormal():
         assert controlBool
         assert SPData.totCount[0] == 1000 #serial input is 1000, should be taken
         return None
-    assert False
\ No newline at end of file
+    assert False
+
+class FakePort():
+    """Serial port stand-in: Reads from a preset buffer, records writes."""
+    def __init__(self, dataIn: bytes=b""):
+        self.dataIn = dataIn
+        self.data = b""
+    def inWaiting(self) -> int:
+        return len(self.dataIn)
+    def read(self, size: int) -> bytes:
+        dataOut, self.dataIn = self.dataIn[:size], self.dataIn[size:]
+        return dataOut
+    def write(self, data: bytes):
+        self.data += data
+
+def test_SWriteCommand():
+    """Check the formatting of signed motor commands, without a port."""
+    class WriteBuffer():
+        def __init__(self):
+            self.data = b""
+        def write(self, data: bytes):
+            self.data += data
+    localMu = WriteBuffer()
+    SPData = SerialData(6, robot.joints)
+    SPData.mSpeed = [100, -300, 0, 20.0, -20, 0]
+    SWriteCommand(SPData, localMu)
+    assert localMu.data == \
+        b"['100|1', '255|0', '0|0', '20|1', '20|0', '0|0']\n"
+    assert SPData.rotDirDes[0:5] == [1, 0, 0, 1, 0]
+
+def test_FrameRoundTrip():
+    assert FrameCRC(b"123456789") == 0x29B1
+    frame = EncodeFrame(FRAME_CMD, 70000, b"\x01\x02\x03")
+    assert DecodeFrame(frame) == (FRAME_CMD, 70000 & 0xFFFF, b"\x01\x02\x03")
+    payload = DecodeFrame(EncodeStateFrame([2**31-1, -20], [1, 0], [0, 1], 
+                                           [0.25, -1.5], 3))[2]
+    assert DecodeStatePayload(payload, 2) == \
+        ([2**31-1, -20], [1, 0], [0, 1], [0.25, -1.5])
+
+def test_FrameCorrupt():
+    """Any flipped bit or truncation must be rejected."""
+    frame = bytearray(EncodeStateFrame([1, 2], [0, 0], [0, 0], [0, 0], 0))
+    for i in range(2, len(frame)):
+        corrupt = bytearray(frame)
+        corrupt[i] ^= 0x10
+        try:
+            DecodeFrame(bytes(corrupt))
+            assert False
+        except InputError:
+            pass
+    try:
+        DecodeFrame(bytes(frame[:-1]))
+        assert False
+    except InputError:
+        pass
+
+def test_SReadAndParseBin():
+    """Binary frames give the same state as the ASCII protocol, frames 
+    split over two reads are completed instead of dropped."""
+    SPText = SerialData(6, robot.joints)
+    SPText.ExtractVars(["100|1|0|0.50", "-200|0|1|1.25", "300|1|0|0.00", 
+                        "400|1|0|0.00", "-50|0|0|0.00", "0|0|0|0.00"])
+    SPBin = SerialData(6, robot.joints)
+    SPBin.protocol = 'bin'
+    state = ([100, -200, 300, 400, -50, 0], [1, 0, 1, 1, 0, 0],
+             [0, 1, 0, 0, 0, 0], [0.5, 1.25, 0, 0, 0, 0])
+    old = EncodeStateFrame([9]*6, [0]*6, [0]*6, [0]*6, 1)
+    new = EncodeStateFrame(*state, 2)
+    last = EncodeStateFrame(*state, 3)
+    corrupt = bytearray(old)
+    corrupt[8] ^= 0xFF
+    assert not SReadAndParse(SPBin, FakePort(old + new + bytes(corrupt) + 
+                                             last[:5]))
+    assert SPBin.seqIn == 2
+    assert SPBin.totCount == SPText.totCount
+    assert SPBin.homing == SPText.homing
+    assert SPBin.current == SPText.current
+    assert np.allclose(SPBin.currAngle, SPText.currAngle)
+    assert SPBin.prevAngle[0] != SPBin.currAngle[0] #Old frame applied too
+    assert SReadAndParse(SPBin, FakePort(last[5:]))
+    assert SPBin.seqIn == 3
+    assert np.allclose(SPBin.prevAngle, SPBin.currAngle)
+    parser = SPBin.parser
+    assert (parser.nFrames, parser.nCorrupt, parser.nDropped) == (3, 1, 0)
+
+def test_SReadAndParseText():
+    """ASCII frames are parsed from a byte stream cut at arbitrary 
+    points, including the raw homing byte sent by the firmware."""
+    stream = b"0|0]\r\n" + b"".join(
+        b"[" + b"][".join(f"{10*k+i}|1|".encode() + bytes([i % 2]) + 
+                          b"|0.25" for i in range(6)) + b"]\r\n"
+        for k in range(5))
+    SPData = SerialData(6, robot.joints)
+    counts = []
+    for chunk in [stream[:3], stream[3:40], stream[40:41], stream[41:]]:
+        SReadAndParse(SPData, FakePort(chunk))
+        counts.append(SPData.totCount[0])
+    assert counts == [0, 0, 0, 40]
+    assert SPData.totCount == [40, 41, 42, 43, 44, 45]
+    assert SPData.homing == [0, 1, 0, 1, 0, 1]
+    assert SPData.current == [0.25 for i in range(6)]
+    assert (SPData.parser.nFrames, SPData.parser.nCorrupt) == (5, 1)
+    SPCheck = SerialData(6, robot.joints)
+    SPCheck.ExtractVars([f"{30+i}|1|0|0.25" for i in range(6)])
+    assert np.allclose(SPData.prevAngle, SPCheck.currAngle)
+
+def test_FrameParser():
+    """Timestamps, history since the last poll & dropped frames."""
+    SPData = SerialData(2, robot.joints)
+    SPData.protocol = 'bin'
+    parser = NewFrameParser(SPData)
+    parser.maxHistory = 3
+    frames = [EncodeStateFrame([k, k], [0, 0], [0, 0], [0, 0], k) 
+              for k in [0, 1, 4, 5, 6]]
+    assert parser.Latest() is None
+    assert parser.Feed(frames[0] + frames[1], t=1.0) == 2
+    assert [(t, state[0]) for t, state in parser.Poll()] == \
+           [(1.0, [0, 0]), (1.0, [1, 1])]
+    assert parser.Poll() == []
+    assert parser.Feed(b"".join(frames[2:]), t=2.0) == 3
+    assert parser.nDropped == 2
+    parser.Feed(frames[4], t=3.0) #Repeated frame, history overflows
+    assert parser.nDropped == 3
+    assert [state[0][0] for t, state in parser.Poll()] == [5, 6, 6]
+    assert parser.Latest()[0] == 3.0
+    parser.Feed(b"\x00"*5000)
+    assert len(parser.buffer) <= parser.maxBuffer and parser.nCorrupt == 1
+
+def test_NegotiateProtocol():
+    """The hello frame is acknowledged by binary firmware, ASCII-only
+    firmware keeps sending text frames."""
+    class BinPort(FakePort):
+        """Acknowledges a hello frame as serial_comm_v6 does."""
+        def write(self, data: bytes):
+            super().write(data)
+            if DecodeFrame(data[:-1])[0] == FRAME_HELLO:
+                self.dataIn += EncodeFrame(FRAME_HELLO, 0, b'')
+    SPData = SerialData(6, robot.joints)
+    localMu = BinPort()
+    assert NegotiateProtocol(SPData, localMu) == 'bin'
+    assert localMu.data == EncodeFrame(FRAME_HELLO, 0, b'') + b'\n'
+    frame = EncodeStateFrame([0]*6, [0]*6, [0]*6, [0]*6, 0)
+    assert NegotiateProtocol(SPData, FakePort(b"\x00" + frame)) == 'bin'
+    localMu = FakePort()
+    SPData.mSpeed = [100, -300, 0, 20, -20, 0]
+    SWriteCommand(SPData, localMu)
+    assert DecodeCommandPayload(DecodeFrame(localMu.data)[2], 6) == \
+        [100, -255, 0, 20, -20, 0]
+    assert SPData.seqOut == 1
+    t = [0.]
+    clock = lambda: t.__setitem__(0, t[0]+0.1) or t[0]
+    assert NegotiateProtocol(SPData, FakePort(b"|0][0|0]\r\n[0|0][0|0]" +
+                             b"[0|0][0|0][0|0][0|0]\r\n"), clock=clock) == 'text'
+    assert NegotiateProtocol(SPData, FakePort(), clock=clock) == 'text'
+
+def Commands(data: bytes) -> list:
+    """Decodes all binary command frames written to a FakePort."""
+    commands = []
+    while data:
+        end = 8 + data[2]
+        commands.append(DecodeCommandPayload(DecodeFrame(data[:end])[2], 6))
+        data = data[end:]
+    return commands
+
+def test_SerialWorker():
+    """The control loop only exchanges in-memory state with the worker,
+    which reads & writes the port in the background."""
+    SPData = SerialData(6, robot.joints)
+    SPData.protocol = 'bin'
+    localMu = FakePort(EncodeStateFrame([100]*6, [1]*6, [0]*6, [0]*6, 0))
+    worker = StartSerialWorker(SPData, localMu, 0.002)
+    try:
+        tStart = time.time()
+        while not SExchange(SPData, worker) and time.time() - tStart < 2:
+            time.sleep(0.001)
+        assert SPData.totCount == [100]*6
+        assert SPData.seqIn == 0
+        assert not worker.Exchange(SPData) #Nothing new
+        SPData.mSpeed = [50, -50, 0, 0, 0, 0]
+        worker.Exchange(SPData)
+        SPData.mSpeed[0] = 0
+        assert worker.command == [50, -50, 0, 0, 0, 0] #Commands are copied
+        localMu.dataIn += EncodeStateFrame([200]*6, [1]*6, [0]*6, [0]*6, 1)
+        tStart = time.time()
+        while not worker.Exchange(SPData) and time.time() - tStart < 2:
+            time.sleep(0.001)
+        assert SPData.totCount == [200]*6
+        assert worker.SPData is not SPData
+        tStart = time.time()
+        while [0, -50, 0, 0, 0, 0] not in Commands(localMu.data) and \
+              time.time() - tStart < 2:
+            time.sleep(0.001)
+    finally:
+        worker.Stop()
+    assert not worker.IsRunning()
+    assert Commands(localMu.data)[-1] == [0, -50, 0, 0, 0, 0]
+
+def test_SerialWorkerError():
+    """A crash of the worker thread surfaces in the control loop."""
+    class BrokenPort(FakePort):
+        def inWaiting(self):
+            raise serial.SerialException("device disconnected")
+    SPData = SerialData(6, robot.joints)
+    worker = StartSerialWorker(SPData, BrokenPort(), 0.002)
+    worker.thread.join(2)
+    try:
+        worker.Exchange(SPData)
+        assert False
+    except serial.SerialException:
+        pass
+
+def test_AsyncSerial():
+    """Polling a port without file descriptor: The coroutines share the
+    event loop with the control loop, which only exchanges state."""
+    SPData = SerialData(6, robot.joints)
+    SPData.protocol = 'bin'
+    localMu = FakePort(EncodeStateFrame([100]*6, [1]*6, [0]*6, [0]*6, 0))
+    loop = asyncio.new_event_loop()
+    try:
+        worker = StartAsyncSerial(SPData, localMu, 0.01, loop)
+        assert worker.IsRunning() and worker.FileNo() is None
+        received = []
+        def ControlTask():
+            received.append(SExchange(SPData, worker))
+            SPData.mSpeed = [50, -50, 0, 0, 0, 0]
+        scheduler = Scheduler()
+        scheduler.AddTask("control", 0.01, ControlTask)
+        loop.run_until_complete(scheduler.RunAsync(until=lambda: 
+                                SPData.totCount == [100]*6 and 
+                                [50, -50, 0, 0, 0, 0] in 
+                                Commands(localMu.data)))
+        assert worker.nSnapshot == 1
+        assert worker.SPData is not SPData
+        assert received.count(True) == 1 #One frame sent
+        worker.Stop()
+        assert not worker.IsRunning()
+    finally:
+        loop.close()
+
+def test_AsyncSerialError():
+    """A crash of a coroutine surfaces in the control loop."""
+    class BrokenPort(FakePort):
+        def inWaiting(self):
+            raise serial.SerialException("device disconnected")
+    SPData = SerialData(6, robot.joints)
+    loop = asyncio.new_event_loop()
+    try:
+        worker = StartAsyncSerial(SPData, BrokenPort(), 0.002, loop)
+        loop.run_until_complete(asyncio.sleep(0.01))
+        try:
+            worker.Exchange(SPData)
+            assert False
+        except serial.SerialException:
+            pass
+        worker.Stop()
+    finally:
+        loop.close()
@@ -1,3 +1,4 @@
+import os
 import numpy as np
 from classes import PID
 """This document contains all settings that are unrelated to the robot 
@@ -6,6 +7,8 @@ settings related to main.py, kindly do so here and in robot_init.py."""
 sett = dict()
 #Time between refreshing frames for the UI [s].
 sett['dtFrame'] = 0.05
+#Time between appending the timing samples to the log file [s].
+sett['dtLog'] = 1
 #Time between PID updates. Note: higher dtPID leads to more instability! [s].
 sett['dtPID'] = 0.05
 #Data communication interval with Teensy [s].
@@ -20,6 +23,8 @@ sett['dtHold'] = sett['dtFF']
 sett['vMax'] = 0.01
 #Maximum rotational velocity of the joints in position control [rad/s].
 sett['wMax'] = 0.04*np.pi
+#Maximum acceleration of the joints in position control [rad/s^2].
+sett['aMax'] = 0.1*np.pi
 #Proportional gain for position control [(N/m)/rad].
 sett['kPP'] = np.diag(np.array([14,28,26,6,6]))
 #Integral gain for position control [(N/m)*s/rad].
@@ -62,3 +67,11 @@ sett['Ka'] = 10*np.eye(3)
 #Additional virtual damping coefficient to avoid high end-effector 
 #velocities [(N/m)/(rad/s)]
 sett['D'] = 4
+#Directory of the output files of main.py, e.g. the timing log.
+sett['logDir'] = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                              "logs")
+#Directory of generated data reused between runs, e.g. the workspace 
+#index, outside of the source tree.
+sett['cacheDir'] = os.path.join(os.environ.get('XDG_CACHE_HOME', 
+                   os.path.join(os.path.expanduser("~"), ".cache")), 
+                   "pegasus_arm")
@@ -0,0 +1,69 @@
+import os
+import sys
+
+#Find directory path of current file
+current = os.path.dirname(os.path.realpath(__file__))
+#Find directory path of parent folder and add to sys path
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import time
+from typing import Callable, List
+from classes import Robot, TeensyEmulator, SimPlant
+from dynamics.dynamics_funcs import SimulateStep
+from util import Curr2Tau, MSpeed2Curr
+
+"""Hardware-in-the-loop simulation: A TeensyEmulator (see teensy_emu.py)
+of which the plant is the robot model, such that the unmodified control
+code (PosControl, HoldPos, VelControl, ...) closes the loop over it.
+"""
+
+#Joint torque per PWM assumed by HoldPos & PosControl (PWM = tau*33.78).
+TAU_PER_PWM_POS = 1/33.78
+#Joint damping in [Nm/(rad/s)] standing in for the back-EMF & gearbox
+#losses of the real motors, with which HoldPos settles using the gains of
+#settings.py. Without it, the light links oscillate with the 20 Hz loop.
+SIM_B_VISC = [4, 4, 4, 1.2, 1.2]
+
+def TauPerPWM(robot: Robot) -> List[float]:
+    """Joint torque per unit of PWM of each motor, as the inverse of
+    Tau2Curr & Curr2MSpeed (used by VelControl, ForceControl, ...).
+    :param robot: A Robot object describing the robot mathematically.
+    :return tauPerPWM: Torque in [Nm] per unit of PWM of each motor.
+    """
+    return [Curr2Tau(MSpeed2Curr(1), joint.gearRatio, joint.km)
+            for joint in robot.joints]
+
+def SimTeensy(robot: Robot, theta0: List[float], dtComm: float,
+              tauPerPWM: List[float]=None, bVisc: List[float]=None, 
+              dtStep: float=0.0005,
+              clock: Callable[[], float]=time.perf_counter,
+              **kwargs) -> TeensyEmulator:
+    """Creates a TeensyEmulator driven by the dynamics of robot, to be
+    used in place of the serial connection with the Teensy.
+    :param robot: A Robot object describing the robot mathematically.
+    :param theta0: Initial joint angles in [rad].
+    :param dtComm: Time between two sent frames in [s].
+    :param tauPerPWM: Joint torque per unit of PWM of each motor in
+                      [Nm], TauPerPWM(robot) by default.
+    :param bVisc: Optional viscous damping of each joint, see SimPlant.
+    :param dtStep: Integration step of the dynamics in [s].
+    :param clock: Function returning the current time in [s], e.g. a
+                  SimClock to run faster than real time.
+    :param kwargs: Further arguments of TeensyEmulator, e.g. countNoise.
+    :return emulator: The emulator, used as a serial.Serial() instance.
+
+    Example input:
+    robot = robot #Of robot_init.py
+    theta0 = [0, 0, 0, 0, 0]
+    dtComm = 0.05
+    Output:
+    TeensyEmulator(frames=0, commands=0, totCount=[0, 0, 0, 0, 0, 0])
+    """
+    if tauPerPWM is None:
+        tauPerPWM = TauPerPWM(robot)
+    plant = SimPlant(robot, SimulateStep, theta0, tauPerPWM, bVisc)
+    emulator = TeensyEmulator(robot.joints, dtComm=dtComm, dtStep=dtStep,
+                              plant=plant, clock=clock, **kwargs)
+    emulator.count[:] = plant.Counts()
+    return emulator
@@ -0,0 +1,58 @@
+import os
+import sys
+#Find directory path of current file
+current = os.path.dirname(os.path.realpath(__file__))
+#Find directory path of parent folder and add to sys path
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import copy
+import numpy as np
+from robot_init import robot
+from settings import sett
+from classes import SerialData, Scheduler, SimClock, SimPlant, TimingLog
+from dynamics.dynamics_funcs import SimulateStep
+from simulation.sim import SimTeensy, TauPerPWM, TAU_PER_PWM_POS, SIM_B_VISC
+from main import HoldPos, CommTask
+from util import Tau2Curr, Curr2MSpeed
+
+def test_SimPlantCounts():
+    """The sent counts translate back into the joint angles."""
+    theta = [0.3, -0.2, 0.4, 0.1, -0.5]
+    plant = SimPlant(robot, SimulateStep, theta, TauPerPWM(robot))
+    serial = SerialData(6, robot.joints)
+    serial.UpdateCounts(np.round(plant.Counts()), [0]*6)
+    assert np.allclose(serial.currAngle[:-1], theta,
+                       atol=2*max(plant.enc2Theta))
+
+def test_SimPlantTorques():
+    """PWM maps back onto the joint torques the controllers intended."""
+    plant = SimPlant(robot, SimulateStep, np.zeros(5), TauPerPWM(robot))
+    tau = np.array([0.5, -1, 2, 0.3, -0.7])
+    tauM = tau.copy()
+    tauM[3] = -tau[3] - tau[4]
+    tauM[4] = tau[3] - tau[4]
+    PWM = [Curr2MSpeed(Tau2Curr(tauM[i], robot.joints[i].gearRatio,
+                                robot.joints[i].km, np.inf))
+           for i in range(5)] + [0]
+    assert np.allclose(plant.Torques(np.array(PWM)), tau)
+
+def test_SimHold():
+    """HoldPos closes the loop over the simulated Teensy, faster than
+    real time."""
+    clock = SimClock()
+    Teensy = SimTeensy(robot, [0, 0.2, 0.1, 0, 0], sett['dtComm'],
+                       [TAU_PER_PWM_POS]*5, SIM_B_VISC, clock=clock)
+    serial = SerialData(6, robot.joints)
+    PIDObj = copy.deepcopy(sett['PIDP'])
+    thetaDes = np.array([0.05, 0.25, 0.15, 0.05, 0])
+    timing = TimingLog(size=1)
+    scheduler = Scheduler(clock, clock.Sleep)
+    scheduler.AddTask("hold", sett['dtHold'], lambda: HoldPos(serial, robot,
+                      PIDObj, thetaDes, sett['dtHold']))
+    scheduler.AddTask("comm", sett['dtComm'], lambda: CommTask(serial, Teensy,
+                      timing), phase=sett['dtComm'])
+    scheduler.Run(duration=6)
+    assert clock() >= 6
+    assert np.all(np.abs(np.array(serial.currAngle[:-1]) - thetaDes) <
+                  sett['errThetaHold'])
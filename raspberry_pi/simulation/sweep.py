@@ -0,0 +1,231 @@
+import os
+import sys
+
+#Find directory path of current file
+current = os.path.dirname(os.path.realpath(__file__))
+#Find directory path of parent folder and add to sys path
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import itertools
+import copy
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Tuple, Union
+from classes import Robot, PID, InputError
+from dynamics.dynamics_funcs import SimulateStep, FeedForwardBatch
+from trajectory_generation.traj_gen import TrajGen, TrajDerivatives
+from settings import sett
+from util import saveToCSV
+
+"""Parameter sweeps over the simulated robot, spread over all CPU cores.
+A candidate is a dictionary with any of the following keys, missing
+keys fall back to settings.py & robot_init.py:
+- 'kPP', 'kIP', 'kDP': PID gains, as nxn matrix or n-vector (diagonal).
+- 'stat', 'kin', 'visc', 'eff': Joint.fricPar entries, as n-vector or
+  scalar for all joints.
+- 'wMax', 'vMax': Trajectory speeds, as in settings.py.
+"""
+
+#Keys of a candidate that map onto Joint.fricPar
+FRIC_KEYS = ['stat', 'kin', 'visc', 'eff']
+#Names of the metrics returned by EvaluateCandidate
+METRICS = ['rmsErr', 'maxErr', 'finalErr', 'stable']
+
+#Per-process state, set once by InitWorker
+workerRobot = None
+workerFricPar = None
+
+def InitWorker(robot: Robot=None):
+    """Initializer of each worker process: Builds the Robot once, which
+    is then reused for every candidate evaluated by this process.
+    :param robot: Optional robot to use instead of robotFric of
+                  robot_init.py. Is pickled to each worker.
+    """
+    global workerRobot, workerFricPar
+    if robot is None:
+        from robot_init import robotFric
+        robot = robotFric
+    workerRobot = robot
+    workerFricPar = [copy.copy(joint.fricPar) for joint in robot.joints]
+
+def SweepGrid(space: dict) -> List[dict]:
+    """Creates all combinations of the given parameter values.
+    :param space: Dictionary mapping a candidate key to a list of
+                  values to try.
+    :return candidates: List of candidate dictionaries.
+
+    Example input:
+    space = {'wMax': [0.02, 0.04], 'eff': [0.5, 1]}
+    Output:
+    [{'wMax': 0.02, 'eff': 0.5}, {'wMax': 0.02, 'eff': 1},
+     {'wMax': 0.04, 'eff': 0.5}, {'wMax': 0.04, 'eff': 1}]
+    """
+    keys = list(space.keys())
+    return [dict(zip(keys, values)) for values in
+            itertools.product(*[space[key] for key in keys])]
+
+def SweepRandom(space: dict, nSamples: int, seed: int=None) -> List[dict]:
+    """Draws candidates uniformly from the given parameter bounds.
+    :param space: Dictionary mapping a candidate key to its [lower,
+                  upper] bounds. Bounds may be scalars or arrays, in
+                  which case each element is drawn independently.
+    :param nSamples: Number of candidates to draw.
+    :param seed: Optional seed, for reproducible sweeps.
+    :return candidates: List of candidate dictionaries.
+
+    Example input:
+    space = {'kPP': [np.zeros(5), 30*np.ones(5)], 'vMax': [0.01, 0.05]}
+    nSamples = 1000
+    Output:
+    [{'kPP': array([...]), 'vMax': 0.0271...}, ...] (1000 candidates)
+    """
+    rng = np.random.default_rng(seed)
+    candidates = []
+    for i in range(nSamples):
+        candidate = dict()
+        for key, (low, high) in space.items():
+            value = rng.uniform(low, high)
+            candidate[key] = value if np.ndim(value) else float(value)
+        candidates.append(candidate)
+    return candidates
+
+def FlattenCandidate(candidate: dict) -> Tuple[List[str], List[float]]:
+    """Flattens a candidate into columns, one per scalar.
+    :param candidate: Candidate dictionary.
+    :return names: Column names, e.g. 'kPP3' for kPP[3], or 'kPP3_4'
+                   for element [3,4] of a gain matrix.
+    :return values: The matching values.
+    """
+    names, values = [], []
+    for key in sorted(candidate.keys()):
+        value = np.asarray(candidate[key], dtype=float)
+        if value.ndim == 0:
+            names.append(key)
+            values.append(float(value))
+            continue
+        for idx in np.ndindex(value.shape):
+            names.append(key + "_".join(str(i) for i in idx))
+            values.append(float(value[idx]))
+    return names, values
+
+def Gain(value: Union[np.ndarray, List[float]]) -> np.ndarray:
+    """Returns an nxn gain matrix from a matrix or its diagonal."""
+    value = np.asarray(value, dtype=float)
+    return np.diag(value) if value.ndim == 1 else value
+
+def EvaluateCandidate(candidate: dict, sConfig: np.ndarray,
+                      eConfig: np.ndarray, dt: float, tSettle: float) \
+                      -> List[float]:
+    """Simulates the worker robot tracking a joint space trajectory
+    between two configurations with the given candidate parameters,
+    using the feed-forward torques plus PID, like PosControl.
+    :param candidate: Candidate dictionary, see the top of this module.
+    :param sConfig: Start configuration in joint space.
+    :param eConfig: End configuration in joint space.
+    :param dt: Simulation time step in seconds, also the PID interval.
+    :param tSettle: Time to keep holding eConfig after the trajectory
+                    finished, in seconds.
+    :return metrics: Values corresponding to METRICS: The RMS, maximum,
+                     and final tracking error norm in [rad], and 1 if
+                     the simulation stayed finite, 0 otherwise.
+    """
+    if workerRobot is None:
+        InitWorker()
+    robot = workerRobot
+    n = len(robot.joints)
+    #Friction parameters: Defaults of the robot, overwritten if swept.
+    for i, joint in enumerate(robot.joints):
+        joint.fricPar = copy.copy(workerFricPar[i])
+        for key in FRIC_KEYS:
+            if key in candidate:
+                joint.fricPar[key] = float(np.broadcast_to(
+                                     candidate[key], (n,))[i])
+    robot.Compile(recompile=True)
+    vMax = candidate.get('vMax', sett['vMax'])
+    wMax = candidate.get('wMax', sett['wMax'])
+    PIDObj = PID(Gain(candidate.get('kPP', sett['kPP'])),
+                 Gain(candidate.get('kIP', sett['kIP'])),
+                 Gain(candidate.get('kDP', sett['kDP'])),
+                 ILim=np.array([2 for i in range(n)]))
+    g = np.array([0,0,-9.81])
+    FTip = np.zeros(6)
+    traj = TrajGen(robot, np.asarray(sConfig, dtype=float),
+                   np.asarray(eConfig, dtype=float), vMax, wMax, dt,
+                   "joint", timeScaling=5)
+    traj, velTraj, accTraj = TrajDerivatives(traj, "joint", robot, dt, 
+                                             timeScaling=5)
+    tauFFTraj = FeedForwardBatch(robot, traj, velTraj, accTraj, g, FTip)
+    #Hold the end configuration for tSettle seconds.
+    nSettle = int(round(tSettle/dt))
+    traj = np.vstack((traj, np.tile(traj[-1], (nSettle,1))))
+    tauFFTraj = np.vstack((tauFFTraj, np.tile(
+                FeedForwardBatch(robot, traj[-1:], np.zeros((1,n)),
+                                 np.zeros((1,n)), g, FTip), (nSettle,1))))
+    theta = list(traj[0])
+    dtheta = [0 for i in range(n)]
+    ddtheta = [0 for i in range(n)]
+    errNorm = np.zeros(traj.shape[0])
+    for k in range(traj.shape[0]):
+        tau = tauFFTraj[k] + PIDObj.Execute(traj[k], np.array(theta), dt)
+        theta, dtheta, ddtheta = SimulateStep(robot, theta, dtheta, ddtheta,
+                                              tau, g, FTip, dt)
+        errNorm[k] = np.linalg.norm(traj[k] - theta)
+        if not np.isfinite(errNorm[k]):
+            return [np.inf, np.inf, np.inf, 0]
+    return [float(np.sqrt(np.mean(errNorm**2))), float(errNorm.max()),
+            float(errNorm[-1]), 1]
+
+def RunSweep(candidates: List[dict], csvTitle: str, sConfig: np.ndarray,
+             eConfig: np.ndarray, dt: float=0.001, tSettle: float=0.5,
+             maxWorkers: int=None, robot: Robot=None) -> int:
+    """Evaluates all candidates in parallel over a process pool, and
+    streams one CSV row per candidate into csvTitle as soon as it
+    finishes. Each row holds the candidate index, the flattened
+    candidate (see FlattenCandidate), and the metrics (see METRICS).
+    :param candidates: List of candidate dictionaries, e.g. from
+                       SweepGrid or SweepRandom.
+    :param csvTitle: Address of the CSV file, truncated at the start.
+    :param sConfig: Start configuration in joint space.
+    :param eConfig: End configuration in joint space.
+    :param dt: Simulation time step in seconds.
+    :param tSettle: Time to hold eConfig after the trajectory [s].
+    :param maxWorkers: Number of processes, all CPU cores by default.
+    :param robot: Optional robot, robotFric of robot_init by default.
+    :return nDone: Number of candidates written.
+    Raises InputError if the candidates do not all flatten to the same
+    columns, as every row shares the header of the first candidate.
+
+    Example input:
+    space = {'kPP': [5*np.ones(5), 30*np.ones(5)], 'wMax': [0.02, 0.2]}
+    candidates = SweepRandom(space, 1000, seed=0)
+    csvTitle = "sweep.csv"
+    sConfig = np.zeros(5)
+    eConfig = np.array([0, 0.2, 0.2, 0.1, 0])
+    Output:
+    1000 (rows in sweep.csv, in order of completion)
+    """
+    if len(candidates) == 0:
+        return 0
+    names = FlattenCandidate(candidates[0])[0]
+    for idx, candidate in enumerate(candidates):
+        if FlattenCandidate(candidate)[0] != names:
+            raise InputError(f"Candidate {idx} has different keys or " +
+                             f"shapes than candidate 0: {sorted(candidate)}"+
+                             f" != {sorted(candidates[0])}")
+    headers = ",".join(["idx"] + names + METRICS)
+    saveToCSV(np.zeros((0, len(names) + len(METRICS) + 1)), csvTitle,
+              headers=headers, reset=True)
+    nDone = 0
+    with ProcessPoolExecutor(max_workers=maxWorkers, initializer=InitWorker,
+                             initargs=(robot,)) as pool:
+        futures = {pool.submit(EvaluateCandidate, candidate, sConfig,
+                               eConfig, dt, tSettle): idx
+                   for idx, candidate in enumerate(candidates)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            values = FlattenCandidate(candidates[idx])[1]
+            row = np.array([[idx] + values + future.result()])
+            saveToCSV(row, csvTitle)
+            nDone += 1
+    return nDone
@@ -0,0 +1,80 @@
+import os
+import sys
+#Find directory path of current file
+current = os.path.dirname(os.path.realpath(__file__))
+#Find directory path of parent folder and add to sys path
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import copy
+import numpy as np
+import pytest
+from robot_init import robot
+from classes import InputError
+import simulation.sweep as sweep
+from simulation.sweep import SweepGrid, SweepRandom, FlattenCandidate, \
+                             InitWorker, EvaluateCandidate, RunSweep, METRICS
+
+def test_SweepGrid():
+    space = {'wMax': [0.02, 0.04], 'eff': [0.5, 1], 'vMax': [0.01]}
+    candidates = SweepGrid(space)
+    assert len(candidates) == 4
+    assert {'wMax': 0.04, 'eff': 0.5, 'vMax': 0.01} in candidates
+
+def test_SweepRandom():
+    space = {'kPP': [np.zeros(5), 30*np.ones(5)], 'vMax': [0.01, 0.05]}
+    candidates = SweepRandom(space, 20, seed=1)
+    assert len(candidates) == 20
+    for candidate in candidates:
+        assert candidate['kPP'].shape == (5,)
+        assert all(0 <= k <= 30 for k in candidate['kPP'])
+        assert 0.01 <= candidate['vMax'] <= 0.05
+    assert np.allclose(SweepRandom(space, 20, seed=1)[3]['kPP'],
+                       candidates[3]['kPP'])
+
+def test_FlattenCandidate():
+    names, values = FlattenCandidate({'wMax': 0.1, 'kPP': np.eye(2),
+                                      'eff': [0.5, 0.6]})
+    assert names == ['eff0', 'eff1', 'kPP0_0', 'kPP0_1', 'kPP1_0',
+                     'kPP1_1', 'wMax']
+    assert values == [0.5, 0.6, 1, 0, 0, 1, 0.1]
+
+def test_EvaluateFricPar(monkeypatch):
+    """Swept friction parameters may not leak into the next candidate."""
+    #Restore the worker state & keep the shared robot untouched afterwards
+    monkeypatch.setattr(sweep, "workerRobot", None)
+    monkeypatch.setattr(sweep, "workerFricPar", None)
+    robotCopy = copy.deepcopy(robot)
+    InitWorker(robotCopy)
+    eConfig = np.array([0,0.05,0.05,0.05,0])
+    EvaluateCandidate({'wMax': 0.5, 'eff': 0.5}, np.zeros(5), eConfig,
+                      0.001, 0.01)
+    assert robotCopy.Compile().eff[2] == 0.5
+    metrics = EvaluateCandidate({'wMax': 0.5}, np.zeros(5), eConfig,
+                                0.001, 0.01)
+    assert robotCopy.Compile().eff[2] == 1
+    assert len(metrics) == len(METRICS)
+
+def test_RunSweep(tmp_path):
+    csvTitle = str(tmp_path / "sweep.csv")
+    candidates = SweepGrid({'wMax': [0.4, 0.5], 'kDP': [np.zeros(5),
+                                                        np.ones(5)]})
+    nDone = RunSweep(candidates, csvTitle, np.zeros(5),
+                     np.array([0,0.05,0.05,0.05,0]), dt=0.001,
+                     tSettle=0.01, maxWorkers=2,
+                     robot=copy.deepcopy(robot))
+    assert nDone == 4
+    with open(csvTitle) as csvFile:
+        headers = csvFile.readline()[2:].strip().split(",")
+    data = np.loadtxt(csvTitle, delimiter=",", ndmin=2)
+    assert headers[0] == "idx" and headers[-len(METRICS):] == METRICS
+    assert data.shape == (4, len(headers))
+    assert sorted(data[:,0]) == [0, 1, 2, 3]
+
+def test_RunSweepKeys(tmp_path):
+    """Candidates with different columns would misalign the CSV rows."""
+    csvTitle = str(tmp_path / "sweep.csv")
+    candidates = [{'wMax': 0.4}, {'wMax': 0.4, 'eff': 0.5}]
+    with pytest.raises(InputError):
+        RunSweep(candidates, csvTitle, np.zeros(5),
+                 np.array([0,0.05,0.05,0.05,0]), robot=copy.deepcopy(robot))
@@ -0,0 +1,94 @@
+import os
+import sys
+
+#Find directory path of current file
+current = os.path.dirname(os.path.realpath(__file__))
+#Find directory path of parent folder and add to sys path
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import time
+import numpy as np
+from typing import Callable
+from classes import SerialData, Scheduler, TimingLog, TeensyEmulator
+from serial_comm.serial_comm import SReadAndParse, SWriteCommand, StartComms
+
+"""Hardware-free tests of the serial stack, using TeensyEmulator (see
+classes.py) in place of the Teensy. Run this file to benchmark the full
+loop over a pseudo-terminal:
+python simulation/teensy_emu.py [dtComm] [duration]
+"""
+
+def BenchmarkLoop(localMu, SPData: SerialData, duration: float=2,
+                  dtComm: float=0.05, dtRead: float=0.0005, PWM: int=100,
+                  timing: TimingLog=None,
+                  clock: Callable[[], float]=time.perf_counter,
+                  sleep: Callable[[float], None]=time.sleep) -> dict:
+    """Measures the throughput & latency of the full serial loop. The
+    direction of the first motor is toggled as soon as the previous
+    toggle has been observed in the received data, the latency is the
+    time between sending a toggle & observing it.
+    :param localMu: serial.Serial() instance or TeensyEmulator.
+    :param SPData: SerialData instance, stores & parses serial data.
+    :param duration: Duration of the benchmark in [s].
+    :param dtComm: Time between two sent commands in [s].
+    :param dtRead: Time between two reads in [s].
+    :param PWM: PWM magnitude of the first motor.
+    :param timing: Optional TimingLog to record the read & write in.
+    :param clock: Function returning the current time in [s].
+    :param sleep: Function sleeping for the given time in [s].
+    :return results: Received frames, frames per second, corrupt &
+                     dropped frames, and the number, median & maximum
+                     of the latencies in [s].
+
+    Example input:
+    emulator = TeensyEmulator(robot.joints, dtComm=0.01)
+    localMu = StartComms(emulator.ServePty())
+    SPData = SerialData(6, robot.joints)
+    Output:
+    {'frames': 199, 'framesPerSec': 99.5, 'corrupt': 1, 'dropped': 0,
+     'nLatency': 97, 'latencyP50': 0.0103, 'latencyMax': 0.0125}
+    """
+    state = dict(dir=1, tWrite=None, latency=[])
+    def ReadTask():
+        SReadAndParse(SPData, localMu)
+        #rotDir is 1 when counting down, i.e. for negative PWM
+        if state['tWrite'] is not None and \
+           SPData.rotDirCurr[0] == 1 - state['dir']:
+            state['latency'].append(clock() - state['tWrite'])
+            state['tWrite'] = None
+    def WriteTask():
+        if state['tWrite'] is None: #Previous toggle observed
+            state['dir'] = 1 - state['dir']
+            SPData.mSpeed[0] = PWM if state['dir'] == 1 else -PWM
+            state['tWrite'] = clock()
+        SWriteCommand(SPData, localMu)
+    scheduler = Scheduler(clock, sleep, timing)
+    scheduler.AddTask("serial read", dtRead, ReadTask)
+    scheduler.AddTask("serial write", dtComm, WriteTask)
+    scheduler.Run(duration=duration)
+    parser = SPData.parser
+    nFrames = 0 if parser is None else parser.nFrames
+    latency = np.array(state['latency'])
+    return dict(frames=nFrames, framesPerSec=nFrames/duration,
+                corrupt=0 if parser is None else parser.nCorrupt,
+                dropped=0 if parser is None else parser.nDropped,
+                nLatency=latency.size,
+                latencyP50=float(np.median(latency)) if latency.size
+                           else None,
+                latencyMax=float(latency.max()) if latency.size else None)
+
+if __name__ == "__main__":
+    from robot_init import robot
+    dtComm = float(sys.argv[1]) if len(sys.argv) > 1 else 0.01
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    emulator = TeensyEmulator(robot.joints, dtComm=dtComm)
+    localMu = StartComms(emulator.ServePty())
+    try:
+        results = BenchmarkLoop(localMu, SerialData(6, robot.joints),
+                                duration, dtComm)
+    finally:
+        localMu.close()
+        emulator.Stop()
+    for key, value in results.items():
+        print(f"{key}: {value}")
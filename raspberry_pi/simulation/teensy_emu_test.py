@@ -0,0 +1,109 @@
+import os
+import sys
+#Find directory path of current file
+current = os.path.dirname(os.path.realpath(__file__))
+#Find directory path of parent folder and add to sys path
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import numpy as np
+import pytest
+import asyncio
+from robot_init import robot
+from classes import SerialData, TeensyEmulator, Scheduler
+from serial_comm.serial_comm import SReadAndParse, SWriteCommand, StartComms, \
+                                    StartAsyncSerial, SExchange
+from simulation.teensy_emu import BenchmarkLoop
+
+def FakeClock():
+    t = [0.]
+    return t, (lambda: t[0]), (lambda dt: t.__setitem__(0, t[0] + dt))
+
+def test_ParseCommand():
+    emulator = TeensyEmulator(robot.joints)
+    emulator.write(b"['100|1', '255|0', '0|0', '20|1', ")
+    assert emulator.mSpeed == [0]*6 #Waits for the end of the line
+    emulator.write(b"'20|0', '0|0']\n")
+    assert emulator.mSpeed == [100, 255, 0, 20, 20, 0]
+    assert emulator.rotCCW == [1, 0, 0, 1, 0, 0]
+    assert list(emulator.PWM()) == [100, -255, 0, 20, -20, 0]
+
+def test_EmulatorCounts():
+    """Frames are sent every dtComm, and the counts follow the PWM."""
+    t, clock, sleep = FakeClock()
+    emulator = TeensyEmulator(robot.joints, dtComm=0.05, clock=clock)
+    SPData = SerialData(6, robot.joints)
+    SPData.mSpeed = [255, -51, 0, 0, 0, 0]
+    SWriteCommand(SPData, emulator)
+    sleep(1)
+    assert emulator.inWaiting() > 0
+    assert SReadAndParse(SPData, emulator)
+    assert SPData.parser.nFrames == 20
+    assert np.isclose(SPData.currAngle[0], 1, atol=robot.joints[0].enc2Theta)
+    assert np.isclose(SPData.totCount[1]*robot.joints[1].enc2Theta, -0.2,
+                      atol=robot.joints[1].enc2Theta)
+    #As the firmware: rotDir is 1 when counting down
+    assert SPData.rotDirCurr[0:3] == [0, 1, 0]
+    assert SPData.homing == [0]*6
+    assert SPData.current[0] == 2.
+
+def test_EmulatorCorrupt():
+    """Corrupted frames are rejected without stopping the parser."""
+    t, clock, sleep = FakeClock()
+    emulator = TeensyEmulator(robot.joints, dtComm=0.01, countNoise=2,
+                              currNoise=0.1, pCorrupt=0.3, seed=0,
+                              clock=clock)
+    SPData = SerialData(6, robot.joints)
+    for i in range(100):
+        sleep(0.01)
+        SReadAndParse(SPData, emulator)
+    parser = SPData.parser
+    assert parser.nCorrupt > 10
+    assert 50 < parser.nFrames < 100
+
+def test_BenchmarkLoop():
+    """Full loop in simulated time: one toggle per two dtComm."""
+    t, clock, sleep = FakeClock()
+    emulator = TeensyEmulator(robot.joints, dtComm=0.01, clock=clock)
+    results = BenchmarkLoop(emulator, SerialData(6, robot.joints), 1, 0.01,
+                            clock=clock, sleep=sleep)
+    assert results['frames'] == 99
+    assert results['nLatency'] >= 45
+    assert results['latencyMax'] <= 0.0105
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="No pty")
+def test_EmulatorPty():
+    emulator = TeensyEmulator(robot.joints, dtComm=0.01)
+    localMu = StartComms(emulator.ServePty())
+    try:
+        results = BenchmarkLoop(localMu, SerialData(6, robot.joints), 0.5,
+                                0.01)
+    finally:
+        localMu.close()
+        emulator.Stop()
+    assert results['frames'] >= 25
+    assert results['nLatency'] >= 10
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="No pty")
+def test_AsyncSerialPty():
+    """Frames of a pty are parsed as soon as the port is readable 
+    (loop.add_reader), the commands reach the emulator."""
+    emulator = TeensyEmulator(robot.joints, dtComm=0.01)
+    localMu = StartComms(emulator.ServePty())
+    SPData = SerialData(6, robot.joints)
+    loop = asyncio.new_event_loop()
+    try:
+        worker = StartAsyncSerial(SPData, localMu, 0.01, loop)
+        assert worker.FileNo() is not None
+        SPData.mSpeed = [100, 0, 0, 0, 0, 0]
+        scheduler = Scheduler()
+        scheduler.AddTask("comm", 0.01, lambda: SExchange(SPData, worker))
+        loop.run_until_complete(scheduler.RunAsync(duration=0.5))
+        worker.Stop()
+        assert worker.nSnapshot >= 25
+        assert emulator.mSpeed[0] == 100
+        assert SPData.totCount[0] > 0
+    finally:
+        localMu.close()
+        emulator.Stop()
+        loop.close()
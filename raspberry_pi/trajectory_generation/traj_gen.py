@@ -8,12 +8,46 @@ sys.path.append(parent)
 
 from classes import Robot, DimensionError, IKAlgorithmError
 from robot_init import robot as Pegasus
-from kinematics.kinematic_funcs import IKSpace
+from kinematics.kinematic_funcs import IKSpace, JacobianSpaceBatch
+from dynamics.dynamics_funcs import FeedForwardBatch
+from util import Curr2Tau, AdjointBatch, SmallAdBatch
 import modern_robotics as mr
 import numpy as np
 #import matplotlib.pyplot as plt
 from typing import Union, List, Tuple
 
+def TimeScaling(t: np.ndarray, Tf: float, method: int=5) -> \
+                Tuple[np.ndarray]:
+    """Cubic or quintic time scaling s(t) from rest to rest, as in 
+    Chapter 9.2 of the Modern Robotics book, with its analytic first 
+    and second time derivative, for all time stamps at once.
+    :param t: Array of time stamps in [s], clipped to [0, Tf].
+    :param Tf: Total time of the motion in [s].
+    :param method: Type of sampling polynomial: 3 for cubic, 5 for 
+                   quintic.
+    :return s: Path parameter at t, from 0 to 1.
+    :return sDot: First time derivative of s in [1/s].
+    :return sDDot: Second time derivative of s in [1/s^2].
+
+    Example input:
+    t = np.array([0, 1, 2])
+    Tf = 2
+    method = 5
+    Output:
+    (array([0. , 0.5, 1. ]), array([0.   , 0.9375, 0.   ]), 
+     array([0., 0., 0.]))
+    """
+    tau = np.clip(np.asarray(t, dtype=float)/Tf, 0, 1)
+    if method == 3:
+        s = 3*tau**2 - 2*tau**3
+        sDot = (6*tau - 6*tau**2)/Tf
+        sDDot = (6 - 12*tau)/Tf**2
+    else:
+        s = 10*tau**3 - 15*tau**4 + 6*tau**5
+        sDot = (30*tau**2 - 60*tau**3 + 30*tau**4)/Tf
+        sDDot = (60*tau - 180*tau**2 + 120*tau**3)/Tf**2
+    return s, sDot, sDDot
+
 def JointTrajLims(thetaStart: Union[List, np.ndarray], thetaEnd: 
                   Union[List, np.ndarray], lims: List, Tf: float, 
                   N: int, method: int):
@@ -81,7 +115,9 @@ def JointTrajLims(thetaStart: Union[List, np.ndarray], thetaEnd:
         else:
             #Take the short path
             thetaEnd[i] = end+short
-    traj = mr.JointTrajectory(thetaStart, thetaEnd, Tf, N, method)
+    #Equal to mr.JointTrajectory, without looping over the samples
+    s = TimeScaling(np.linspace(0, Tf, N), Tf, method)[0][:,None]
+    traj = (1 - s)*thetaStart + s*thetaEnd
     return traj
 
 def TrajGen(robot: Robot, startConfig: Union[np.ndarray, List[float]], endConfig: 
@@ -173,9 +209,187 @@ def TrajGen(robot: Robot, startConfig: Union[np.ndarray, List[float]], endConfig
                                   "between 'joint', 'screw', or 'cartesian'")
     return traj
 
+def MotorTauLims(robot: Robot, currLim: float, tauPerPWM: List[float]=None,
+                 PWMMax: float=255) -> np.ndarray:
+    """Maximum torque of each motor at the output shaft, as limited by 
+    the current limit of Tau2Curr and, optionally, by the PWM range.
+    :param robot: Robot object mathematically representing the robot.
+    :param currLim: Maximum allowed current to each motor in [A].
+    :param tauPerPWM: Optional torque in [Nm] per unit of PWM of each 
+                      motor, e.g. 1/33.78 as assumed by PosControl.
+    :param PWMMax: Maximum PWM value.
+    :return tauLim: Torque limit of each motor in [Nm].
+
+    Example input:
+    robot = Pegasus
+    currLim = 2
+    tauPerPWM = [1/33.78 for i in range(5)]
+    Output:
+    [7.54885 7.54885 7.54885 7.54885 7.54885]
+    """
+    tauLim = np.array([Curr2Tau(currLim, joint.gearRatio, joint.km) for 
+                       joint in robot.joints])
+    if tauPerPWM is not None:
+        tauLim = np.minimum(tauLim, PWMMax*np.abs(tauPerPWM))
+    return tauLim
+
+def LP2DRange(G: np.ndarray, h: np.ndarray) -> Tuple[float, float]:
+    """Range of the second variable x over the bounded polygon 
+    {[u, x] | G[u, x] <= h}, by enumerating its vertices.
+    :param G: mx2 matrix of constraint coefficients.
+    :param h: m-vector of constraint bounds.
+    :return xMin: Minimum of x, None if the polygon is empty.
+    :return xMax: Maximum of x, None if the polygon is empty.
+
+    Example input:
+    G = np.array([[1,0],[-1,0],[0,1],[0,-1],[1,1]])
+    h = np.array([1,1,2,0,1.5])
+    Output:
+    (0.0, 2.0)
+    """
+    i, j = np.triu_indices(h.size, 1)
+    det = G[i,0]*G[j,1] - G[i,1]*G[j,0]
+    valid = np.abs(det) > 1e-12
+    i, j, det = i[valid], j[valid], det[valid]
+    #Intersections of each pair of constraint lines (Cramer's rule)
+    v = np.stack(((h[i]*G[j,1] - h[j]*G[i,1])/det, 
+                  (G[i,0]*h[j] - G[j,0]*h[i])/det), axis=1)
+    feasible = np.all(v @ G.T <= h + 1e-9*(1 + np.abs(h)), axis=1)
+    if not np.any(feasible):
+        return None, None
+    return v[feasible,1].min(), v[feasible,1].max()
+
+def TOPP(robot: Robot, path: np.ndarray, vLim: Union[float, np.ndarray], 
+         aLim: Union[float, np.ndarray], tauLim: np.ndarray=None, 
+         dt: float=0.05, g: np.ndarray=np.array([0,0,-9.81]), 
+         tauMap: np.ndarray=None, nGrid: int=100) -> Tuple[np.ndarray]:
+    """Time-optimal parameterization of a joint space path, respecting 
+    joint velocity-, joint acceleration-, and motor torque limits, by 
+    means of reachability analysis (TOPP-RA, Pham & Pham, 2018). The 
+    path theta(s), s in [0,1], is discretized in nGrid segments. On 
+    these, the constraints are linear in u = s'' and x = s'^2: 
+    tau = a*u + b*x + c, with a, b, c from FeedForwardBatch. A backward 
+    pass computes the set of x from which the end can be reached at 
+    rest, after which a forward pass greedily takes the largest 
+    feasible u.
+    :param robot: Robot object mathematically representing the robot.
+    :param path: Nxn array of joint angles describing the path (N>=2),
+                 equally spaced in s. Two rows give a straight line.
+    :param vLim: Maximum velocity of each joint in [rad/s].
+    :param aLim: Maximum acceleration of each joint in [rad/s^2].
+    :param tauLim: Optional maximum torque of each motor in [Nm], see
+                   MotorTauLims.
+    :param dt: Time between the returned sub-configurations in [s].
+    :param g: 3-dimensional gravity vector in [m/s^2].
+    :param tauMap: Optional nxn matrix mapping the joint torques onto 
+                   the motor torques (e.g. of the differential drive), 
+                   identity by default.
+    :param nGrid: Number of path segments on which the constraints are 
+                  evaluated.
+    :return trajTheta: The trajectory in joint space, sampled every dt,
+                       ending at rest in the last configuration of path.
+    :return trajVel: The joint velocities during the trajectory.
+    :return trajAcc: The joint accelerations during the trajectory.
+
+    Example input:
+    path = np.array([[0,0,0,0,0], [0.2*np.pi for i in range(5)]])
+    vLim = 0.25*np.pi
+    aLim = 0.5*np.pi
+    dt = 0.2
+    Output (trajTheta):
+    [[0.      0.      0.      0.      0.     ]
+    [0.03142 0.03142 0.03142 0.03142 0.03142]
+    [0.12566 0.12566 0.12566 0.12566 0.12566]
+    [0.27488 0.27488 0.27488 0.27488 0.27488]
+    [0.43195 0.43195 0.43195 0.43195 0.43195]
+    [0.55762 0.55762 0.55762 0.55762 0.55762]
+    [0.62046 0.62046 0.62046 0.62046 0.62046]
+    [0.62832 0.62832 0.62832 0.62832 0.62832]]
+    NOTE: The limits are enforced on the grid points. In between, 
+    curved paths can exceed them slightly, less so for a larger nGrid.
+    """
+    path = np.atleast_2d(np.asarray(path, dtype=float))
+    N, n = path.shape
+    vLim = np.broadcast_to(np.asarray(vLim, dtype=float), (n,))
+    aLim = np.broadcast_to(np.asarray(aLim, dtype=float), (n,))
+    #Path & its derivatives w.r.t. s on the grid
+    sPath = np.linspace(0, 1, N)
+    dPath = np.gradient(path, sPath, axis=0)
+    ddPath = np.gradient(dPath, sPath, axis=0)
+    s = np.linspace(0, 1, nGrid+1)
+    Interp = lambda arr, sVal: np.stack([np.interp(sVal, sPath, arr[:,j]) 
+                                         for j in range(n)], axis=1)
+    q, dq, ddq = Interp(path, s), Interp(dPath, s), Interp(ddPath, s)
+    if np.allclose(dq, 0):
+        return path[-1:].copy(), np.zeros((1,n)), np.zeros((1,n))
+    #Constraints lo <= P*u + Q*x <= hi on each grid point
+    P, Q = dq, ddq
+    lo, hi = -np.broadcast_to(aLim, dq.shape), np.broadcast_to(aLim, dq.shape)
+    if tauLim is not None:
+        if tauMap is None:
+            tauMap = np.eye(n)
+        FTip = np.zeros(6)
+        c = FeedForwardBatch(robot, q, np.zeros_like(q), np.zeros_like(q), 
+                             g, FTip)
+        a = FeedForwardBatch(robot, q, np.zeros_like(q), dq, g, FTip) - c
+        b = FeedForwardBatch(robot, q, dq, ddq, g, FTip) - c
+        tauLim = np.broadcast_to(np.asarray(tauLim, dtype=float), (n,))
+        P = np.hstack((P, a @ tauMap.T))
+        Q = np.hstack((Q, b @ tauMap.T))
+        lo = np.hstack((lo, -tauLim - c @ tauMap.T))
+        hi = np.hstack((hi, tauLim - c @ tauMap.T))
+    with np.errstate(divide='ignore'):
+        xMax = np.min(vLim**2/dq**2, axis=1)
+    xMax = np.minimum(xMax, 1e8) #Bounded, for the vertex enumeration
+    ds = np.diff(s)
+    #Backward pass: Controllable sets [xLo, xHi] of each grid point
+    xLo, xHi = np.zeros(nGrid+1), np.zeros(nGrid+1)
+    for i in range(nGrid-1, -1, -1):
+        G = np.vstack((np.stack((P[i], Q[i]), axis=1),
+                       -np.stack((P[i], Q[i]), axis=1),
+                       [[0, 1], [0, -1], [2*ds[i], 1], [-2*ds[i], -1]]))
+        h = np.concatenate((hi[i], -lo[i], [xMax[i], 0, xHi[i+1], 
+                                             -xLo[i+1]]))
+        xRange = LP2DRange(G, h)
+        if xRange[0] is None:
+            raise ValueError("The path cannot be followed within the " +
+                             "torque limits.")
+        xLo[i], xHi[i] = xRange
+    #Forward pass: Largest feasible path acceleration from rest
+    x = np.zeros(nGrid+1)
+    u = np.zeros(nGrid)
+    for i in range(nGrid):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            uHi = np.where(P[i] > 0, (hi[i] - Q[i]*x[i])/P[i], 
+                           np.where(P[i] < 0, (lo[i] - Q[i]*x[i])/P[i], 
+                                    np.inf))
+        u[i] = min(uHi.min(), (xHi[i+1] - x[i])/(2*ds[i]))
+        x[i+1] = max(x[i] + 2*ds[i]*u[i], 0)
+        if x[i] > xHi[i] + 1e-9 or x[i+1] < xLo[i+1] - 1e-9:
+            raise ValueError("The path cannot be followed from rest " +
+                             "within the torque limits.")
+    x[-1] = 0
+    #Time stamps of the grid points: u is constant within each segment
+    sdot = np.sqrt(x)
+    t = np.concatenate(([0], np.cumsum(2*ds/(sdot[:-1] + sdot[1:]))))
+    u = (x[1:] - x[:-1])/(2*ds)
+    #Sample every dt, the last sample at rest at the end of the path
+    tSample = np.append(np.arange(0, t[-1], dt), t[-1])
+    seg = np.clip(np.searchsorted(t, tSample, side='right') - 1, 0, nGrid-1)
+    tau = tSample - t[seg]
+    sSample = np.clip(s[seg] + sdot[seg]*tau + 0.5*u[seg]*tau**2, 0, 1)
+    sdotSample = np.maximum(sdot[seg] + u[seg]*tau, 0)
+    sdotSample[-1] = 0
+    dqSample, ddqSample = Interp(dPath, sSample), Interp(ddPath, sSample)
+    trajTheta = Interp(path, sSample)
+    trajVel = dqSample*sdotSample[:,None]
+    trajAcc = dqSample*u[seg,None] + ddqSample*sdotSample[:,None]**2
+    trajAcc[-1] = 0
+    return trajTheta, trajVel, trajAcc
+
 def TrajDerivatives(traj: Union[List[np.ndarray], List[List[float]]], 
-                    method: str, robot: Robot, dt: float) \
-                    -> Tuple[np.ndarray]:
+                    method: str, robot: Robot, dt: float, 
+                    timeScaling: int=None) -> Tuple[np.ndarray]:
     """Calculates the time derivatives of a sequential list of 
     configurations.
     :param traj: List of sequential configurations in either the joint- 
@@ -184,6 +398,12 @@ def TrajDerivatives(traj: Union[List[np.ndarray], List[List[float]]],
                    over time. Either 'joint', 'screw', or 'cartesian'.
     :param robot: Robot class object describing the robot in question.
     :param dt: Time between each configuration.
+    :param timeScaling: Order of the time scaling of TrajGen with which
+                        traj was made (3 or 5). If given, the 
+                        derivatives are analytic: Those of the time 
+                        scaling polynomial, mapped to the joints by the
+                        space Jacobian for SE(3) trajectories. Otherwise
+                        they are forward finite differences.
     :return trajTheta: The trajectory in joint space.
     :return trajVel: The joint velocities during the trajectory.
     :return trajAcc: The join accelerations during the trajectory.
@@ -222,8 +442,10 @@ def TrajDerivatives(traj: Union[List[np.ndarray], List[List[float]]],
         # the space frame at the home configuration of the robot.
         lims = [robot.joints[i].lims for i in range(len(robot.joints))]
         for i in range(len(traj)): 
+            #Stay on the IK branch of the previous sample
             trajTheta[i], success = IKSpace(robot.TllList[-1], traj[i], 
-            robot.screwAxes, lims, eRad=0.03, eLin=0.03)
+            robot.screwAxes, lims, eRad=0.03, eLin=0.03, 
+            thetaRef=trajTheta[i-1] if i > 0 else None)
             if not success:
                 """A straight path in end-effector space might move 
                 through configurations that fall outside of the 
@@ -232,10 +454,45 @@ def TrajDerivatives(traj: Union[List[np.ndarray], List[List[float]]],
                 raise IKAlgorithmError()
     else:
         trajTheta = traj
-    #Discrete differentiation
-    for i in range(len(trajTheta)-1):
-        trajVel[i] = (trajTheta[i+1] - trajTheta[i])/dt
-        trajAcc[i] = (trajVel[i+1] - trajVel[i])/dt 
+    if timeScaling is None or len(traj) < 2:
+        #Discrete differentiation
+        trajVel[:-1] = np.diff(trajTheta, axis=0)/dt
+        trajAcc[:-1] = np.diff(trajVel, axis=0)/dt
+        return trajTheta, trajVel, trajAcc
+    #The configurations are played back every dt
+    N = len(traj)
+    s, sDot, sDDot = TimeScaling(dt*np.arange(N), dt*(N-1), timeScaling)
+    if method == "joint" or method == "Joint":
+        delta = trajTheta[-1] - trajTheta[0]
+        return trajTheta, sDot[:,None]*delta, sDDot[:,None]*delta
+    #Body twist of the straight line & its derivative
+    TN = np.array(traj, dtype=float)
+    if method == "screw" or method == "Screw":
+        S = mr.se3ToVec(mr.MatrixLog6(np.dot(mr.TransInv(TN[0]), TN[-1])))
+        Vb = sDot[:,None]*S
+        dVb = sDDot[:,None]*S
+    else:
+        omg = mr.so3ToVec(mr.MatrixLog3(np.dot(TN[0,0:3,0:3].T, 
+                                                TN[-1,0:3,0:3])))
+        #Displacement in the end-effector frame of each sample
+        pB = np.einsum('kji,j->ki', TN[:,0:3,0:3], TN[-1,0:3,3] - 
+                       TN[0,0:3,3])
+        Vb = np.hstack((sDot[:,None]*omg, sDot[:,None]*pB))
+        dVb = np.hstack((sDDot[:,None]*omg, sDDot[:,None]*pB - 
+                         np.cross(Vb[:,0:3], Vb[:,3:6])))
+    #In the space frame, d/dt(Ad_T*Vb) = Ad_T*dVb as [ad_Vb]Vb = 0
+    AdTN = AdjointBatch(TN)
+    Vs = np.matmul(AdTN, Vb[:,:,None])[:,:,0]
+    dVs = np.matmul(AdTN, dVb[:,:,None])[:,:,0]
+    JsN = JacobianSpaceBatch(robot.screwAxes, trajTheta)
+    JsPinv = np.linalg.pinv(JsN)
+    trajVel = np.matmul(JsPinv, Vs[:,:,None])[:,:,0]
+    #dJs/dt*dtheta: Column i changes with [ad_(Js_j*dtheta_j)]Js_i, j<i
+    JsVel = JsN*trajVel[:,None,:]
+    VPrev = np.cumsum(JsVel, axis=2) - JsVel
+    dJsVel = sum(SmallAdBatch(VPrev[:,:,i], JsVel[:,:,i]) for i in 
+                 range(JsN.shape[2]))
+    trajAcc = np.matmul(JsPinv, (dVs - dJsVel)[:,:,None])[:,:,0]
     return trajTheta, trajVel, trajAcc
 
 if __name__ == "__main__":
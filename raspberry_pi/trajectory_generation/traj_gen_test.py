@@ -8,7 +8,11 @@ parent = os.path.dirname(current)
 sys.path.append(parent)
 
 import numpy as np
-from traj_gen import TrajGen, TrajDerivatives, JointTrajLims
+from traj_gen import TrajGen, TrajDerivatives, JointTrajLims, TOPP, \
+                     MotorTauLims, TimeScaling
+from dynamics.dynamics_funcs import FeedForwardBatch
+from kinematics.kinematic_funcs import FKSpaceBatch, JacobianSpaceBatch
+import modern_robotics as mr
 from classes import IKAlgorithmError
 from robot_init import robot
 
@@ -157,4 +161,85 @@ def test_TrajDerIKUnreachable():
         trajTheta, trajV, trajA = TrajDerivatives(traj, 'cartesian', robot, dt)
         assert False
     except IKAlgorithmError as e:
-        assert True
\ No newline at end of file
+        assert True
+
+def test_TrajDerFiniteDiff():
+    """Accelerations are differences of the computed velocities."""
+    traj = TrajGen(robot, np.array(sConfigJoint), np.array(fConfigJoint), 
+                   vMax, omgMax, dt, 'joint')
+    trajTheta, trajV, trajA = TrajDerivatives(traj, 'joint', robot, dt)
+    assert np.allclose(trajA[:-1], np.diff(trajV, axis=0)/dt)
+
+def test_TrajDerAnalytic():
+    """Derivatives of the time scaling, played back every dt."""
+    for timeScaling in [3, 5]:
+        traj = TrajGen(robot, np.array(sConfigJoint), np.array(fConfigJoint),
+                       vMax, omgMax, dt, 'joint', timeScaling)
+        trajTheta, trajV, trajA = TrajDerivatives(traj, 'joint', robot, dt,
+                                                  timeScaling)
+        assert np.all(trajTheta == traj)
+        assert np.allclose(trajV[1:-1], (traj[2:] - traj[:-2])/(2*dt), 
+                           atol=1e-3)
+        assert np.allclose(trajA[1:-1], (trajV[2:] - trajV[:-2])/(2*dt), 
+                           atol=1e-3)
+    assert np.all(trajV[[0,-1]] == 0) and np.all(trajA[[0,-1]] == 0)
+    s, sDot, sDDot = TimeScaling(np.linspace(0, 2, 5), 2)
+    assert np.allclose(s, [0, 0.103515625, 0.5, 0.896484375, 1])
+    assert np.isclose(sDot[2], 1.875/2)
+
+def test_TrajDerAnalyticScrew():
+    """Joint velocities reproduce the twist of the screw motion."""
+    model = robot.Compile()
+    TStart, TEnd = [FKSpaceBatch(robot, [theta])[0] for theta in 
+                    ([0.2, 0.3, 0.4, -0.3, 0.2], [0.6, 0.1, 0.7, -0.5, 0.6])]
+    for T in [TStart, TEnd]: #Orthonormal, as mr.TestIfSE3 requires
+        U, _, VT = np.linalg.svd(T[0:3,0:3])
+        T[0:3,0:3] = np.dot(U, VT)
+    traj = np.array(TrajGen(robot, TStart, TEnd, 0.1, omgMax, dt, 'screw'))
+    trajTheta, trajV, trajA = TrajDerivatives(traj, 'screw', robot, dt, 5)
+    VFD = np.array([mr.se3ToVec(mr.MatrixLog6(np.dot(traj[k+1], 
+                    mr.TransInv(traj[k-1]))))/(2*dt) for k in 
+                    range(1, len(traj)-1)])
+    Js = JacobianSpaceBatch(model.screwS, trajTheta[1:-1])
+    assert np.allclose(np.matmul(Js, trajV[1:-1,:,None])[:,:,0], VFD, 
+                       atol=0.02)
+    assert np.allclose(trajA[1:-1], (trajV[2:] - trajV[:-2])/(2*dt), 
+                       atol=0.02)
+
+def test_TOPPTrapezoid():
+    """Straight line: Bang-coast-bang of the slowest joint."""
+    path = np.array([sConfigJoint, fConfigJoint])
+    vLim = 0.5
+    aLim = 1
+    traj, trajV, trajA = TOPP(robot, path, vLim, aLim, dt=dt)
+    tOpt = 0.5/vLim + vLim/aLim
+    assert abs(dt*(len(traj) - 1) - tOpt) < 2*dt
+    assert np.allclose(traj[0], sConfigJoint)
+    assert np.allclose(traj[-1], fConfigJoint)
+    assert np.all(trajV[-1] == 0) and np.all(trajV[0] == 0)
+    assert np.all(np.abs(trajV) <= vLim + 1e-9)
+    assert np.all(np.abs(trajA) <= aLim + 1e-9)
+    #The derivatives are those of the sampled positions
+    assert np.allclose((traj[1:] - traj[:-1])/dt, 
+                       (trajV[1:] + trajV[:-1])/2, atol=1e-2)
+
+def test_TOPPTorque():
+    """Torque limits slow down the motion, and are respected."""
+    path = np.array([[0, 0.3, 0.2, 0, 0], [0.5, -0.4, 0.6, 0.3, -0.5]])
+    g = np.array([0,0,-9.81])
+    traj = TOPP(robot, path, 2, 200, dt=dt)[0]
+    tauLim = np.full(5, 0.8)
+    trajT, trajTV, trajTA = TOPP(robot, path, 2, 200, tauLim, dt, g)
+    tau = FeedForwardBatch(robot, trajT, trajTV, trajTA, g, np.zeros(6))
+    assert np.all(np.abs(tau) <= tauLim*1.01)
+    assert len(trajT) > len(traj)
+    try:
+        TOPP(robot, path, 2, 20, np.full(5, 0.1), dt, g)
+        assert False
+    except ValueError:
+        assert True
+
+def test_MotorTauLims():
+    tauLim = MotorTauLims(robot, 2, [1/33.78 for i in range(5)])
+    assert np.allclose(tauLim, 255/33.78)
+    assert np.all(MotorTauLims(robot, 2) > tauLim)
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 import modern_robotics as mr
 from typing import List
@@ -66,6 +67,253 @@ def screwsToMatT(screwsT: List[np.ndarray]) -> np.ndarray:
         screwMat = np.hstack((screwMat, screwsT[i].T))
     return screwMat
 
+def RevoluteExp6(screw: np.ndarray, theta: float, out: np.ndarray=None) \
+                 -> np.ndarray:
+    """Computes the matrix exponential of a revolute screw axis 
+    directly from the sine & cosine of theta (Rodrigues' formula, see 
+    Modern Robotics, Chapter 3.3.3), avoiding the generic matrix 
+    exponential of mr.MatrixExp6.
+    :param screw: 6-vector screw axis of a revolute joint. A non-unit
+                  rotational part is normalized, as in mr.MatrixExp6.
+    :param theta: Joint angle in [rad].
+    :param out: Optional preallocated 4x4 array to write the result in.
+    :return T: The SE(3) matrix exp([screw]*theta).
+    NOTE: Only valid for revolute joints, i.e. |omega| != 0!
+
+    Example input:
+    screw = np.array([0,0,1,0,-0.2,0])
+    theta = 0.5*np.pi
+    Output:
+    [[ 0.  -1.   0.   0.2]
+     [ 1.   0.   0.  -0.2]
+     [ 0.   0.   1.   0. ]
+     [ 0.   0.   0.   1. ]]
+    """
+    if out is None:
+        out = np.zeros((4,4))
+    w1, w2, w3, v1, v2, v3 = [float(val) for val in screw]
+    theta = float(theta)
+    wNorm = math.sqrt(w1*w1 + w2*w2 + w3*w3)
+    if wNorm != 1: #Normalize the rotation axis, as mr.MatrixExp6 does
+        w1, w2, w3 = w1/wNorm, w2/wNorm, w3/wNorm
+        v1, v2, v3 = v1/wNorm, v2/wNorm, v3/wNorm
+        theta *= wNorm
+    s = math.sin(theta)
+    c = math.cos(theta)
+    vc = 1 - c
+    #R = I + sin*[w] + (1-cos)*[w]^2, with [w]^2 = ww^T - I
+    out[0,0] = c + vc*w1*w1
+    out[0,1] = vc*w1*w2 - s*w3
+    out[0,2] = vc*w1*w3 + s*w2
+    out[1,0] = vc*w1*w2 + s*w3
+    out[1,1] = c + vc*w2*w2
+    out[1,2] = vc*w2*w3 - s*w1
+    out[2,0] = vc*w1*w3 - s*w2
+    out[2,1] = vc*w2*w3 + s*w1
+    out[2,2] = c + vc*w3*w3
+    #p = (I*theta + (1-cos)*[w] + (theta-sin)*[w]^2)v
+    wv = w1*v1 + w2*v2 + w3*v3
+    ts = theta - s
+    out[0,3] = theta*v1 + vc*(w2*v3 - w3*v2) + ts*(w1*wv - v1)
+    out[1,3] = theta*v2 + vc*(w3*v1 - w1*v3) + ts*(w2*wv - v2)
+    out[2,3] = theta*v3 + vc*(w1*v2 - w2*v1) + ts*(w3*wv - v3)
+    out[3,0] = 0
+    out[3,1] = 0
+    out[3,2] = 0
+    out[3,3] = 1
+    return out
+
+def AdjointInto(T: np.ndarray, out: np.ndarray=None) -> np.ndarray:
+    """Computes the 6x6 adjoint representation of an SE(3) matrix, 
+    equal to mr.Adjoint, but written into a preallocated array.
+    :param T: 4x4 SE(3) transformation matrix.
+    :param out: Optional preallocated 6x6 array to write the result in.
+    :return AdT: The 6x6 adjoint representation [AdT] of T.
+    
+    Example input:
+    T = np.array([[1,0,0,0],
+                  [0,0,-1,0],
+                  [0,1,0,3],
+                  [0,0,0,1]])
+    Output:
+    [[ 1.  0.  0.  0.  0.  0.]
+     [ 0.  0. -1.  0.  0.  0.]
+     [ 0.  1.  0.  0.  0.  0.]
+     [ 0.  0.  3.  1.  0.  0.]
+     [ 3.  0.  0.  0.  0. -1.]
+     [ 0.  0.  0.  0.  1.  0.]]
+    """
+    if out is None:
+        out = np.zeros((6,6))
+    out[0:3,0:3] = T[0:3,0:3]
+    out[3:6,3:6] = T[0:3,0:3]
+    out[0:3,3:6] = 0
+    p1 = T[0,3]
+    p2 = T[1,3]
+    p3 = T[2,3]
+    for j in range(3): #[p]R, column by column
+        r1 = T[0,j]
+        r2 = T[1,j]
+        r3 = T[2,j]
+        out[3,j] = p2*r3 - p3*r2
+        out[4,j] = p3*r1 - p1*r3
+        out[5,j] = p1*r2 - p2*r1
+    return out
+
+def RevoluteExp6Batch(screw: np.ndarray, thetaN: np.ndarray) -> np.ndarray:
+    """Computes the matrix exponentials of a single revolute screw axis
+    for N joint angles at once, without a Python loop over the angles.
+    Vectorized equivalent of RevoluteExp6.
+    :param screw: 6-vector screw axis of a revolute joint. A non-unit
+                  rotational part is normalized, as in mr.MatrixExp6.
+    :param thetaN: Array of N joint angles in [rad].
+    :return expTN: Nx4x4 array of SE(3) matrices exp([screw]*theta).
+
+    Example input:
+    screw = np.array([0,0,1,0,-0.2,0])
+    thetaN = np.array([0, 0.5*np.pi])
+    Output:
+    [[[ 1.   0.   0.   0. ]
+      [ 0.   1.   0.   0. ]
+      [ 0.   0.   1.   0. ]
+      [ 0.   0.   0.   1. ]]
+     [[ 0.  -1.   0.   0.2]
+      [ 1.   0.   0.  -0.2]
+      [ 0.   0.   1.   0. ]
+      [ 0.   0.   0.   1. ]]]
+    """
+    screw = np.asarray(screw, dtype=float).reshape(6)
+    wNorm = np.linalg.norm(screw[0:3])
+    w = screw[0:3]/wNorm
+    v = screw[3:6]/wNorm
+    thetaN = np.asarray(thetaN, dtype=float)*wNorm
+    wMat = mr.VecToso3(w)
+    wMat2 = np.dot(wMat, wMat)
+    s = np.sin(thetaN)[:,None]
+    vc = 1 - np.cos(thetaN)[:,None]
+    expTN = np.zeros((thetaN.size,4,4))
+    expTN[:,0:3,0:3] = np.eye(3) + s[:,:,None]*wMat + vc[:,:,None]*wMat2
+    expTN[:,0:3,3] = thetaN[:,None]*v + vc*np.dot(wMat, v) + \
+                     (thetaN[:,None] - s)*np.dot(wMat2, v)
+    expTN[:,3,3] = 1
+    return expTN
+
+def AdjointBatch(TN: np.ndarray) -> np.ndarray:
+    """Computes the 6x6 adjoint representations of N SE(3) matrices at
+    once. Vectorized equivalent of mr.Adjoint.
+    :param TN: Nx4x4 array of SE(3) transformation matrices.
+    :return AdTN: Nx6x6 array of adjoint representations.
+    
+    Example input:
+    TN = np.array([[[1,0,0,0],
+                    [0,0,-1,0],
+                    [0,1,0,3],
+                    [0,0,0,1]]])
+    Output:
+    [[[ 1.  0.  0.  0.  0.  0.]
+      [ 0.  0. -1.  0.  0.  0.]
+      [ 0.  1.  0.  0.  0.  0.]
+      [ 0.  0.  3.  1.  0.  0.]
+      [ 3.  0.  0.  0.  0. -1.]
+      [ 0.  0.  0.  0.  1.  0.]]]
+    """
+    R = TN[...,0:3,0:3]
+    p = TN[...,0:3,3]
+    AdTN = np.zeros(TN.shape[:-2] + (6,6))
+    AdTN[...,0:3,0:3] = R
+    AdTN[...,3:6,3:6] = R
+    #[p]R, by crossing p with each column of R
+    AdTN[...,3:6,0:3] = np.cross(p[...,:,None], R, axis=-2)
+    return AdTN
+
+def SmallAdInto(V: np.ndarray, x: np.ndarray, out: np.ndarray) \
+                -> np.ndarray:
+    """Computes the Lie bracket [adV]x of two twists, equal to 
+    np.dot(mr.ad(V), x), written into a preallocated array.
+    :param V: 6-vector twist [omega, v].
+    :param x: 6-vector twist.
+    :param out: Preallocated 6-vector to write the result in.
+    :return out: [omega x x_omega, v x x_omega + omega x x_v].
+
+    Example input:
+    V = np.array([0,0,1,1,0,0])
+    x = np.array([1,0,0,0,1,0])
+    Output:
+    [ 0.  1.  0. -1.  0.  0.]
+    """
+    w1, w2, w3, v1, v2, v3 = V[0], V[1], V[2], V[3], V[4], V[5]
+    a1, a2, a3, b1, b2, b3 = x[0], x[1], x[2], x[3], x[4], x[5]
+    out[0] = w2*a3 - w3*a2
+    out[1] = w3*a1 - w1*a3
+    out[2] = w1*a2 - w2*a1
+    out[3] = v2*a3 - v3*a2 + w2*b3 - w3*b2
+    out[4] = v3*a1 - v1*a3 + w3*b1 - w1*b3
+    out[5] = v1*a2 - v2*a1 + w1*b2 - w2*b1
+    return out
+
+def SmallAdTransInto(V: np.ndarray, F: np.ndarray, out: np.ndarray) \
+                     -> np.ndarray:
+    """Computes [adV]^T F for a twist V and wrench F, equal to 
+    np.dot(mr.ad(V).T, F), written into a preallocated array.
+    :param V: 6-vector twist [omega, v].
+    :param F: 6-vector wrench [m, f].
+    :param out: Preallocated 6-vector to write the result in.
+    :return out: [m x omega + f x v, f x omega].
+
+    Example input:
+    V = np.array([0,0,1,1,0,0])
+    F = np.array([1,0,0,0,1,0])
+    Output:
+    [ 0. -1. -1.  1.  0.  0.]
+    """
+    w1, w2, w3, v1, v2, v3 = V[0], V[1], V[2], V[3], V[4], V[5]
+    m1, m2, m3, f1, f2, f3 = F[0], F[1], F[2], F[3], F[4], F[5]
+    out[0] = m2*w3 - m3*w2 + f2*v3 - f3*v2
+    out[1] = m3*w1 - m1*w3 + f3*v1 - f1*v3
+    out[2] = m1*w2 - m2*w1 + f1*v2 - f2*v1
+    out[3] = f2*w3 - f3*w2
+    out[4] = f3*w1 - f1*w3
+    out[5] = f1*w2 - f2*w1
+    return out
+
+def SmallAdBatch(VN: np.ndarray, xN: np.ndarray) -> np.ndarray:
+    """Stacked version of SmallAdInto: Computes [adV]x for N pairs of 
+    twists.
+    :param VN: Nx6 array of twists [omega, v].
+    :param xN: Nx6 array of twists.
+    :return adVx: Nx6 array, row k being np.dot(mr.ad(VN[k]), xN[k]).
+
+    Example input:
+    VN = np.array([[0,0,1,1,0,0]])
+    xN = np.array([[1,0,0,0,1,0]])
+    Output:
+    [[ 0.  1.  0. -1.  0.  0.]]
+    """
+    adVx = np.empty(np.broadcast(VN, xN).shape)
+    adVx[...,0:3] = np.cross(VN[...,0:3], xN[...,0:3])
+    adVx[...,3:6] = np.cross(VN[...,3:6], xN[...,0:3]) + \
+                    np.cross(VN[...,0:3], xN[...,3:6])
+    return adVx
+
+def SmallAdTransBatch(VN: np.ndarray, FN: np.ndarray) -> np.ndarray:
+    """Stacked version of SmallAdTransInto: Computes [adV]^T F for N 
+    twist-wrench pairs.
+    :param VN: Nx6 array of twists [omega, v].
+    :param FN: Nx6 array of wrenches [m, f].
+    :return adTF: Nx6 array, row k being np.dot(mr.ad(VN[k]).T, FN[k]).
+
+    Example input:
+    VN = np.array([[0,0,1,1,0,0]])
+    FN = np.array([[1,0,0,0,1,0]])
+    Output:
+    [[ 0. -1. -1.  1.  0.  0.]]
+    """
+    adTF = np.empty(np.broadcast(VN, FN).shape)
+    adTF[...,0:3] = np.cross(FN[...,0:3], VN[...,0:3]) + \
+                    np.cross(FN[...,3:6], VN[...,3:6])
+    adTF[...,3:6] = np.cross(FN[...,3:6], VN[...,0:3])
+    return adTF
+
 def RToEuler(R: np.ndarray):
     """Calculates one solution of Euler angles related to a SO(3)
     rotation matrix.
@@ -223,34 +471,63 @@ def Curr2MSpeed(currMotor: float) -> float:
     mSpeed = currMotor *linFactor
     return mSpeed
 
-def LimDamping(theta: np.ndarray, val: np.ndarray, 
-               limList: List[List[float]], k: float=10) -> np.ndarray:
-    """Ensures joint velocities are damped when coming close to / crossing"""
-    n = len(limList)
-    valNew = val.copy()
-    for i in range(n):
-        overshot = False
-        damping = 1
-        if abs(theta[i] - limList[i][0]) < \
-        abs(theta[i] - limList[i][1]):
-            limClose = limList[i][0]
-            toLim = val[i] < 0
-            if theta[i] < limClose:
-                overshot = True
-        else:
-            limClose = limList[i][1]
-            toLim = val[i] > 0
-            if theta[i] > limClose:
-                overshot = True
-        if toLim:
-            if overshot:
-                damping = 0
-            else:
-                damping = abs(np.arctan(k*(theta[i]-limClose)))/(0.5*np.pi)
-        valNew[i] *= damping
-    return valNew
+def MSpeed2Curr(mSpeed: float) -> float:
+    """Inverse of Curr2MSpeed: Converts a PWM motor speed command to the
+    resulting current.
+    :param mSpeed: PWM value.
+    :return currMotor: Current in [A].
+    """
+    return mSpeed/Curr2MSpeed(1)
 
+def Curr2Tau(currMotor: float, gRatio: float, km: float) -> float:
+    """Inverse of Tau2Curr (without current limit): Computes the output 
+    torque resulting from a motor current.
+    :param currMotor: Motor current in [A].
+    :param gRatio: Gearbox ratio (>1).
+    :param km: Motor constant in [Nm/A].
+    :return tau: Output torque in [Nm].
+    """
+    return currMotor*km*gRatio
 
+def LimDamping(theta: np.ndarray, val: np.ndarray, 
+               limList: np.ndarray, k: float=10) -> np.ndarray:
+    """Ensures joint velocities (or PWM / torques) are damped when coming 
+    close to / crossing a joint limit. Only values driving the joint 
+    towards its nearest limit are damped, with a factor of 
+    |arctan(k*(distance to limit))|/(pi/2), and set to zero once the 
+    limit is crossed. Works on single configurations as well as on 
+    (N,n) batches of them, e.g. a full trajectory.
+    :param theta: Joint angles, shape (n,) or (N,n).
+    :param val: Values to damp, same shape as theta (list or array).
+    :param limList: Lower & upper limit of each joint, shape (n,2), 
+                    preferably the preconverted robot.Compile().limList.
+                    Infinite limits are allowed.
+    :param k: Steepness of the damping near the limits.
+    :return valNew: New float array with the damped values.
+    
+    Example input:
+    theta = np.array([0.9*np.pi, 0])
+    val = [1, 1]
+    limList = np.array([[-np.pi, np.pi], [-np.inf, np.inf]])
+    k = 10
+    Output:
+    np.array([0.80, 1.])
+    """
+    theta = np.asarray(theta, dtype=float)
+    lims = np.asarray(limList, dtype=float)
+    lower = lims[:,0]
+    upper = lims[:,1]
+    #Nearest limit, the upper one on a tie
+    closeLow = np.abs(theta - lower) < np.abs(theta - upper)
+    dist = theta - np.where(closeLow, lower, upper)
+    valNew = np.array(val, dtype=float)
+    toLim = np.where(closeLow, valNew < 0, valNew > 0)
+    overshot = np.where(closeLow, dist < 0, dist > 0)
+    #arctan saturates for infinite distances, no inf/nan involved
+    damping = np.abs(np.arctan(k*dist))*(2/np.pi)
+    damping[overshot] = 0
+    valNew *= np.where(toLim, damping, 1)
+    return valNew
 
 
 def saveToCSV(dataMat: np.ndarray, csvTitle: str, headers: str=None, 